@@ -0,0 +1,242 @@
+"""生成、分析、报告与可视化各阶段的规模基准测试
+
+每个 (阶段, 规模) 在独立子进程中运行, 数据准备一次后将计时段重复 --repeats 次,
+记录墙钟时间的中位数 (seconds, 用于与基线比较)、最短时间和计时段内的内存增量
+(stage_rss_mb = 各次计时段的峰值 - 数据准备后的常驻内存), 结果写为JSON (默认写入系统临时目录)
+并与保存的基线比较, 任一阶段超出阈值时以非零状态退出。全部数据本地合成, 无需联网。
+单次计时受首次调用的懒加载导入和系统噪声影响, 偶发的过快或过慢都不会改变中位数。
+
+    python benchmarks/run_benchmarks.py                      # 10K / 1M / 10M
+    python benchmarks/run_benchmarks.py --sizes 10000 --stages analyze_all_metrics --repeats 7
+    python benchmarks/run_benchmarks.py --update-baseline
+"""
+import os
+import sys
+import json
+import time
+import platform
+import statistics
+import resource
+import tempfile
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+DEFAULT_SIZES = [10000, 1000000, 10000000]
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_PATH = os.path.join(tempfile.gettempdir(), "abtest-benchmark-results.json")
+
+# 相对基线允许的增幅; 低于绝对下限的差异视为计时噪声
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_REPEATS = 5
+MIN_SECONDS_DELTA = 0.05
+MIN_MEMORY_DELTA_MB = 16
+
+def _proc_status_mb(field):
+    """/proc/self/status 中的内存字段 (MB); 非Linux平台返回 None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _peak_rss_mb():
+    """当前进程的内存高水位; 优先取 VmHWM (可重置), 否则取 ru_maxrss (Linux 上单位为KB)"""
+    peak = _proc_status_mb("VmHWM")
+    return peak if peak is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _reset_peak_rss():
+    """将内存高水位重置为当前常驻内存 (Linux 4.0+), 使峰值只反映之后的计时段"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def make_users(n, seed=0):
+    """合成用户级实验数据"""
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    treatment = rng.random(n) < 0.5
+    return pd.DataFrame({
+        "user_id": np.arange(n),
+        "group": np.where(treatment, "treatment", "control"),
+        "converted_user": rng.random(n) < np.where(treatment, 0.115, 0.10),
+        "avg_order_value": rng.lognormal(4 + 0.02 * treatment, 0.8, n),
+        "bounce_rate": rng.random(n),
+        "is_chronic": rng.random(n) < 0.3,
+        "adherence": np.clip(rng.normal(0.7 + 0.01 * treatment, 0.1, n), 0, 1)
+    })
+
+def make_metrics(n, seed=0, n_days=14):
+    """合成指标数据, 每行一个用户日"""
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    treatment = rng.random(n) < 0.5
+    conversions = rng.random(n) < np.where(treatment, 0.115, 0.10)
+    return pd.DataFrame({
+        "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, n_days, n), unit="D"),
+        "group": np.where(treatment, "treatment", "control"),
+        "conversions": conversions.astype(np.int64),
+        "conversion_rate": conversions.astype(np.float64),
+        "total_revenue": conversions * rng.lognormal(4, 0.8, n)
+    })
+
+def bench_generate_transactions(n):
+    from data_generator import generate_patients, generate_transactions
+    patients = generate_patients(n, seed=0, include_pii=False)
+    return lambda: generate_transactions(patients, seed=0)
+
+def bench_analyze_all_metrics(n):
+    from statistical_analysis import StatisticalAnalyzer
+    users = make_users(n)
+    return lambda: StatisticalAnalyzer(None, users).analyze_all_metrics()
+
+def bench_generate_report_dataframe(n):
+    import business_report
+    from statistical_analysis import StatisticalAnalyzer
+    from business_report import BusinessReportGenerator
+    from config import AB_TEST_CONFIG
+    results = StatisticalAnalyzer(None, make_users(n)).analyze_all_metrics()
+    metrics = make_metrics(n)
+
+    def run():
+        # 重复计时时每次都重新构建报告, 不命中进程内缓存
+        business_report._REPORT_CACHE.clear()
+        return BusinessReportGenerator(metrics, results, AB_TEST_CONFIG).generate_report_dataframe()
+    return run
+
+def bench_render_charts(n):
+    from statistical_analysis import StatisticalAnalyzer
+    from visualization import ABTestVisualizer
+    results = StatisticalAnalyzer(None, make_users(n)).analyze_all_metrics()
+    metrics = make_metrics(n)
+    output_dir = tempfile.mkdtemp(prefix="abtest-bench-")
+    return lambda: ABTestVisualizer(metrics, results).render_all(output_dir, timeseries_df=metrics, processes=1)
+
+STAGES = {
+    "generate_transactions": bench_generate_transactions,
+    "analyze_all_metrics": bench_analyze_all_metrics,
+    "generate_report_dataframe": bench_generate_report_dataframe,
+    "render_charts": bench_render_charts
+}
+
+def run_case(stage, n, repeats=DEFAULT_REPEATS):
+    """子进程内执行: 准备数据后只对阶段本身重复计时, 内存增量不含数据准备"""
+    run = STAGES[stage](n)
+    setup_rss = _peak_rss_mb()
+    # 能重置高水位时以准备后的常驻内存为起点; 否则只能以准备阶段的峰值为起点 (可能低估)
+    start_rss = _proc_status_mb("VmRSS") if _reset_peak_rss() else setup_rss
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    peak_rss = _peak_rss_mb()
+    return {"stage": stage, "size": n, "seconds": round(statistics.median(times), 4),
+            "min_seconds": round(min(times), 4), "repeats": repeats,
+            "setup_rss_mb": round(setup_rss, 1), "peak_rss_mb": round(peak_rss, 1),
+            "stage_rss_mb": round(max(peak_rss - start_rss, 0.0), 1)}
+
+def spawn_case(stage, n, repeats=DEFAULT_REPEATS, timeout=None):
+    """在独立子进程中运行一个用例, 保证峰值内存互不影响"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", stage, str(n), "--repeats", str(repeats)]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, cwd=ROOT_DIR)
+    except subprocess.TimeoutExpired:
+        return {"stage": stage, "size": n, "error": f"timeout after {timeout}s"}
+    if proc.returncode != 0:
+        # 被OOM终止等情况只记录错误, 不中断整个套件
+        tail = (proc.stderr.strip().splitlines() or [f"exit code {proc.returncode}"])[-1]
+        return {"stage": stage, "size": n, "error": tail}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def case_key(result):
+    return f"{result['stage']}@{result['size']}"
+
+def compare(results, baseline, threshold):
+    """与基线比较, 返回回归列表"""
+    regressions = []
+    for result in results:
+        base = baseline.get(case_key(result))
+        if base is None or "error" in result or "error" in base:
+            continue
+        for field, floor in [("seconds", MIN_SECONDS_DELTA), ("stage_rss_mb", MIN_MEMORY_DELTA_MB)]:
+            if field not in base:
+                continue
+            current, previous = result[field], base[field]
+            if current > previous * (1 + threshold) and current - previous > floor:
+                change = f" (+{current / previous - 1:.0%})" if previous else ""
+                regressions.append(f"{case_key(result)} {field}: {previous} -> {current}{change}")
+    return regressions
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="A/B测试框架规模基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--output", default=RESULTS_PATH, help="结果JSON路径")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线JSON路径")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="相对基线允许的增幅, 如 0.25 表示 25%%")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS,
+                        help="每个用例的计时次数, 以中位数与基线比较")
+    parser.add_argument("--timeout", type=float, help="单个用例的超时秒数")
+    parser.add_argument("--child", nargs=2, metavar=("STAGE", "SIZE"), help=argparse.SUPPRESS)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.child:
+        print(json.dumps(run_case(args.child[0], int(args.child[1]), args.repeats)))
+        return 0
+
+    results = []
+    for n in args.sizes:
+        for stage in args.stages:
+            result = spawn_case(stage, n, args.repeats, args.timeout)
+            results.append(result)
+            if "error" in result:
+                print(f"{case_key(result):<36} ERROR {result['error']}")
+            else:
+                print(f"{case_key(result):<36} {result['seconds']:>9.3f}s "
+                      f"(min {result['min_seconds']:.3f}s) {result['stage_rss_mb']:>9.1f}MB")
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = {case_key(r): r for r in json.load(f)["results"]}
+
+    if args.update_baseline:
+        baseline.update({case_key(r): r for r in results if "error" not in r})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({**report, "results": sorted(baseline.values(), key=lambda r: (r["size"], r["stage"]))},
+                      f, indent=2)
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,5 @@
+from datetime import date
+
 # A/B测试参数配置
 AB_TEST_CONFIG = {
     "experiment_name": "处方药详情页改版",
@@ -22,3 +24,52 @@ MEDICAL_METRICS = {
     "medication_adherence": "用药依从性",
     "repurchase_rate_chronic": "慢病复购率"
 }
+
+# 模拟数据生成参数
+DATA_GENERATION = {
+    "num_patients": 10000,
+    "seed": 42,  # 随机种子, 保证数据可复现
+    "batch_size": 100000,  # 流式生成时每批患者数
+    "storage_format": "parquet",  # 输出格式: parquet / csv
+    "pii_pool_size": 5000,  # 预生成的姓名/电话/地址池大小
+    "start_date": date(2023, 1, 1),
+    "end_date": date(2023, 12, 31),
+    "disease_types": ["Diabetes", "Hypertension", "Asthma", "Hyperlipidemia", "Depression"],
+    "drug_categories": {
+        "Diabetes": ["Insulin", "Metformin", "Glipizide"],
+        "Hypertension": ["Amlodipine", "Lisinopril", "Losartan"],
+        "Asthma": ["Inhalers", "Montelukast"],
+        "Hyperlipidemia": ["Atorvastatin", "Rosuvastatin"],
+        "Depression": ["Sertraline", "Fluoxetine", "Escitalopram"]
+    },
+    "adherence_factors": {
+        "age_effect": 0.3,  # 每增加1岁依从率变化(百分点)
+        "disease_effect": {
+            "Diabetes": 0.05,
+            "Hypertension": 0.03,
+            "Asthma": -0.05,
+            "Hyperlipidemia": 0.0,
+            "Depression": -0.1
+        }
+    }
+}
+
+# 功效分析与样本量规划参数
+POWER_ANALYSIS = {
+    "baseline_rate": 0.10,  # 对照组基线转化率
+    "daily_users": 2000,  # 每日进入实验的用户数 (两组合计)
+    "target_power": 0.8,  # 目标统计功效
+    "n_sims": 2000,  # 每个情景的模拟实验次数
+    "variance_reduction": 0.0,  # CUPED等协变量调整的方差缩减比例 (取自 analyze_all_metrics 的 variance_reduction 列)
+    "effect_multipliers": [0.5, 0.75, 1.0, 1.5, 2.0],  # 相对 expected_effect 的效应网格
+    "durations": [7, 14, 21, 28]  # 测试天数网格
+}
+
+# 分位数草图参数 (对数分桶, 相对误差有界, 可跨分片/跨天合并)
+QUANTILE_SKETCH = {
+    "metrics": ["avg_order_value"],  # 做分位数效应分析的偏态指标
+    "quantiles": [0.5, 0.9],  # 中位数与P90
+    "relative_accuracy": 0.01,  # 分位数估计的相对误差上限
+    "min_value": 1e-3,  # 绝对值小于该值的记为0
+    "n_bins": 2047  # 桶数 (正负各1023个加零桶), uint32计数约8KB; 每侧覆盖最大绝对值以下约2.6万倍的范围
+}
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+from config import DATA_GENERATION
+from tracing import traced
+
+PATIENT_COL = "patient_id"
+DRUG_COL = "drug_name"
+DATE_COL = "transaction_date"
+SUPPLY_COL = "expected_interval_days"
+
+# 缺少处方信息时每次取药默认覆盖的天数
+DEFAULT_SUPPLY_DAYS = 30
+
+# PDC 达到该值视为依从
+ADHERENT_PDC = 0.8
+
+def _day_numbers(dates):
+    """日期转换为自1970-01-01起的整数天数"""
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+def _codes(values, categories=None):
+    """分类编码: 指定 categories 时按其顺序编码 (不在其中的为 -1)"""
+    if categories is not None:
+        return pd.Categorical(values, categories=categories).codes.astype(np.int64), categories
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype(np.int64), values.cat.categories
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes.astype(np.int64), pd.Index(uniques)
+
+def _patient_codes(values, reference=None):
+    """患者ID转换为非负整数编码; 整数ID直接平移, 其他类型因子化"""
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        base = values.min() if reference is None else reference
+        return values.astype(np.int64) - base, base
+    if reference is None:
+        codes, uniques = pd.factorize(values, sort=True)
+        return codes.astype(np.int64), pd.Index(uniques)
+    return reference.get_indexer(values).astype(np.int64), reference
+
+def _group_supply(group_keys, patient_ref, drug_names, prescriptions_df, supply_col, n_drugs):
+    """按 (患者, 药物) 组查找处方的覆盖天数: 处方键排序后二分查找, 不做逐行关联"""
+    if prescriptions_df is None:
+        return np.full(len(group_keys), DEFAULT_SUPPLY_DAYS, dtype=np.int64)
+    patient, _ = _patient_codes(prescriptions_df[PATIENT_COL].to_numpy(), patient_ref)
+    drug, _ = _codes(prescriptions_df[DRUG_COL], drug_names)
+    valid = (patient >= 0) & (drug >= 0)
+    keys = patient[valid] * n_drugs + drug[valid]
+    supply = prescriptions_df[supply_col].to_numpy(dtype=np.float64)[valid]
+    order = np.argsort(keys, kind="stable")
+    keys, supply = keys[order], supply[order]
+
+    position = np.clip(np.searchsorted(keys, group_keys), 0, max(len(keys) - 1, 0))
+    found = (keys[position] == group_keys) if len(keys) else np.zeros(len(group_keys), dtype=bool)
+    result = np.where(found, supply[position] if len(keys) else 0, np.nan)
+    return np.where(np.isnan(result), DEFAULT_SUPPLY_DAYS, result).astype(np.int64)
+
+@traced()
+def compute_pdc(transactions_df, prescriptions_df=None, period_start=None, period_end=None, supply_col=SUPPLY_COL):
+    """按患者×药物计算覆盖天数比例 (PDC) 与取药间隔缺口
+
+    (患者, 药物, 日期) 组合成一个整数键后一次排序, 不逐患者循环。提前取药时剩余药量顺延 (carry-forward):
+    第i次取药的覆盖结束日 end_i = S_i + max_{j<=i}(date_j - S_{j-1}), S为组内累计供药天数,
+    组内前缀最大值通过给每组加上互不重叠的偏移量后一次 np.maximum.accumulate 得到。
+    覆盖天数取交易表的 supply_col 列, 没有时按 (患者, 药物) 查找处方表的 expected_interval_days。
+    观察期为首次取药日至 period_end (默认 DATA_GENERATION["end_date"], 含当日)。
+    """
+    period_end = DATA_GENERATION["end_date"] if period_end is None else period_end
+    window_end = _day_numbers([period_end])[0] + 1
+    day = _day_numbers(transactions_df[DATE_COL])
+    keep = (day < window_end) & transactions_df[DRUG_COL].notna().to_numpy()
+    if period_start is not None:
+        keep &= day >= _day_numbers([period_start])[0]
+    if not keep.all():
+        transactions_df = transactions_df[keep]
+        day = day[keep]
+
+    n = len(day)
+    if n == 0:
+        return pd.DataFrame(columns=[PATIENT_COL, DRUG_COL, "n_fills", "first_fill", "covered_days",
+                                     "period_days", "pdc", "max_gap_days", "total_gap_days"])
+
+    patient, patient_ref = _patient_codes(transactions_df[PATIENT_COL].to_numpy())
+    drug, drug_names = _codes(transactions_df[DRUG_COL])
+    n_drugs = max(len(drug_names), 1)
+    first_day = day.min()
+    group_key = patient * n_drugs + drug
+    order = np.argsort(group_key * (day.max() - first_day + 1) + (day - first_day))
+    group_key, day = group_key[order], day[order]
+
+    new_group = np.empty(n, dtype=bool)
+    new_group[0] = True
+    new_group[1:] = group_key[1:] != group_key[:-1]
+    group = np.cumsum(new_group) - 1
+    starts = np.flatnonzero(new_group)
+
+    if supply_col in transactions_df.columns:
+        supply = transactions_df[supply_col].to_numpy(dtype=np.float64)[order]
+        supply = np.where(np.isnan(supply), DEFAULT_SUPPLY_DAYS, supply).astype(np.int64)
+    else:
+        supply = _group_supply(group_key[starts], patient_ref, drug_names, prescriptions_df,
+                               supply_col, n_drugs)[group]
+
+    # 组内累计供药天数 (S_{i-1} 与 S_i)
+    cumulative = np.cumsum(supply)
+    supplied_before = cumulative - supply
+    offset = supplied_before[starts][group]
+    supplied_before -= offset
+    supplied = cumulative - offset
+
+    # 分组前缀最大值: 每组抬高 group * span 后全局累积最大值不会跨组
+    key = day - supplied_before
+    low = key.min()
+    span = key.max() - low + 1
+    lifted = (key - low) + group * span
+    running = np.maximum.accumulate(lifted) - group * span + low
+    end = supplied + running
+    start = end - supply
+
+    covered = np.clip(np.minimum(end, window_end) - start, 0, None)
+    previous_end = np.empty(n, dtype=np.int64)
+    previous_end[0] = 0
+    previous_end[1:] = end[:-1]
+    gap = np.where(new_group, 0, np.maximum(day - previous_end, 0))
+
+    first_fill = day[starts]
+    period_days = window_end - first_fill
+    covered_days = np.add.reduceat(covered, starts)
+    group_patient = group_key[starts] // n_drugs
+    return pd.DataFrame({
+        PATIENT_COL: group_patient + patient_ref if not isinstance(patient_ref, pd.Index)
+        else patient_ref[group_patient].to_numpy(),
+        DRUG_COL: pd.Categorical.from_codes(group_key[starts] % n_drugs, categories=drug_names),
+        "n_fills": np.diff(np.append(starts, n)),
+        "first_fill": first_fill.astype("datetime64[D]"),
+        "covered_days": covered_days,
+        "period_days": period_days,
+        "pdc": np.minimum(covered_days / period_days, 1.0),
+        "max_gap_days": np.maximum.reduceat(gap, starts),
+        "total_gap_days": np.add.reduceat(gap, starts)
+    })
+
+def iter_pdc(chunks, prescriptions_df=None, period_start=None, period_end=None, supply_col=SUPPLY_COL):
+    """分块计算PDC
+
+    chunks 为按患者ID非递减排列的交易数据块 (如生成器批次或按患者分区的文件),
+    每块末尾患者的记录可能延续到下一块, 因此暂存该患者的记录并拼接到下一块,
+    内存只取决于块大小。处方表按患者ID排序一次, 每块只取对应患者区间的处方。
+    """
+    prescription_ids = None
+    if prescriptions_df is not None and prescriptions_df[PATIENT_COL].dtype.kind in "iu":
+        prescriptions_df = prescriptions_df.sort_values(PATIENT_COL, kind="stable")
+        prescription_ids = prescriptions_df[PATIENT_COL].to_numpy()
+
+    def run(ready):
+        prescriptions = prescriptions_df
+        if prescription_ids is not None:
+            ids = ready[PATIENT_COL].to_numpy()
+            lo = np.searchsorted(prescription_ids, ids.min(), side="left")
+            hi = np.searchsorted(prescription_ids, ids.max(), side="right")
+            prescriptions = prescriptions_df.iloc[lo:hi]
+        return compute_pdc(ready, prescriptions, period_start, period_end, supply_col)
+
+    tail = None
+    emitted_through = None
+    for chunk in chunks:
+        if tail is not None and len(tail):
+            chunk = pd.concat([tail, chunk], ignore_index=True)
+        if not len(chunk):
+            continue
+        patients = chunk[PATIENT_COL].to_numpy()
+        if emitted_through is not None and patients.min() <= emitted_through:
+            raise ValueError("Transaction chunks must be ordered by patient_id for chunked PDC")
+        last = patients.max()
+        held = patients == last
+        tail = chunk[held]
+        ready = chunk[~held]
+        if len(ready):
+            emitted_through = patients[~held].max()
+            yield run(ready)
+    if tail is not None and len(tail):
+        yield run(tail)
+
+def patient_adherence(pdc_df):
+    """汇总到患者级: 各药物PDC的均值与最小值、最大取药缺口及是否依从"""
+    grouped = pdc_df.groupby(PATIENT_COL, sort=False)
+    summary = pd.DataFrame({
+        "pdc": grouped["pdc"].mean(),
+        "min_pdc": grouped["pdc"].min(),
+        "max_gap_days": grouped["max_gap_days"].max(),
+        "n_drugs": grouped.size()
+    })
+    summary["adherent"] = summary["pdc"] >= ADHERENT_PDC
+    return summary
+
+def attach_adherence(user_df, adherence_df, user_col="user_id", value_col="pdc", target_col="adherence"):
+    """将患者级PDC写入用户表的 adherence 列, 供 StatisticalAnalyzer 直接分析 (无取药记录的用户为空)"""
+    values = adherence_df[value_col].reindex(user_df[user_col].to_numpy()).to_numpy()
+    return user_df.assign(**{target_col: values})
@@ -0,0 +1,235 @@
+import json
+import asyncio
+import hashlib
+import warnings
+import numpy as np
+import pandas as pd
+from scipy import special
+from config import AB_TEST_CONFIG
+
+GROUPS = ("control", "treatment")
+NUM_BUCKETS = 10000
+
+# SRM 检验的显著性水平; 远严于实验本身的 alpha, 只标记明显的分流异常
+SRM_ALPHA = 0.001
+
+class SampleRatioMismatchWarning(UserWarning):
+    """各组样本量与预期分流比例不符"""
+
+def experiment_seed(experiment_name, salt=""):
+    """由实验名与盐值导出64位哈希种子, 不同实验的分桶相互独立"""
+    digest = hashlib.sha256(f"{experiment_name}:{salt}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+def _mix64(h):
+    """splitmix64 终结函数, 原地在 uint64 数组上运算"""
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94D049BB133111EB)
+    h ^= h >> np.uint64(31)
+    return h
+
+def hash_ids(user_ids, seed):
+    """对一批用户ID计算加盐64位哈希
+
+    整数ID直接在 uint64 上做 splitmix64 混合; 字符串等其他类型先用 pandas 的向量化
+    SipHash (以种子派生的密钥) 映射为64位整数。
+    """
+    values = np.asarray(user_ids)
+    if values.dtype.kind in "iu":
+        h = values.astype(np.uint64)
+    else:
+        key = hashlib.sha256(seed.to_bytes(8, "little")).hexdigest()[:16]
+        h = pd.util.hash_array(values.astype(object), hash_key=key, categorize=False).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        h += np.uint64(seed)
+        return _mix64(h)
+
+def _to_buckets(h, num_buckets):
+    """取哈希高32位按乘法-移位映射到 [0, num_buckets), 避免逐元素取模"""
+    h >>= np.uint64(32)
+    h *= np.uint64(num_buckets)
+    h >>= np.uint64(32)
+    return h.view(np.int64)
+
+def assign_buckets(user_ids, experiment_name=None, salt="", num_buckets=NUM_BUCKETS):
+    """向量化分桶: 返回每个ID所在的桶号 (0 .. num_buckets-1)"""
+    seed = experiment_seed(experiment_name or AB_TEST_CONFIG["experiment_name"], salt)
+    return _to_buckets(hash_ids(user_ids, seed), num_buckets)
+
+class TrafficAssigner:
+    """按实验名加盐哈希的确定性分流; 同一用户在同一实验中总是进入同一组"""
+
+    def __init__(self, config=None, salt="", num_buckets=NUM_BUCKETS):
+        self.config = config or AB_TEST_CONFIG
+        self.experiment_name = self.config["experiment_name"]
+        self.salt = salt
+        self.num_buckets = num_buckets
+        self.seed = experiment_seed(self.experiment_name, salt)
+
+        # traffic_allocation 为实验组占比, 桶号小于阈值的进入实验组
+        self.allocation = self.config["traffic_allocation"]
+        self.threshold = int(round(self.allocation * num_buckets))
+
+    def buckets(self, user_ids):
+        """一批ID的桶号"""
+        return _to_buckets(hash_ids(user_ids, self.seed), self.num_buckets)
+
+    def assign(self, user_ids):
+        """一批ID的分组, 返回分类编码的分组数组"""
+        codes = (self.buckets(user_ids) < self.threshold).view(np.int8)
+        return pd.Categorical.from_codes(codes, categories=list(GROUPS))
+
+    def assign_frame(self, user_df, user_col="user_id", group_col="group"):
+        """为用户表添加分组列"""
+        return user_df.assign(**{group_col: self.assign(user_df[user_col].to_numpy())})
+
+    def lookup(self, user_id):
+        """单个ID的分组 (与批量接口结果一致)"""
+        bucket = int(self.buckets(np.array([user_id]))[0])
+        return {"user_id": user_id, "experiment": self.experiment_name,
+                "group": GROUPS[bucket < self.threshold], "bucket": bucket}
+
+def srm_test(counts, allocation=None):
+    """样本比例失衡的卡方拟合优度检验
+
+    counts 为 {组名: 样本量}, allocation 为实验组占比 (默认取 traffic_allocation)。
+    """
+    allocation = AB_TEST_CONFIG["traffic_allocation"] if allocation is None else allocation
+    expected_share = {"control": 1 - allocation, "treatment": allocation}
+    observed = np.array([counts.get(group, 0) for group in GROUPS], dtype=float)
+    total = observed.sum()
+    expected = np.array([expected_share[group] for group in GROUPS]) * total
+    with np.errstate(divide="ignore", invalid="ignore"):
+        chi2 = float(((observed - expected) ** 2 / expected).sum())
+    pval = float(special.chdtrc(len(GROUPS) - 1, chi2)) if total > 0 else 1.0
+    return {
+        "observed": dict(zip(GROUPS, observed.astype(np.int64).tolist())),
+        "expected": dict(zip(GROUPS, expected.tolist())),
+        "chi2": chi2,
+        "p_value": pval,
+        "mismatch": pval < SRM_ALPHA
+    }
+
+def check_srm(counts, allocation=None, alpha=SRM_ALPHA):
+    """执行SRM检验, 检出失衡时发出 SampleRatioMismatchWarning"""
+    result = srm_test(counts, allocation)
+    result["mismatch"] = result["p_value"] < alpha
+    if result["mismatch"]:
+        warnings.warn(
+            f"Sample ratio mismatch: observed {result['observed']}, expected "
+            f"{ {g: round(v) for g, v in result['expected'].items()} } (p={result['p_value']:.2e}); "
+            "results may be biased", SampleRatioMismatchWarning, stacklevel=2
+        )
+    return result
+
+class AssignmentService:
+    """本地 asyncio 分流查询服务
+
+    协议为按行的JSON: 请求 {"user_id": ...}, 响应 TrafficAssigner.lookup 的结果。
+    同一连接上已到达的多条请求合并为一批做向量化分桶。
+    """
+
+    def __init__(self, assigner=None, host="127.0.0.1", port=0):
+        self.assigner = assigner or TrafficAssigner()
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def _respond(self, lines):
+        """将一批请求行转换为响应行
+
+        按ID的类型分别做向量化分桶: 整数与字符串等混在一个数组里会被统一转换为字符串,
+        桶号随之改变; 分开计算后每个ID的结果都与 TrafficAssigner.lookup 一致。
+        """
+        requests = [json.loads(line) for line in lines]
+        user_ids = [request["user_id"] for request in requests]
+        by_type = {}
+        for position, user_id in enumerate(user_ids):
+            by_type.setdefault(type(user_id), []).append(position)
+        buckets = np.empty(len(user_ids), dtype=np.int64)
+        for positions in by_type.values():
+            buckets[positions] = self.assigner.buckets(np.array([user_ids[i] for i in positions]))
+        return "".join(
+            json.dumps({"user_id": user_id, "experiment": self.assigner.experiment_name,
+                        "group": GROUPS[int(bucket) < self.assigner.threshold], "bucket": int(bucket)},
+                       ensure_ascii=False) + "\n"
+            for user_id, bucket in zip(user_ids, buckets)
+        ).encode("utf-8")
+
+    async def _handle(self, reader, writer):
+        pending = b""
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                # 本次读到的所有完整行作为一批处理, 不完整的尾部留到下次
+                *lines, pending = (pending + data).split(b"\n")
+                lines = [line for line in lines if line.strip()]
+                if lines:
+                    writer.write(self._respond(lines))
+                    await writer.drain()
+        finally:
+            writer.close()
+
+class AssignmentClient:
+    """分流服务的 asyncio 客户端"""
+
+    def __init__(self, host="127.0.0.1", port=None):
+        self.host = host
+        self.port = port
+        self._reader = self._writer = None
+
+    async def __aenter__(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def lookup(self, user_id):
+        return (await self.lookup_many([user_id]))[0]
+
+    async def lookup_many(self, user_ids):
+        """流水线方式发送多条请求后依次读取响应"""
+        self._writer.write("".join(json.dumps({"user_id": u}) + "\n" for u in user_ids).encode("utf-8"))
+        await self._writer.drain()
+        return [json.loads(await self._reader.readline()) for _ in user_ids]
+
+class LocalAssignmentClient:
+    """与 AssignmentClient 接口相同的进程内替身, 用于离线测试和不便启动服务的场景"""
+
+    def __init__(self, assigner=None):
+        self.assigner = assigner or TrafficAssigner()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def lookup(self, user_id):
+        return self.assigner.lookup(user_id)
+
+    async def lookup_many(self, user_ids):
+        return [self.assigner.lookup(user_id) for user_id in user_ids]
@@ -0,0 +1,129 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tracing import pool_map
+
+DEFAULT_MAX_SUPPORT = 4096
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+def _seed_sequence(seed):
+    """统一将整数种子或SeedSequence转换为SeedSequence"""
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+def compress_values(values, max_support=DEFAULT_MAX_SUPPORT, exact_tails=0):
+    """将样本压缩为不超过 max_support 个 (取值, 计数), 并返回箱内离均差平方和
+
+    取值种类不超过 max_support 时(如转化0/1)压缩是精确的; 否则按等频分箱,
+    用箱内均值代表该箱, 箱内方差单独返回以便在重抽样时以正态扰动补回。
+    exact_tails > 0 时两端各保留 exact_tails 个最极端样本的原值, 只对中间部分分箱:
+    偏态指标重抽样分布的偏度主要来自极端值, 全部分箱 (exact_tails=0) 会将其抹平。
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    support, counts = np.unique(values, return_counts=True)
+    if len(support) <= max_support:
+        return support, counts, 0.0
+
+    order = np.sort(values)
+    tail = min(exact_tails, (max_support - 1) // 2)
+    middle = order[tail:len(order) - tail]
+
+    # 等频分箱: 每箱样本数相同, 箱内取均值
+    edges = np.linspace(0, len(middle), max_support - 2 * tail + 1).astype(int)
+    bin_counts = np.diff(edges)
+    means = np.add.reduceat(middle, edges[:-1]) / bin_counts
+    within_ss = np.sum((middle - np.repeat(means, bin_counts)) ** 2)
+    ones = np.ones(tail, dtype=np.int64)
+    return (np.concatenate([order[:tail], means, order[len(order) - tail:]]),
+            np.concatenate([ones, bin_counts, ones]), within_ss)
+
+def _resample_data(values, resampling, max_support):
+    """按重抽样方式准备 (取值, 计数, 箱内离均差平方和)"""
+    if resampling == "auto":
+        return compress_values(values, max_support, exact_tails=max_support // 4)
+    if resampling == "exact":
+        support, counts = np.unique(values, return_counts=True)
+        return support, counts, 0.0
+    if resampling == "binned":
+        return compress_values(values, max_support)
+    if resampling == "poisson":
+        return values, np.ones(len(values), dtype=np.int64), 0.0
+    raise ValueError(f"Unknown bootstrap resampling: {resampling}")
+
+def _poisson_means(support, counts, within_ss, n_boot, seed, memory_budget_mb):
+    """Poisson重抽样: 权重矩阵按支撑集分块与取值做矩阵乘法, 内存受预算约束
+
+    同一取值上 count 个Poisson(1)权重之和服从 Poisson(count), 因此在精确支撑集上抽样
+    与逐行Poisson bootstrap同分布; 分箱时额外叠加箱内方差对应的正态扰动。
+    """
+    rng = np.random.default_rng(seed)
+    chunk = max(1, int(memory_budget_mb * 2**20 // (8 * n_boot)))
+    weighted_sum = np.zeros(n_boot)
+    weight_total = np.zeros(n_boot)
+    for start in range(0, len(support), chunk):
+        x = support[start:start + chunk]
+        weights = rng.poisson(counts[start:start + chunk], size=(n_boot, len(x))).astype(float)
+        weighted_sum += weights @ x
+        weight_total += weights.sum(axis=1)
+    means = weighted_sum / weight_total
+    if within_ss > 0:
+        means += rng.normal(0.0, np.sqrt(within_ss) / counts.sum(), size=n_boot)
+    return means
+
+def _bootstrap_block(args):
+    """进程池入口: 计算一批重抽样均值"""
+    data, n_boot, seed, memory_budget_mb = args
+    return _poisson_means(*data, n_boot, seed, memory_budget_mb)
+
+def bootstrap_means(values, n_boot=10000, seed=None, n_jobs=1, resampling="auto",
+                    max_support=DEFAULT_MAX_SUPPORT, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """返回 n_boot 个重抽样均值, 可将重抽样分散到进程池
+
+    resampling:
+    "auto" (默认) 取值种类不超过 max_support 时与 "exact" 相同; 否则两端各保留 max_support/4 个
+    极端值原值、中间等频分箱, 耗时只与 max_support * n_boot 有关 (默认约每组2秒), 且保留偏度;
+    代价是中间各箱内的离散以正态扰动近似;
+    "exact" 在去重后的精确支撑集上抽样, 与逐行bootstrap同分布, 但连续指标的耗时为 O(n * n_boot);
+    "poisson" 逐行抽样; "binned" 全部等频分箱, 只保留均值与方差, 不保留偏度。
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    data = _resample_data(values, resampling, max_support)
+
+    # 各进程使用独立的子种子, 结果可由 seed 复现
+    n_jobs = n_jobs or os.cpu_count() or 1
+    seeds = _seed_sequence(seed).spawn(n_jobs)
+    sizes = [len(part) for part in np.array_split(np.arange(n_boot), n_jobs)]
+    budget = memory_budget_mb / n_jobs
+    tasks = [(data, size, s, budget) for size, s in zip(sizes, seeds) if size > 0]
+
+    if len(tasks) == 1:
+        return _bootstrap_block(tasks[0])
+    with ProcessPoolExecutor(max_workers=len(tasks)) as pool:
+        return np.concatenate(pool_map(pool, _bootstrap_block, tasks))
+
+def bootstrap_intervals(control, treatment, level=0.95, n_boot=10000, seed=None, n_jobs=1,
+                        resampling="auto", max_support=DEFAULT_MAX_SUPPORT,
+                        memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """各组均值及相对提升的百分位bootstrap置信区间"""
+    seed_control, seed_treatment = _seed_sequence(seed).spawn(2)
+    options = dict(n_boot=n_boot, n_jobs=n_jobs, resampling=resampling,
+                   max_support=max_support, memory_budget_mb=memory_budget_mb)
+    boot_control = bootstrap_means(control, seed=seed_control, **options)
+    boot_treatment = bootstrap_means(treatment, seed=seed_treatment, **options)
+    boot_lift = boot_treatment / boot_control - 1
+
+    tail = (1 - level) / 2 * 100
+    def _interval(point, replicates, key="mean"):
+        lower, upper = np.nanpercentile(replicates, [tail, 100 - tail])
+        return {key: point, "ci_lower": lower, "ci_upper": upper}
+
+    mean_control = np.nanmean(control)
+    mean_treatment = np.nanmean(treatment)
+    return {
+        "control": _interval(mean_control, boot_control),
+        "treatment": _interval(mean_treatment, boot_treatment),
+        "lift": _interval(mean_treatment / mean_control - 1, boot_lift, key="estimate")
+    }
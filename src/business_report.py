@@ -1,19 +1,129 @@
+import os
+import copy
+import json
+import pickle
+import hashlib
+from collections import OrderedDict
+from html import escape
 import pandas as pd
 import numpy as np
 from datetime import datetime
 from config import AB_TEST_CONFIG, MEDICAL_METRICS
+from experiment_frame import ExperimentFrame
+from tracing import traced
+
+# 进程内报告缓存 (LRU), 键为 (输入指纹, 报告类型), 最多保留 REPORT_CACHE_SIZE 份
+REPORT_CACHE_SIZE = 32
+_REPORT_CACHE = OrderedDict()
+
+def _code_version():
+    """本模块源码的摘要, 报告构建逻辑变化后磁盘上的旧缓存不再命中"""
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+_CODE_VERSION = _code_version()
+
+def _json_default(value):
+    """将numpy/pandas标量和时间转换为可JSON序列化的值"""
+    if isinstance(value, (np.integer, np.bool_)):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    return str(value)
+
+def _json_safe(value):
+    """递归地将 NaN/inf (含 np.float64, json 会直接按 float 输出) 替换为 None"""
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    if isinstance(value, (float, np.floating)):
+        return float(value) if np.isfinite(value) else None
+    return value
+
+def _dumps(value):
+    """严格JSON: 非有限浮点数输出为 null"""
+    return json.dumps(_json_safe(value), ensure_ascii=False, default=_json_default, allow_nan=False)
 
 class BusinessReportGenerator:
-    def __init__(self, metrics_df, results_df, test_config):
-        self.metrics_df = metrics_df
+    def __init__(self, metrics_df, results_df, test_config, cache_dir=None):
+        self.metrics_frame = ExperimentFrame.wrap(metrics_df)
+        self.metrics_df = self.metrics_frame.df
         self.results_df = results_df
         self.config = test_config
+        self.cache_dir = cache_dir
+        self._totals = None
+        self._result_rows = None
+        self._fingerprint = None
     
+    def _group_totals(self, group):
+        """各组的行数、转化数和收入合计, 只计算一次"""
+        if self._totals is None:
+            self._totals = {}
+            for g in self.metrics_frame.groups:
+                totals = {"rows": self.metrics_frame.group_size(g)}
+                for col in ["conversions", "total_revenue"]:
+                    if col in self.metrics_df.columns:
+                        totals[col] = self.metrics_frame.group_sum(g, col)
+                self._totals[g] = totals
+        return self._totals.get(group, {"rows": 0, "conversions": 0.0, "total_revenue": 0.0})
+    
+    def _result_for(self, metric):
+        """按指标名查找结果行 (同名时取第一行), 查找表只构建一次"""
+        if self._result_rows is None:
+            self._result_rows = {}
+            for row in self.results_df.to_dict("records"):
+                self._result_rows.setdefault(row["metric"], row)
+        return self._result_rows.get(metric)
+    
+    def fingerprint(self):
+        """输入数据框与配置的内容指纹, 用作报告缓存键"""
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for df in [self.metrics_df, self.results_df]:
+                digest.update(_dumps(list(map(str, df.columns))).encode())
+                digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+            digest.update(json.dumps(self.config, sort_keys=True, ensure_ascii=False, default=str).encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+    
+    def _cached(self, kind, build):
+        """按指纹缓存整份报告; 指定 cache_dir 时同时持久化到磁盘 (文件名含源码版本)"""
+        key = (self.fingerprint(), kind)
+        if key in _REPORT_CACHE:
+            _REPORT_CACHE.move_to_end(key)
+            # 返回副本, 调用方修改结果不会污染缓存
+            return copy.deepcopy(_REPORT_CACHE[key])
+
+        path = None
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, f"{_CODE_VERSION}-{key[0]}-{kind}.pkl")
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                report = pickle.load(f)
+        else:
+            report = build()
+            if path:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    pickle.dump(report, f)
+                os.replace(path + ".tmp", path)
+
+        _REPORT_CACHE[key] = report
+        while len(_REPORT_CACHE) > REPORT_CACHE_SIZE:
+            _REPORT_CACHE.popitem(last=False)
+        return copy.deepcopy(report)
+    
+    @traced()
     def generate_executive_summary(self):
         """生成执行摘要"""
+        return self._cached("executive_summary", self._build_executive_summary)
+    
+    def _build_executive_summary(self):
+        """构建执行摘要"""
         # 获取主要指标结果
         primary_metric = self.config["metrics"]["primary"]
-        primary_result = self.results_df[self.results_df["metric"] == primary_metric].iloc[0]
+        primary_result = self._result_for(primary_metric)
         
         summary = {
             "experiment_name": self.config["experiment_name"],
@@ -30,27 +140,32 @@ class BusinessReportGenerator:
         
         # 计算潜在业务影响
         if "conversions" in self.metrics_df.columns:
-            control_conv = self.metrics_df[self.metrics_df["group"] == "control"]["conversions"].sum()
+            control_conv = self._group_totals("control")["conversions"]
             lift_conv = control_conv * primary_result["lift"]
             summary["potential_lift_conversions"] = lift_conv
         
         if "total_revenue" in self.metrics_df.columns:
-            control_rev = self.metrics_df[self.metrics_df["group"] == "control"]["total_revenue"].sum()
+            control_rev = self._group_totals("control")["total_revenue"]
             revenue_per_conv = control_rev / control_conv
             summary["potential_revenue_lift"] = lift_conv * revenue_per_conv
         
         return summary
     
+    @traced()
     def generate_full_report(self):
         """生成完整业务报告"""
+        return self._cached("full_report", self._build_full_report)
+    
+    def _build_full_report(self):
+        """构建完整业务报告"""
         report = {
             "experiment_overview": {
                 "name": self.config["experiment_name"],
                 "objective": "测试新版处方药详情页对转化率的影响",
                 "test_groups": self.config["groups"],
                 "duration": f"{self.config['test_duration']} days",
-                "sample_size_control": len(self.metrics_df[self.metrics_df["group"] == "control"]),
-                "sample_size_treatment": len(self.metrics_df[self.metrics_df["group"] == "treatment"])
+                "sample_size_control": self._group_totals("control")["rows"],
+                "sample_size_treatment": self._group_totals("treatment")["rows"]
             },
             "key_results": [],
             "detailed_analysis": [],
@@ -59,7 +174,7 @@ class BusinessReportGenerator:
         }
         
         # 添加关键结果
-        for _, row in self.results_df.iterrows():
+        for row in self.results_df.to_dict("records"):
             result = {
                 "metric": row["metric"],
                 "control_value": row["control_value"],
@@ -78,7 +193,7 @@ class BusinessReportGenerator:
             report["detailed_analysis"].append(analysis)
         
         # 添加结论和建议
-        primary_result = self.results_df[self.results_df["metric"] == self.config["metrics"]["primary"]].iloc[0]
+        primary_result = self._result_for(self.config["metrics"]["primary"])
         if primary_result["significant"]:
             if primary_result["lift"] > 0:
                 report["conclusions"].append("实验组在主要指标上表现显著优于对照组")
@@ -91,8 +206,8 @@ class BusinessReportGenerator:
             report["recommendations"].append("考虑延长测试时间或优化实验方案")
         
         # 添加医药行业特定建议
-        if "adherence" in self.results_df["metric"].values:
-            adherence_result = self.results_df[self.results_df["metric"] == "adherence"].iloc[0]
+        adherence_result = self._result_for("adherence")
+        if adherence_result is not None:
             if adherence_result["significant"] and adherence_result["lift"] > 0:
                 report["recommendations"].append("新版详情页显著提升用药依从性，建议在慢病管理模块推广")
         
@@ -108,29 +223,35 @@ class BusinessReportGenerator:
         else:
             return f"组间差异不显著 (p={result['p_value']:.4f})"
     
+    @traced()
     def generate_report_dataframe(self):
         """生成报告数据框"""
+        return self._cached("report_dataframe", self._build_report_dataframe)
+    
+    def _build_report_dataframe(self):
+        """构建报告数据框"""
         report_df = self.results_df.copy()
-        report_df["business_impact"] = report_df.apply(self._calculate_business_impact, axis=1)
-        report_df["interpretation"] = report_df.apply(self._interpret_result, axis=1)
+        rows = self.results_df.to_dict("records")
+        report_df["business_impact"] = [self._calculate_business_impact(row) for row in rows]
+        report_df["interpretation"] = [self._interpret_result(row) for row in rows]
         return report_df[["metric", "control_value", "treatment_value", 
                          "lift", "p_value", "significant", "business_impact", "interpretation"]]
     
     def _calculate_business_impact(self, row):
         """估算业务影响"""
         if row["metric"] == "conversion_rate":
-            control_users = len(self.metrics_df[self.metrics_df["group"] == "control"])
+            control_users = self._group_totals("control")["rows"]
             conv_lift = control_users * row["lift"] * row["control_value"]
             return f"每月增加{conv_lift:.0f}次转化"
         
         elif row["metric"] == "avg_order_value":
-            conv_rate = self.results_df[self.results_df["metric"] == "conversion_rate"].iloc[0]
+            conv_rate = self._result_for("conversion_rate")
             if conv_rate["significant"]:
                 lift = conv_rate["lift"]
             else:
                 lift = 0
                 
-            control_conv = self.metrics_df[self.metrics_df["group"] == "control"]["conversions"].sum()
+            control_conv = self._group_totals("control")["conversions"]
             revenue_lift = control_conv * (1 + lift) * row["lift"] * row["control_value"]
             return f"每月增加收入${revenue_lift:.0f}"
         
@@ -138,3 +259,68 @@ class BusinessReportGenerator:
             return "提升患者健康结果，减少并发症风险"
         
         return "N/A"
+    
+    def iter_report_json(self):
+        """逐段生成完整报告的JSON文本, 列表类章节逐条输出"""
+        report = self.generate_full_report()
+        yield "{"
+        for i, (section, content) in enumerate(report.items()):
+            yield ("," if i else "") + _dumps(section) + ":"
+            if isinstance(content, list):
+                yield "["
+                for j, item in enumerate(content):
+                    yield ("," if j else "") + _dumps(item)
+                yield "]"
+            else:
+                yield _dumps(content)
+        yield "}"
+    
+    def iter_report_html(self):
+        """逐段生成完整报告的HTML文本"""
+        report = self.generate_full_report()
+        overview = report["experiment_overview"]
+        yield f"<section class=\"ab-report\"><h2>{escape(str(overview['name']))}</h2>"
+        yield "<ul>" + "".join(
+            f"<li>{escape(str(k))}: {escape(str(v))}</li>" for k, v in overview.items() if k != "name"
+        ) + "</ul>"
+        yield ("<table><thead><tr><th>metric</th><th>control</th><th>treatment</th>"
+               "<th>lift</th><th>p_value</th><th>interpretation</th></tr></thead><tbody>")
+        for result, analysis in zip(report["key_results"], report["detailed_analysis"]):
+            yield (f"<tr><td>{escape(str(result['metric']))}</td>"
+                   f"<td>{result['control_value']:.4f}</td><td>{result['treatment_value']:.4f}</td>"
+                   f"<td>{result['lift']:.2%}</td><td>{result['p_value']:.4f}</td>"
+                   f"<td>{escape(analysis['interpretation'])}</td></tr>")
+        yield "</tbody></table>"
+        for section in ["conclusions", "recommendations"]:
+            yield f"<h3>{section}</h3><ul>" + "".join(
+                f"<li>{escape(item)}</li>" for item in report[section]
+            ) + "</ul>"
+        yield "</section>"
+    
+    @traced()
+    def write_report_json(self, f):
+        """将报告以流式方式写入已打开的文本文件"""
+        for chunk in self.iter_report_json():
+            f.write(chunk)
+    
+    @traced()
+    def write_report_html(self, f):
+        """将报告HTML以流式方式写入已打开的文本文件"""
+        for chunk in self.iter_report_html():
+            f.write(chunk)
+
+def stream_reports_json(generators, f):
+    """将多个实验的报告依次写为一个JSON数组, 内存中同时只保留一份报告"""
+    f.write("[")
+    for i, generator in enumerate(generators):
+        if i:
+            f.write(",")
+        generator.write_report_json(f)
+    f.write("]")
+
+def stream_reports_html(generators, f):
+    """将多个实验的报告依次写入一个HTML页面"""
+    f.write("<!DOCTYPE html><html><head><meta charset=\"utf-8\"></head><body>")
+    for generator in generators:
+        generator.write_report_html(f)
+    f.write("</body></html>")
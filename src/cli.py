@@ -0,0 +1,251 @@
+"""A/B测试框架命令行入口
+
+子命令: generate / analyze / report / plot / pipeline / plan / assign。各子命令只在执行时导入自己需要的模块,
+例如 analyze 不会加载 matplotlib、seaborn、plotly 或 Faker。
+"""
+import time
+
+_START = time.perf_counter()
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 仅计算结果的任务 (analyze) 从进程启动到开始读数据的目标耗时 (秒)
+STARTUP_BUDGET_SECONDS = 1.5
+
+def _export_trace(args):
+    """将追踪结果写为 <前缀>.json 和 <前缀>.trace.json (Chrome trace)"""
+    import tracing
+    paths = [tracing.export_json(args.trace_output + ".json"),
+             tracing.export_chrome_trace(args.trace_output + ".trace.json")]
+    for entry in tracing.summary():
+        print(f"{entry['name']:<48} {entry['calls']:>5} {entry['total_ms']:>10.1f}ms "
+              f"{entry['peak_rss_mb']:>8.1f}MB", file=sys.stderr)
+    print("trace written to " + ", ".join(paths), file=sys.stderr)
+
+def _report_startup(args):
+    """记录启动耗时 (入口模块加载到子命令依赖导入完成), 超出预算时告警"""
+    elapsed = time.perf_counter() - _START
+    if args.timings:
+        print(f"startup: {elapsed:.3f}s (budget {args.startup_budget:.2f}s)", file=sys.stderr)
+    if elapsed > args.startup_budget:
+        print(f"Warning: startup took {elapsed:.3f}s, over budget of {args.startup_budget:.2f}s",
+              file=sys.stderr)
+    return elapsed
+
+def _load_table(paths):
+    """读取一个或多个CSV/Parquet文件或目录"""
+    from storage import read_table
+    import pandas as pd
+    frames = [read_table(path) for path in paths]
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+def cmd_generate(args):
+    """生成模拟数据并按批次写入分区文件"""
+    from data_generator import run_generation_pipeline
+    from config import DATA_GENERATION
+    _report_startup(args)
+    rows = run_generation_pipeline(
+        args.num_patients or DATA_GENERATION["num_patients"], args.output_dir,
+        batch_size=args.batch_size, seed=args.seed, include_pii=not args.no_pii, fmt=args.format
+    )
+    print(rows)
+
+def cmd_analyze(args):
+    """计算实验结果表; 多个输入文件时使用分片并行分析"""
+    if len(args.users) > 1 or args.processes:
+        from sharded_analysis import ShardedAnalyzer
+        _report_startup(args)
+        analyzer = ShardedAnalyzer(args.users, processes=args.processes)
+    else:
+        from statistical_analysis import StatisticalAnalyzer
+        from experiment_frame import ExperimentFrame
+        _report_startup(args)
+        analyzer = StatisticalAnalyzer(None, ExperimentFrame.read(args.users[0]))
+    results_df = analyzer.analyze_all_metrics()
+
+    if args.output:
+        results_df.to_csv(args.output, index=False)
+    print(results_df.to_string(index=False))
+
+    if args.quantiles is not None:
+        quantile_df = analyzer.analyze_quantiles(quantiles=args.quantiles or None)
+        if args.output:
+            quantile_df.to_csv(os.path.splitext(args.output)[0] + "_quantiles.csv", index=False)
+        print(quantile_df.to_string(index=False))
+
+def cmd_report(args):
+    """根据结果表生成业务报告 (JSON/HTML/CSV)"""
+    from business_report import BusinessReportGenerator
+    from experiment_frame import ExperimentFrame
+    from config import AB_TEST_CONFIG
+    _report_startup(args)
+    metrics = ExperimentFrame.read(args.metrics)
+    results_df = _load_table([args.results])
+    generator = BusinessReportGenerator(metrics, results_df, AB_TEST_CONFIG, cache_dir=args.cache_dir)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        if args.format == "json":
+            generator.write_report_json(out)
+        elif args.format == "html":
+            generator.write_report_html(out)
+        else:
+            generator.generate_report_dataframe().to_csv(out, index=False)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+def cmd_plot(args):
+    """批量渲染图表到输出目录"""
+    from visualization import ABTestVisualizer
+    from experiment_frame import ExperimentFrame
+    _report_startup(args)
+    metrics = ExperimentFrame.read(args.metrics)
+    results_df = _load_table([args.results])
+    visualizer = ABTestVisualizer(metrics, results_df)
+    timeseries_df = metrics.df if "date" in metrics.df.columns else None
+    for path in visualizer.render_all(args.output_dir, args.metric, timeseries_df, args.processes):
+        print(path)
+
+def cmd_pipeline(args):
+    """运行带缓存的 generate → analyze → report/visualize 流水线"""
+    from pipeline import build_default_pipeline
+    _report_startup(args)
+    runner = build_default_pipeline(args.users, args.metrics, cache_dir=args.cache_dir)
+    outputs = runner.run(args.stage or None, force=args.force or ())
+    print(runner.summary())
+    for name, path in outputs.items():
+        print(f"{name}: {path}")
+
+def cmd_plan(args):
+    """输出功效与样本量规划网格"""
+    from power_analysis import PowerPlanner
+    _report_startup(args)
+    planner = PowerPlanner(planning={k: v for k, v in [("baseline_rate", args.baseline_rate),
+                                                       ("daily_users", args.daily_users)] if v})
+    grid = planner.grid(args.effects, args.allocations, args.durations, simulate=not args.no_simulate,
+                        n_sims=args.n_sims, seed=args.seed)
+    if args.output:
+        grid.to_csv(args.output, index=False)
+    print(grid.to_string(index=False))
+    print(f"required duration for expected effect: {planner.required_duration()} days")
+
+def cmd_assign(args):
+    """批量为用户表分组, 或启动本地分流查询服务"""
+    from assignment import TrafficAssigner, AssignmentService, check_srm
+    _report_startup(args)
+    assigner = TrafficAssigner(salt=args.salt)
+    if args.serve:
+        import asyncio
+
+        async def serve():
+            async with AssignmentService(assigner, args.host, args.port) as service:
+                print(f"serving assignments on {service.host}:{service.port}", file=sys.stderr)
+                await asyncio.Event().wait()
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    assigned = assigner.assign_frame(_load_table(args.users), user_col=args.user_col)
+    check_srm(assigned["group"].value_counts().to_dict(), assigner.allocation)
+    if args.output:
+        assigned.to_csv(args.output, index=False)
+    print(assigned["group"].value_counts().to_string())
+
+def build_parser():
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(prog="abtest", description="医药A/B测试分析框架")
+    parser.add_argument("--timings", action="store_true", help="输出启动耗时")
+    parser.add_argument("--trace", action="store_true", help="记录各阶段耗时、行数与内存并导出")
+    parser.add_argument("--trace-output", default="abtest-trace", help="追踪文件路径前缀")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_SECONDS,
+                        help="启动耗时预算(秒), 超出时告警")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("generate", help="生成模拟数据")
+    p.add_argument("--num-patients", type=int)
+    p.add_argument("--output-dir", default="../data")
+    p.add_argument("--batch-size", type=int)
+    p.add_argument("--seed", type=int)
+    p.add_argument("--format", choices=["parquet", "csv"])
+    p.add_argument("--no-pii", action="store_true", help="不生成姓名/电话/地址列")
+    p.set_defaults(func=cmd_generate)
+
+    p = sub.add_parser("analyze", help="计算实验结果表")
+    p.add_argument("users", nargs="+", help="用户级数据 (CSV/Parquet 文件或目录)")
+    p.add_argument("--output", help="结果表输出CSV路径")
+    p.add_argument("--processes", type=int, help="分片并行分析的进程数")
+    p.add_argument("--quantiles", type=float, nargs="*",
+                   help="同时输出偏态指标的分位数效应 (默认中位数与P90)")
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser("report", help="生成业务报告")
+    p.add_argument("--metrics", nargs="+", required=True)
+    p.add_argument("--results", required=True)
+    p.add_argument("--format", choices=["json", "html", "csv"], default="json")
+    p.add_argument("--output")
+    p.add_argument("--cache-dir")
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("plot", help="批量渲染图表")
+    p.add_argument("--metrics", nargs="+", required=True)
+    p.add_argument("--results", required=True)
+    p.add_argument("--output-dir", default="charts")
+    p.add_argument("--metric", nargs="*", help="只渲染指定指标")
+    p.add_argument("--processes", type=int)
+    p.set_defaults(func=cmd_plot)
+
+    p = sub.add_parser("pipeline", help="运行带缓存的完整流水线")
+    p.add_argument("--users", required=True, help="用户级数据 (CSV/Parquet 文件或目录)")
+    p.add_argument("--metrics", required=True, help="指标数据 (CSV/Parquet 文件或目录)")
+    p.add_argument("--cache-dir", default=".cache/pipeline")
+    p.add_argument("--stage", nargs="*", choices=["generate", "analyze", "report", "visualize"],
+                   help="只运行指定阶段及其上游")
+    p.add_argument("--force", nargs="*", help="忽略缓存强制重跑的阶段")
+    p.set_defaults(func=cmd_pipeline)
+
+    p = sub.add_parser("plan", help="功效分析与样本量规划")
+    p.add_argument("--effects", type=float, nargs="+", help="相对提升效应网格")
+    p.add_argument("--allocations", type=float, nargs="+", help="实验组流量占比网格")
+    p.add_argument("--durations", type=int, nargs="+", help="测试天数网格")
+    p.add_argument("--baseline-rate", type=float)
+    p.add_argument("--daily-users", type=int)
+    p.add_argument("--n-sims", type=int)
+    p.add_argument("--seed", type=int)
+    p.add_argument("--no-simulate", action="store_true", help="只计算解析功效")
+    p.add_argument("--output", help="网格输出CSV路径")
+    p.set_defaults(func=cmd_plan)
+
+    p = sub.add_parser("assign", help="确定性流量分配")
+    p.add_argument("users", nargs="*", help="需要分组的用户表 (CSV/Parquet 文件或目录)")
+    p.add_argument("--user-col", default="user_id")
+    p.add_argument("--salt", default="")
+    p.add_argument("--output", help="带分组列的输出CSV路径")
+    p.add_argument("--serve", action="store_true", help="启动 asyncio 分流查询服务")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.set_defaults(func=cmd_assign)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.func is cmd_assign and not (args.users or args.serve):
+        parser.error("assign: provide user tables to assign or --serve to start the lookup service")
+    if args.trace:
+        import tracing
+        tracing.enable()
+    try:
+        args.func(args)
+    finally:
+        if args.trace:
+            _export_trace(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+from statistical_analysis import (
+    welch_from_moments, welch_test, conversion_test, combine_moments, GROUP_COL, CHRONIC_COL, CONVERSION_COL
+)
+from adherence import iter_pdc, patient_adherence
+from tracing import traced
+
+USER_COL = "user_id"
+PATIENT_COL = "patient_id"
+COVARIATE_COLUMNS = ["pre_orders", "pre_revenue", "pre_avg_order_value", "pre_purchased"]
+
+# 各指标默认使用的实验前协变量
+DEFAULT_COVARIATES = {
+    CONVERSION_COL: "pre_purchased",
+    "avg_order_value": "pre_avg_order_value",
+    "bounce_rate": "pre_orders",
+    "adherence": "pre_adherence_score"
+}
+
+def _pre_period_sums(transactions_df, start, end, key_col, date_col, amount_col):
+    """单块交易记录在实验前窗口内按患者汇总的订单数与金额"""
+    dates = transactions_df[date_col]
+    mask = dates < end if start is None else (dates >= start) & (dates < end)
+    window = transactions_df.loc[mask, [key_col, amount_col]]
+    return window.groupby(key_col, sort=False)[amount_col].agg(["size", "sum"])
+
+@traced()
+def build_pre_period_covariates(transactions, experiment_start, lookback_days=None, adherence=False,
+                                prescriptions_df=None, key_col=PATIENT_COL, date_col="transaction_date",
+                                amount_col="amount"):
+    """由实验开始前的交易记录构建每位患者的协变量
+
+    transactions 可以是单个数据框, 也可以是数据框的迭代器 (如 storage.iter_batches 的输出),
+    各块只保留按患者汇总后的结果, 交易明细不需要同时载入内存。
+    adherence=True 时同一遍扫描中由实验前的取药记录计算PDC (观察期截止到实验开始前一天),
+    作为 pre_adherence_score; 此时各块须按患者ID递增排列 (见 adherence.iter_pdc)。
+    """
+    end = pd.Timestamp(experiment_start)
+    start = end - pd.Timedelta(days=lookback_days) if lookback_days else None
+    chunks = [transactions] if isinstance(transactions, pd.DataFrame) else transactions
+
+    partials = []
+
+    def scan():
+        for chunk in chunks:
+            chunk = chunk.assign(**{date_col: pd.to_datetime(chunk[date_col])})
+            partials.append(_pre_period_sums(chunk, start, end, key_col, date_col, amount_col))
+            yield chunk
+
+    pdc_parts = []
+    if adherence:
+        pdc_parts = list(iter_pdc(scan(), prescriptions_df, period_start=start,
+                                  period_end=end - pd.Timedelta(days=1)))
+    else:
+        for _ in scan():
+            pass
+    sums = pd.concat(partials)
+    if len(partials) > 1:
+        sums = sums.groupby(level=0, sort=False).sum()
+
+    orders = sums["size"].astype(np.float64)
+    covariates = pd.DataFrame({
+        "pre_orders": orders,
+        "pre_revenue": sums["sum"],
+        "pre_avg_order_value": sums["sum"] / orders,
+        "pre_purchased": (orders > 0).astype(np.float64)
+    })
+    covariates.index.name = key_col
+
+    if adherence:
+        pdc = [part for part in pdc_parts if len(part)]
+        scores = (patient_adherence(pd.concat(pdc))["pdc"] if pdc else pd.Series(dtype=np.float64))
+        covariates = covariates.join(scores.rename("pre_adherence_score"), how="outer")
+    return covariates
+
+def attach_covariates(user_df, covariates, user_col=USER_COL):
+    """按用户ID将协变量拼接到用户表, 没有实验前记录的用户取 0"""
+    aligned = covariates.reindex(user_df[user_col].to_numpy())
+    return user_df.assign(**{col: aligned[col].fillna(0.0).to_numpy() for col in covariates.columns})
+
+def resolve_covariates(user_df, covariates=None, metric_cols=None):
+    """确定每个指标使用的协变量列: 字符串表示所有指标共用, 字典按指标指定"""
+    metric_cols = list(metric_cols or DEFAULT_COVARIATES)
+    if isinstance(covariates, dict):
+        metric_cols = list(dict.fromkeys(metric_cols + list(covariates)))
+    if isinstance(covariates, str):
+        mapping = {metric: covariates for metric in metric_cols}
+    else:
+        mapping = {**DEFAULT_COVARIATES, **(covariates or {})}
+    return {metric: mapping[metric] for metric in metric_cols
+            if metric in user_df.columns and mapping.get(metric) in user_df.columns}
+
+@traced()
+def compute_cross_stats(user_df, covariates, by=(GROUP_COL,), chunk_size=None):
+    """单次分组扫描计算指标y与协变量x的交叉充分统计量
+
+    返回以分组键为索引、(metric, stat) 为列的数据框, stat 为 count/sum_y/sum_x/sumsq_y/sumsq_x/sum_xy,
+    各项均可直接相加, 可按块或按分片累加后再合并。
+    """
+    if not covariates:
+        raise ValueError(
+            "CUPED requires at least one metric with a pre-period covariate column in the data "
+            f"(default covariates: {sorted(set(DEFAULT_COVARIATES.values()))}); "
+            "see build_pre_period_covariates / attach_covariates"
+        )
+    keys = [k for k in by if k in user_df.columns]
+    chunk_size = chunk_size or max(len(user_df), 1)
+
+    total = None
+    for start in range(0, max(len(user_df), 1), chunk_size):
+        chunk = user_df.iloc[start:start + chunk_size]
+        parts = {}
+        for metric, covariate in covariates.items():
+            y = chunk[metric].to_numpy(dtype=np.float64)
+            x = chunk[covariate].to_numpy(dtype=np.float64)
+            valid = ~(np.isnan(y) | np.isnan(x))
+            y, x = np.where(valid, y, 0.0), np.where(valid, x, 0.0)
+            parts[metric] = pd.DataFrame({"count": valid, "sum_y": y, "sum_x": x, "sumsq_y": y * y,
+                                          "sumsq_x": x * x, "sum_xy": x * y}, index=chunk.index)
+        partial = pd.concat(parts, axis=1).groupby([chunk[k] for k in keys], observed=True, dropna=False).sum()
+        total = partial if total is None else total.add(partial, fill_value=0)
+    return total
+
+def to_cross_moments(cross_stats, metric, group_level=GROUP_COL):
+    """按实验组合并交叉统计量, 转换为 (count, mean_y, mean_x, var_y, var_x, cov_xy)"""
+    stats = cross_stats[metric]
+    if stats.index.nlevels > 1:
+        stats = stats.groupby(level=group_level).sum()
+    n = stats["count"]
+    mean_y, mean_x = stats["sum_y"] / n, stats["sum_x"] / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return pd.DataFrame({
+            "count": n,
+            "mean_y": mean_y,
+            "mean_x": mean_x,
+            "var_y": (stats["sumsq_y"] - stats["sum_y"] * mean_y).clip(lower=0) / (n - 1),
+            "var_x": (stats["sumsq_x"] - stats["sum_x"] * mean_x).clip(lower=0) / (n - 1),
+            "cov_xy": (stats["sum_xy"] - stats["sum_x"] * mean_y) / (n - 1)
+        })
+
+def cuped_test(cross_moments, alpha, metric_name):
+    """CUPED调整后的Welch检验
+
+    theta 取组内合并的 cov(x, y) / var(x) (即带处理指示变量的回归系数),
+    调整后均值 = 均值y - theta * (组均值x - 总体均值x), 调整后方差 = var_y - 2θcov + θ²var_x。
+    """
+    control, treatment = cross_moments.loc["control"], cross_moments.loc["treatment"]
+    dof = cross_moments["count"] - 1
+    pooled_var_x = (dof * cross_moments["var_x"]).sum()
+    theta = (dof * cross_moments["cov_xy"]).sum() / pooled_var_x if pooled_var_x > 0 else 0.0
+    overall_x = (cross_moments["count"] * cross_moments["mean_x"]).sum() / cross_moments["count"].sum()
+
+    def adjust(arm):
+        mean = arm["mean_y"] - theta * (arm["mean_x"] - overall_x)
+        var = max(arm["var_y"] - 2 * theta * arm["cov_xy"] + theta ** 2 * arm["var_x"], 0.0)
+        return arm["count"], mean, var
+
+    n_control, mean_control, var_control = adjust(control)
+    n_treatment, mean_treatment, var_treatment = adjust(treatment)
+    tstat, pval = welch_from_moments(n_control, mean_control, var_control,
+                                     n_treatment, mean_treatment, var_treatment)
+    pval = float(pval)
+
+    raw_se = control["var_y"] / control["count"] + treatment["var_y"] / treatment["count"]
+    adjusted_se = var_control / n_control + var_treatment / n_treatment
+    return {
+        "metric": metric_name,
+        "control_value": mean_control,
+        "treatment_value": mean_treatment,
+        "lift": (mean_treatment - mean_control) / mean_control,
+        "p_value": pval,
+        "significant": pval < alpha,
+        "test_type": "cuped_t-test",
+        "theta": theta,
+        "variance_reduction": 1 - adjusted_se / raw_se if raw_se > 0 else 0.0
+    }
+
+def _unadjusted(moments, metric, alpha):
+    """没有协变量的指标: 未调整的检验, theta 为空、方差缩减为 0"""
+    if metric == CONVERSION_COL:
+        result = conversion_test(moments, alpha)
+    else:
+        result = welch_test(moments, metric, alpha)
+    return {**result, "theta": np.nan, "variance_reduction": 0.0}
+
+def cuped_results(cross_stats, config, moments=None):
+    """由交叉统计量生成与 analyze_all_metrics 结构相同的CUPED结果表
+
+    moments 为按 (group, is_chronic) 的分组矩 (见 statistical_analysis.to_moments) 时,
+    数据中没有协变量的指标回退为未调整的检验, 结果表的行与 analyze_all_metrics 一致。
+    """
+    alpha = config["significance_level"]
+    adjusted = set(cross_stats.columns.get_level_values(0))
+    unadjusted = set() if moments is None else set(moments.columns.get_level_values(0))
+    results = []
+
+    def test(cross, subset_moments, metric, name):
+        if metric in adjusted:
+            results.append(cuped_test(to_cross_moments(cross, metric), alpha, name))
+        elif metric in unadjusted:
+            results.append(_unadjusted(subset_moments, metric, alpha))
+
+    def by_group(chronic_only=False):
+        if moments is None:
+            return None
+        subset = moments
+        if chronic_only:
+            subset = moments[moments.index.get_level_values(CHRONIC_COL) == True]
+        return combine_moments(subset, GROUP_COL) if subset.index.nlevels > 1 else subset
+
+    test(cross_stats, by_group(), CONVERSION_COL, "conversion_rate")
+    for metric in config["metrics"]["secondary"]:
+        test(cross_stats, by_group(), metric, metric)
+
+    # 慢病患者子集
+    if CHRONIC_COL in cross_stats.index.names:
+        chronic_keys = cross_stats.index.get_level_values(CHRONIC_COL) == True
+        if chronic_keys.any():
+            chronic = cross_stats[chronic_keys]
+            chronic_moments = by_group(chronic_only=True)
+            test(chronic, chronic_moments, "adherence", "adherence")
+            test(chronic, chronic_moments, CONVERSION_COL, "conversion_rate")
+
+    return pd.DataFrame(results)
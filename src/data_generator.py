@@ -1,162 +1,278 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from faker import Faker
-import random
 from config import DATA_GENERATION
+from storage import write_partition
+from tracing import span, traced
+from adherence import compute_pdc, patient_adherence
 
-fake = Faker()
-
-def generate_patients(num_patients):
-    """生成患者基本信息"""
-    patients = []
-    for i in range(1, num_patients + 1):
-        age = random.randint(18, 90)
-        gender = random.choice(['M', 'F'])
-        disease = random.choice(DATA_GENERATION["disease_types"])
-        join_date = fake.date_between(
-            start_date=DATA_GENERATION["start_date"], 
-            end_date=DATA_GENERATION["end_date"]
-        )
-        
-        patients.append({
-            "patient_id": i,
-            "name": fake.name(),
-            "age": age,
-            "gender": gender,
-            "primary_disease": disease,
-            "join_date": join_date,
-            "phone": fake.phone_number(),
-            "address": fake.address().replace('\n', ', ')
-        })
-    
-    return pd.DataFrame(patients)
-
-def generate_transactions(patients_df):
-    """生成交易记录"""
-    transactions = []
-    patient_ids = patients_df["patient_id"].tolist()
-    
-    for pid in patient_ids:
-        # 每个患者有1-12次交易
-        num_transactions = random.randint(1, 12)
-        disease = patients_df[patients_df["patient_id"] == pid]["primary_disease"].values[0]
-        drugs = DATA_GENERATION["drug_categories"][disease]
-        
-        for _ in range(num_transactions):
-            drug = random.choice(drugs)
-            quantity = random.randint(1, 4)
-            unit_price = round(random.uniform(20, 200), 2)
-            amount = round(quantity * unit_price, 2)
-            transaction_date = fake.date_between(
-                start_date=DATA_GENERATION["start_date"],
-                end_date=DATA_GENERATION["end_date"]
-            )
-            
-            transactions.append({
-                "transaction_id": len(transactions) + 1,
-                "patient_id": pid,
-                "drug_name": drug,
-                "quantity": quantity,
-                "unit_price": unit_price,
-                "amount": amount,
-                "transaction_date": transaction_date
-            })
-    
-    return pd.DataFrame(transactions)
-
-def generate_prescriptions(transactions_df):
-    """生成处方数据"""
-    prescriptions = []
-    grouped = transactions_df.groupby("patient_id")
-    
-    for pid, group in grouped:
-        # 为每种药物生成处方
-        drugs = group["drug_name"].unique()
-        for drug in drugs:
-            drug_transactions = group[group["drug_name"] == drug]
-            first_prescription = drug_transactions["transaction_date"].min()
-            
-            # 预期用药间隔 (天)
-            if drug == "Insulin":
-                expected_interval = 30
-            elif drug == "Inhalers":
-                expected_interval = 60
-            else:
-                expected_interval = random.choice([30, 60, 90])
-            
-            # 实际间隔有波动
-            actual_interval = max(1, int(expected_interval * random.uniform(0.7, 1.3)))
-            
-            prescriptions.append({
-                "prescription_id": len(prescriptions) + 1,
-                "patient_id": pid,
-                "drug_name": drug,
-                "first_prescription_date": first_prescription,
-                "expected_interval_days": expected_interval,
-                "actual_interval_days": actual_interval
-            })
-    
-    return pd.DataFrame(prescriptions)
-
-def generate_adherence(patients_df, prescriptions_df):
-    """生成用药依从性数据"""
-    adherence_data = []
-    
-    for _, patient in patients_df.iterrows():
-        pid = patient["patient_id"]
-        age = patient["age"]
-        disease = patient["primary_disease"]
+# Faker实例在首次需要个人信息列时才创建
+_fake = None
+
+def _get_faker():
+    """按需创建Faker实例"""
+    global _fake
+    if _fake is None:
+        from faker import Faker
+        _fake = Faker()
+    return _fake
+
+# 单独调用各表的生成函数时, 每张表使用由同一种子派生的独立随机流
+TABLES = ("patients", "transactions", "prescriptions", "adherence")
+
+def _get_rng(rng=None, seed=None, table=None):
+    """获取随机数生成器
+
+    传入 rng 时直接沿用 (流式管道中四张表依次从同一个Generator抽样)。未传入时由种子创建;
+    指定 table 时取 SeedSequence(seed).spawn 中该表对应的子流, 否则各表会重放同一串随机数,
+    例如患者年龄与交易次数几乎完全相关。
+    """
+    if rng is not None:
+        return rng
+    if seed is None:
+        seed = DATA_GENERATION.get("seed")
+    if table is None:
+        return np.random.default_rng(seed)
+    streams = np.random.SeedSequence(seed).spawn(len(TABLES))
+    return np.random.default_rng(streams[TABLES.index(table)])
+
+def _random_dates(rng, size):
+    """在数据生成区间内均匀抽取日期"""
+    start = np.datetime64(DATA_GENERATION["start_date"], "D")
+    end = np.datetime64(DATA_GENERATION["end_date"], "D")
+    offsets = rng.integers(0, (end - start).astype(int) + 1, size=size)
+    return pd.to_datetime(start + offsets)
+
+def _build_pii_pool(pool_size, seed=None):
+    """预生成姓名/电话/地址池, 避免逐行调用Faker"""
+    fake = _get_faker()
+    if seed is not None:
+        fake.seed_instance(seed)
+    return pd.DataFrame({
+        "name": [fake.name() for _ in range(pool_size)],
+        "phone": [fake.phone_number() for _ in range(pool_size)],
+        "address": [fake.address().replace('\n', ', ') for _ in range(pool_size)]
+    })
+
+@traced()
+def generate_patients(num_patients, rng=None, seed=None, include_pii=True, pii_pool_size=None,
+                      start_id=1, pii_pool=None):
+    """生成患者基本信息 (向量化)"""
+    rng = _get_rng(rng, seed, "patients")
+    diseases = DATA_GENERATION["disease_types"]
+    
+    patients_df = pd.DataFrame({
+        "patient_id": np.arange(start_id, start_id + num_patients),
+        "age": rng.integers(18, 91, size=num_patients),
+        "gender": pd.Categorical.from_codes(rng.integers(0, 2, size=num_patients), categories=['M', 'F']),
+        "primary_disease": pd.Categorical.from_codes(
+            rng.integers(0, len(diseases), size=num_patients), categories=diseases
+        ),
+        "join_date": _random_dates(rng, num_patients)
+    })
+    
+    # 个人信息列可选, 从预生成的池中按索引抽取
+    if include_pii:
+        if pii_pool is None:
+            pool_size = pii_pool_size or DATA_GENERATION.get("pii_pool_size", 5000)
+            pii_pool = _build_pii_pool(pool_size, seed=int(rng.integers(0, 2**31 - 1)))
+        idx = rng.integers(0, len(pii_pool), size=num_patients)
+        patients_df.insert(1, "name", pii_pool["name"].to_numpy()[idx])
+        patients_df["phone"] = pii_pool["phone"].to_numpy()[idx]
+        patients_df["address"] = pii_pool["address"].to_numpy()[idx]
+    
+    return patients_df
+
+def _disease_codes(diseases):
+    """将疾病列转换为DATA_GENERATION["disease_types"]中的位置编码"""
+    return pd.Categorical(diseases, categories=DATA_GENERATION["disease_types"]).codes
+
+@traced()
+def generate_transactions(patients_df, rng=None, seed=None, start_id=1):
+    """生成交易记录 (向量化)"""
+    rng = _get_rng(rng, seed, "transactions")
+    drug_categories = DATA_GENERATION["drug_categories"]
+    
+    # 每个患者有1-12次交易
+    num_transactions = rng.integers(1, 13, size=len(patients_df))
+    patient_ids = np.repeat(patients_df["patient_id"].to_numpy(), num_transactions)
+    disease_codes = np.repeat(_disease_codes(patients_df["primary_disease"]), num_transactions)
+    n = len(patient_ids)
+    
+    # 按疾病的候选药物表: 展平后用偏移量+长度索引
+    drug_names = sorted({d for drugs in drug_categories.values() for d in drugs})
+    drug_lists = [drug_categories[d] for d in DATA_GENERATION["disease_types"]]
+    lengths = np.array([len(drugs) for drugs in drug_lists])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    flat_codes = np.array([drug_names.index(d) for drugs in drug_lists for d in drugs])
+    pick = offsets[disease_codes] + (rng.random(n) * lengths[disease_codes]).astype(int)
+    
+    quantity = rng.integers(1, 5, size=n)
+    unit_price = np.round(rng.uniform(20, 200, size=n), 2)
+    
+    return pd.DataFrame({
+        "transaction_id": np.arange(start_id, start_id + n),
+        "patient_id": patient_ids,
+        "drug_name": pd.Categorical.from_codes(flat_codes[pick], categories=drug_names),
+        "quantity": quantity,
+        "unit_price": unit_price,
+        "amount": np.round(quantity * unit_price, 2),
+        "transaction_date": _random_dates(rng, n)
+    })
+
+@traced()
+def generate_prescriptions(transactions_df, rng=None, seed=None, start_id=1):
+    """生成处方数据 (向量化)"""
+    rng = _get_rng(rng, seed, "prescriptions")
+    
+    # 每个患者的每种药物生成一张处方, 首次处方日期为最早交易日期
+    prescriptions_df = (
+        transactions_df.groupby(["patient_id", "drug_name"], observed=True, sort=True)
+        ["transaction_date"].min()
+        .reset_index(name="first_prescription_date")
+    )
+    n = len(prescriptions_df)
+    drug = prescriptions_df["drug_name"].astype(str).to_numpy()
+    
+    # 预期用药间隔 (天)
+    expected_interval = np.where(
+        drug == "Insulin", 30,
+        np.where(drug == "Inhalers", 60, rng.choice([30, 60, 90], size=n))
+    )
+    
+    # 实际间隔有波动
+    actual_interval = np.maximum(1, (expected_interval * rng.uniform(0.7, 1.3, size=n)).astype(int))
+    
+    prescriptions_df.insert(0, "prescription_id", np.arange(start_id, start_id + n))
+    prescriptions_df["expected_interval_days"] = expected_interval
+    prescriptions_df["actual_interval_days"] = actual_interval
+    return prescriptions_df
+
+@traced()
+def generate_adherence(patients_df, prescriptions_df, rng=None, seed=None, transactions_df=None):
+    """生成用药依从性数据 (向量化)
+
+    传入 transactions_df 时依从率取自取药记录计算的PDC (见 adherence.compute_pdc),
+    否则按年龄和疾病类型估算。
+    """
+    rng = _get_rng(rng, seed, "adherence")
+    refill_gap = None
+    if transactions_df is not None:
+        pdc = patient_adherence(compute_pdc(transactions_df, prescriptions_df))
+        pdc = pdc.reindex(patients_df["patient_id"].to_numpy())
+        adherence_rate = pdc["pdc"].fillna(0.0).to_numpy()
+        refill_gap = pdc["max_gap_days"].fillna(0).to_numpy(dtype=np.int64)
+    else:
+        factors = DATA_GENERATION["adherence_factors"]
+        age = patients_df["age"].to_numpy(dtype=float)
         
         # 基础依从率 (年龄越大依从性越好)
-        base_adherence = 0.7 + (age - 50) * DATA_GENERATION["adherence_factors"]["age_effect"] / 100
+        base_adherence = 0.7 + (age - 50) * factors["age_effect"] / 100
         
         # 疾病类型影响
-        disease_effect = DATA_GENERATION["adherence_factors"]["disease_effect"].get(disease, 0)
-        adherence_rate = min(0.95, max(0.3, base_adherence + disease_effect))
-        
-        # 患者自主反馈 (1-5星)
-        feedback_score = random.choices(
-            [1, 2, 3, 4, 5],
-            weights=[0.1, 0.2, 0.3, 0.25, 0.15]
-        )[0]
-        
-        # 计算最终依从性评分
-        adherence_score = min(1.0, adherence_rate * (0.9 + (feedback_score - 1) * 0.05))
-        
-        adherence_data.append({
-            "patient_id": pid,
-            "adherence_rate": round(adherence_rate, 4),
-            "feedback_score": feedback_score,
-            "adherence_score": round(adherence_score, 4),
-            "last_updated": DATA_GENERATION["end_date"]
-        })
+        disease = patients_df["primary_disease"].astype("category")
+        effect_by_code = np.array(
+            [factors["disease_effect"].get(d, 0) for d in disease.cat.categories] + [0.0]
+        )
+        disease_effect = effect_by_code[disease.cat.codes.to_numpy()]
+        adherence_rate = np.clip(base_adherence + disease_effect, 0.3, 0.95)
     
-    return pd.DataFrame(adherence_data)
-
-def generate_all_data():
-    """生成所有测试数据"""
-    print("Generating patient data...")
-    patients_df = generate_patients(DATA_GENERATION["num_patients"])
+    # 患者自主反馈 (1-5星)
+    feedback_weights = np.cumsum([0.1, 0.2, 0.3, 0.25, 0.15])
+    feedback_score = np.searchsorted(
+        feedback_weights / feedback_weights[-1], rng.random(len(patients_df)), side="right"
+    ) + 1
     
-    print("Generating transaction data...")
-    transactions_df = generate_transactions(patients_df)
+    # 计算最终依从性评分
+    adherence_score = np.minimum(1.0, adherence_rate * (0.9 + (feedback_score - 1) * 0.05))
     
-    print("Generating prescription data...")
-    prescriptions_df = generate_prescriptions(transactions_df)
+    adherence_df = pd.DataFrame({
+        "patient_id": patients_df["patient_id"].to_numpy(),
+        "adherence_rate": np.round(adherence_rate, 4),
+        "feedback_score": feedback_score,
+        "adherence_score": np.round(adherence_score, 4),
+        "last_updated": DATA_GENERATION["end_date"]
+    })
+    if refill_gap is not None:
+        adherence_df.insert(4, "max_refill_gap_days", refill_gap)
+    return adherence_df
+
+def iter_data_batches(num_patients, batch_size=None, rng=None, seed=None, include_pii=True):
+    """按患者批次流式生成四张表, 每批只保留当前批次的数据"""
+    rng = _get_rng(rng, seed)
+    batch_size = batch_size or DATA_GENERATION.get("batch_size", 100000)
+    pii_pool = None
+    if include_pii:
+        pii_pool = _build_pii_pool(
+            DATA_GENERATION.get("pii_pool_size", 5000), seed=int(rng.integers(0, 2**31 - 1))
+        )
     
-    print("Generating adherence data...")
-    adherence_df = generate_adherence(patients_df, prescriptions_df)
+    next_transaction_id = 1
+    next_prescription_id = 1
+    for start in range(0, num_patients, batch_size):
+        size = min(batch_size, num_patients - start)
+        patients_df = generate_patients(
+            size, rng=rng, include_pii=include_pii, start_id=start + 1, pii_pool=pii_pool
+        )
+        transactions_df = generate_transactions(patients_df, rng=rng, start_id=next_transaction_id)
+        prescriptions_df = generate_prescriptions(transactions_df, rng=rng, start_id=next_prescription_id)
+        adherence_df = generate_adherence(patients_df, prescriptions_df, rng=rng, transactions_df=transactions_df)
+        
+        next_transaction_id += len(transactions_df)
+        next_prescription_id += len(prescriptions_df)
+        yield {
+            "patients": patients_df,
+            "transactions": transactions_df,
+            "prescriptions": prescriptions_df,
+            "adherence": adherence_df
+        }
+
+def write_batches(batches, output_dir="../data", fmt=None):
+    """逐批写入分区文件并原样向下游传递批次"""
+    fmt = fmt or DATA_GENERATION.get("storage_format", "parquet")
+    for part, batch in enumerate(batches):
+        for table, df in batch.items():
+            with span("write_partition", table=table, part=part, rows=len(df)):
+                write_partition(df, output_dir, table, part, fmt)
+        print(f"Batch {part}: wrote {len(batch['patients'])} patients, "
+              f"{len(batch['transactions'])} transactions")
+        yield batch
+
+def run_generation_pipeline(num_patients, output_dir="../data", batch_size=None, rng=None, seed=None,
+                            include_pii=True, fmt=None):
+    """流式生成并逐批写入分区文件, 峰值内存只取决于批次大小"""
+    rows = {}
+    batches = iter_data_batches(num_patients, batch_size, rng, seed, include_pii)
+    for batch in write_batches(batches, output_dir, fmt):
+        for table, df in batch.items():
+            rows[table] = rows.get(table, 0) + len(df)
+    return rows
+
+def generate_all_data(seed=None, include_pii=True, batch_size=None, output_dir="../data", return_frames=True,
+                      fmt=None):
+    """生成所有测试数据 (流式管道的薄封装)"""
+    if not return_frames:
+        rows = run_generation_pipeline(
+            DATA_GENERATION["num_patients"], output_dir, batch_size, seed=seed, include_pii=include_pii,
+            fmt=fmt
+        )
+        print(f"Data generation complete! {rows}")
+        return None
     
-    # 保存数据
-    patients_df.to_csv("../data/patients.csv", index=False)
-    transactions_df.to_csv("../data/transactions.csv", index=False)
-    prescriptions_df.to_csv("../data/prescriptions.csv", index=False)
-    adherence_df.to_csv("../data/adherence.csv", index=False)
+    # 需要返回完整数据框时才保留各批次
+    print("Generating data in patient batches...")
+    frames = {"patients": [], "transactions": [], "prescriptions": [], "adherence": []}
+    batches = iter_data_batches(DATA_GENERATION["num_patients"], batch_size, seed=seed, include_pii=include_pii)
+    for batch in write_batches(batches, output_dir, fmt):
+        for table, df in batch.items():
+            frames[table].append(df)
     
     print("Data generation complete!")
     
-    return patients_df, transactions_df, prescriptions_df, adherence_df
+    return tuple(
+        pd.concat(frames[table], ignore_index=True)
+        for table in ("patients", "transactions", "prescriptions", "adherence")
+    )
 
 if __name__ == "__main__":
-    generate_all_data()
+    generate_all_data(return_frames=False)
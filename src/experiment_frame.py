@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+GROUP_COL = "group"
+FLAG_COLUMNS = ["converted_user", "is_chronic", "converted"]
+SEGMENT_COLUMNS = ["primary_disease", "gender", "age_band", "region", "chronic_type"]
+DATE_COLUMNS = ["date", "join_date", "transaction_date", "first_prescription_date", "last_updated"]
+
+# float32 舍入误差相对列标准差的上限; 超出时保留 float64
+FLOAT32_RTOL = 1e-5
+
+def _float32_safe(values):
+    """判断浮点列降为 float32 后的舍入误差相对列标准差是否可以忽略
+
+    float32 逐值的相对误差约 6e-8, 任何列都满足逐值的相对误差阈值, 因此按标准差衡量:
+    均值、方差与检验统计量只受 rtol * sd 量级的扰动; 取值集中在一个大数附近的列保留 float64。
+    """
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return True
+    if np.abs(finite).max() > np.finfo(np.float32).max:
+        return False
+    roundtrip = finite.astype(np.float32).astype(np.float64)
+    return bool(np.abs(roundtrip - finite).max() <= FLOAT32_RTOL * finite.std())
+
+def compact_frame(df, group_col=GROUP_COL, segment_cols=None, flag_cols=None, date_cols=None,
+                  downcast_metrics=True):
+    """压缩实验数据的内存表示: 分组/细分列转为分类编码, 标志列转为布尔, 指标列安全时降为float32
+
+    日期列 (CSV中为字符串) 解析为 datetime64, 不编码为无序分类, 以便按日期取最值和排序。
+    """
+    segment_cols = SEGMENT_COLUMNS if segment_cols is None else segment_cols
+    flag_cols = FLAG_COLUMNS if flag_cols is None else flag_cols
+    date_cols = DATE_COLUMNS if date_cols is None else date_cols
+    dtypes = {}
+    dates = {}
+
+    for col in df.columns:
+        series = df[col]
+        if col in date_cols:
+            if not pd.api.types.is_datetime64_any_dtype(series.dtype):
+                dates[col] = pd.to_datetime(series)
+        elif col == group_col or col in segment_cols:
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                dtypes[col] = "category"
+        elif col in flag_cols:
+            if series.dtype != bool and not series.isna().any():
+                dtypes[col] = bool
+        elif pd.api.types.is_float_dtype(series.dtype):
+            if downcast_metrics and series.dtype == np.float64 and _float32_safe(series.to_numpy()):
+                dtypes[col] = np.float32
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            downcast = pd.to_numeric(series, downcast="integer")
+            if downcast.dtype != series.dtype:
+                dtypes[col] = downcast.dtype
+        elif series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            # 其他低基数字符串列同样编码为分类
+            if series.nunique(dropna=True) <= len(series) // 2:
+                dtypes[col] = "category"
+
+    if dtypes:
+        df = df.astype(dtypes)
+    return df.assign(**dates) if dates else df
+
+class ExperimentFrame:
+    """实验数据的共享内存表示: 预先计算各组的行索引, 供分析、报告和可视化模块复用
+
+    入口 (CLI、流水线、ExperimentRunner) 加载数据时用 read() 构建一次压缩表示,
+    再把同一个对象传给 StatisticalAnalyzer / BusinessReportGenerator / ABTestVisualizer。
+    """
+
+    def __init__(self, df, group_col=GROUP_COL, compact=True, **compact_options):
+        self.group_col = group_col
+        self.df = compact_frame(df, group_col, **compact_options) if compact else df
+
+        # 分组编码只计算一次, 之后按组取数都通过整数索引完成
+        groups = self.df[group_col]
+        categorical = groups if isinstance(groups.dtype, pd.CategoricalDtype) else groups.astype("category")
+        self._set_groups(categorical.cat.codes.to_numpy(), list(categorical.cat.categories))
+
+    def _set_groups(self, codes, groups):
+        self.group_codes = codes
+        self.groups = groups
+        self.group_indices = {group: np.flatnonzero(codes == i) for i, group in enumerate(groups)}
+
+    @classmethod
+    def wrap(cls, df, group_col=GROUP_COL, compact=False):
+        """已是 ExperimentFrame 时原样返回; 普通数据框默认只建立分组索引, 不改变列类型"""
+        if isinstance(df, cls) or df is None:
+            return df
+        return cls(df, group_col, compact=compact)
+
+    @classmethod
+    def read(cls, paths, group_col=GROUP_COL, **compact_options):
+        """读取一个或多个CSV/Parquet文件或目录, 构建压缩表示"""
+        from storage import read_table
+        paths = [paths] if isinstance(paths, str) else list(paths)
+        frames = [read_table(path) for path in paths]
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        return cls(df, group_col, **compact_options)
+
+    def take(self, positions):
+        """按行位置取子集, 复用已有的分组编码而不重新编码分组列"""
+        frame = object.__new__(type(self))
+        frame.group_col = self.group_col
+        frame.df = self.df.iloc[positions]
+        frame._set_groups(self.group_codes[positions], self.groups)
+        return frame
+
+    def group_key(self, start=None, stop=None):
+        """某一行区间的分组键 (由预先计算的编码构造的分类序列), 供分组汇总直接使用"""
+        codes = self.group_codes[start:stop]
+        return pd.Series(pd.Categorical.from_codes(codes, categories=self.groups),
+                         index=self.df.index[start:stop], name=self.group_col)
+
+    @property
+    def shape(self):
+        return self.df.shape
+
+    def __len__(self):
+        return len(self.df)
+
+    def _index(self, group):
+        """某组的行位置, 不存在的组返回空索引"""
+        return self.group_indices.get(group, np.empty(0, dtype=np.intp))
+
+    def group_size(self, group):
+        """某组的行数"""
+        return len(self._index(group))
+
+    def rows(self, group):
+        """某组的全部行"""
+        return self.df.iloc[self._index(group)]
+
+    def values(self, group, col, dtype=None):
+        """某组某列的取值数组"""
+        values = self.df[col].to_numpy()[self._index(group)]
+        return values if dtype is None else values.astype(dtype)
+
+    def group_sum(self, group, col):
+        """某组某列的合计 (按 float64 累加)"""
+        return self.values(group, col, dtype=np.float64).sum()
+
+    def memory_usage(self):
+        """当前表示占用的字节数"""
+        return int(self.df.memory_usage(deep=True).sum())
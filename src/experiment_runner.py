@@ -0,0 +1,84 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from config import AB_TEST_CONFIG
+from experiment_frame import ExperimentFrame
+from statistical_analysis import StatisticalAnalyzer
+from business_report import BusinessReportGenerator
+from tracing import pool_map
+
+EXPERIMENT_COL = "experiment_name"
+
+# 工作进程共享的数据; fork 启动时子进程以写时复制方式直接继承, 不做序列化
+_SHARED = {}
+
+def _set_shared(metrics, users):
+    """加载共享数据 (ExperimentFrame) 并预先计算各实验的行索引"""
+    _SHARED["metrics"] = metrics
+    _SHARED["users"] = users
+    _SHARED["metrics_index"] = _experiment_index(metrics.df)
+    _SHARED["user_index"] = _experiment_index(users.df)
+
+def _experiment_index(df):
+    """各实验对应的行位置; 数据中没有实验列时所有实验共用整张表"""
+    if EXPERIMENT_COL not in df.columns:
+        return None
+    return df.groupby(EXPERIMENT_COL, observed=True).indices
+
+def _experiment_rows(frame, index, experiment_name):
+    """按预计算的行索引取出某个实验的数据, 分组编码沿用共享数据的结果"""
+    if index is None:
+        return frame
+    return frame.take(index.get(experiment_name, np.empty(0, dtype=np.intp)))
+
+def run_experiment(config):
+    """分析并生成单个实验的报告数据框; 分析与报告使用同一个 ExperimentFrame"""
+    name = config["experiment_name"]
+    metrics = _experiment_rows(_SHARED["metrics"], _SHARED["metrics_index"], name)
+    users = _experiment_rows(_SHARED["users"], _SHARED["user_index"], name)
+
+    results_df = StatisticalAnalyzer(metrics, users, config=config).analyze_all_metrics()
+    report_df = BusinessReportGenerator(metrics, results_df, config).generate_report_dataframe()
+    report_df.insert(0, EXPERIMENT_COL, name)
+    return report_df
+
+class ExperimentRunner:
+    """并行运行多个实验: 共享数据只加载一次, 各实验的分析与报告在进程池中执行"""
+
+    def __init__(self, configs, metrics_df, user_df, processes=None):
+        # 未指定的配置项沿用 AB_TEST_CONFIG
+        self.configs = [{**AB_TEST_CONFIG, **config} for config in configs]
+        names = [config["experiment_name"] for config in self.configs]
+        if len(set(names)) != len(names):
+            raise ValueError("experiment_name must be unique across configs")
+        # 加载时构建一次压缩表示, 所有实验与工作进程共用
+        self.metrics = ExperimentFrame.wrap(metrics_df, compact=True)
+        self.users = ExperimentFrame.wrap(user_df, compact=True)
+        self.processes = processes or os.cpu_count() or 1
+
+    @classmethod
+    def from_csv(cls, configs, metrics_path, user_path, processes=None):
+        """从CSV加载共享数据 (整个运行只读取一次)"""
+        metrics_df = pd.read_csv(metrics_path, parse_dates=["date"])
+        user_df = pd.read_csv(user_path)
+        return cls(configs, metrics_df, user_df, processes)
+
+    def run(self):
+        """运行全部实验并合并为一张结果表"""
+        _set_shared(self.metrics, self.users)
+        workers = min(self.processes, len(self.configs))
+        if workers <= 1:
+            reports = [run_experiment(config) for config in self.configs]
+            return pd.concat(reports, ignore_index=True)
+
+        # fork 下子进程直接继承 _SHARED; 其他启动方式通过 initializer 每个进程传递一次
+        if "fork" in multiprocessing.get_all_start_methods():
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+        else:
+            pool = ProcessPoolExecutor(workers, initializer=_set_shared,
+                                       initargs=(self.metrics, self.users))
+        with pool:
+            reports = pool_map(pool, run_experiment, self.configs)
+        return pd.concat(reports, ignore_index=True)
@@ -0,0 +1,122 @@
+import os
+import json
+import tempfile
+import warnings
+import pandas as pd
+from config import AB_TEST_CONFIG, QUANTILE_SKETCH
+from statistical_analysis import (
+    GROUP_COL, CHRONIC_COL, configured_metrics,
+    compute_group_stats, to_moments, merge_moments, results_from_moments
+)
+
+CHECKPOINT_VERSION = 1
+
+class IncrementalAnalyzer:
+    """逐日增量分析: 每天只扫描新增批次, 与持久化的分组矩合并后输出结果表"""
+
+    def __init__(self, checkpoint_path=None, config=None):
+        self.config = config or AB_TEST_CONFIG
+        self.checkpoint_path = checkpoint_path
+        self.moments = None
+        self.sketches = None
+        self.ingested_batches = []
+
+        # 存在检查点时自动恢复, 便于每日任务中断后重启
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            self.restore(checkpoint_path)
+
+    def _metric_columns(self):
+        """需要累积的指标列"""
+        return configured_metrics(self.config)
+
+    def ingest(self, batch_df, batch_id=None):
+        """合并新一天的用户数据并返回更新后的结果表"""
+        # 同一批次重复提交时跳过, 保证重跑幂等
+        if batch_id is not None and batch_id in self.ingested_batches:
+            warnings.warn(f"Batch {batch_id!r} already ingested, skipping", stacklevel=2)
+            return self.results()
+
+        batch_stats = compute_group_stats(batch_df, self._metric_columns(), by=(GROUP_COL, CHRONIC_COL))
+        self.moments = merge_moments(self.moments, to_moments(batch_stats))
+
+        # 偏态指标的分位数草图与矩一起逐日合并
+        sketch_cols = [c for c in QUANTILE_SKETCH["metrics"] if c in batch_df.columns]
+        if sketch_cols:
+            from quantile_sketch import compute_group_sketches, merge_sketch_tables
+            batch_sketches = compute_group_sketches(batch_df, sketch_cols, by=(GROUP_COL, CHRONIC_COL))
+            self.sketches = merge_sketch_tables(self.sketches, batch_sketches)
+        self.ingested_batches.append(batch_id)
+
+        if self.checkpoint_path:
+            self.checkpoint()
+        return self.results()
+
+    def results(self):
+        """基于当前累积矩生成结果表"""
+        if self.moments is None:
+            raise ValueError("No batches ingested yet")
+        return results_from_moments(self.moments, self.config)
+
+    def quantile_results(self, quantiles=None):
+        """基于累积的分位数草图生成分位数效应表"""
+        if self.sketches is None:
+            raise ValueError("No quantile sketches accumulated yet")
+        from quantile_sketch import quantile_results
+        return quantile_results(self.sketches, self.config, quantiles)
+
+    def checkpoint(self, path=None):
+        """将累积状态原子地写入本地JSON文件"""
+        path = path or self.checkpoint_path
+        if path is None:
+            raise ValueError("No checkpoint path configured")
+
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "experiment_name": self.config["experiment_name"],
+            "ingested_batches": self.ingested_batches,
+            "index_names": list(self.moments.index.names),
+            "moments": json.loads(
+                self.moments.stack(level=0, future_stack=True)
+                .rename_axis(self.moments.index.names + ["metric"])
+                .reset_index().to_json(orient="records", double_precision=15)
+            )
+        }
+        if self.sketches is not None:
+            from quantile_sketch import sketches_to_records
+            state["sketch_index_names"] = list(self.sketches.index.names)
+            state["sketches"] = sketches_to_records(self.sketches)
+
+        # 先写临时文件再替换, 避免任务中断时留下半个检查点
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return path
+
+    def restore(self, path=None):
+        """从本地检查点恢复累积状态"""
+        path = path or self.checkpoint_path
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version: {state.get('version')}")
+        if state["experiment_name"] != self.config["experiment_name"]:
+            raise ValueError(f"Checkpoint belongs to experiment {state['experiment_name']!r}")
+
+        index_names = state["index_names"]
+        records = pd.DataFrame(state["moments"])
+        moments = records.pivot_table(
+            index=index_names, columns="metric", values=["count", "mean", "m2"], dropna=False
+        )
+        self.moments = moments.swaplevel(axis=1).sort_index(axis=1)
+        if state.get("sketches"):
+            from quantile_sketch import sketches_from_records
+            self.sketches = sketches_from_records(state["sketches"], state["sketch_index_names"])
+        self.ingested_batches = state["ingested_batches"]
+        return self
@@ -0,0 +1,211 @@
+import os
+import ast
+import json
+import time
+import shutil
+import hashlib
+import functools
+from config import AB_TEST_CONFIG, DATA_GENERATION
+from tracing import span
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+SUCCESS_MARKER = "_SUCCESS"
+
+def _hash_file(path, digest):
+    """按块将文件内容写入摘要"""
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+def hash_path(path):
+    """文件或目录内容的摘要 (目录按相对路径排序后逐个文件计算)"""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                digest.update(os.path.relpath(full, path).encode())
+                _hash_file(full, digest)
+    else:
+        _hash_file(path, digest)
+    return digest.hexdigest()
+
+def _local_imports(module):
+    """模块中 (含函数内延迟导入) 引用的 src 下的其他模块"""
+    with open(os.path.join(SRC_DIR, module), encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=module)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return {f"{name}.py" for name in names if os.path.isfile(os.path.join(SRC_DIR, f"{name}.py"))}
+
+def module_closure(modules):
+    """入口模块及其传递导入的全部 src 模块 (按文件名排序)"""
+    seen, pending = set(), list(modules)
+    while pending:
+        module = pending.pop()
+        if module not in seen:
+            seen.add(module)
+            pending.extend(_local_imports(module) - seen)
+    return sorted(seen)
+
+class Stage:
+    """流水线阶段: 缓存键由配置切片、相关源码、输入文件内容和上游阶段的键共同决定
+
+    code 只需列出阶段的入口模块, 其 (传递) 导入的 src 模块会自动计入缓存键。
+    """
+
+    def __init__(self, name, run, deps=(), config=None, code=(), inputs=()):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.config = config or {}
+        self.code = module_closure(code)
+        self.inputs = list(inputs)
+
+    def cache_key(self, dep_keys):
+        """计算本阶段的内容寻址缓存键"""
+        digest = hashlib.sha256()
+        digest.update(self.name.encode())
+        digest.update(json.dumps(self.config, sort_keys=True, ensure_ascii=False, default=str).encode())
+        for module in self.code:
+            digest.update(module.encode())
+            _hash_file(os.path.join(SRC_DIR, module), digest)
+        for path in self.inputs:
+            digest.update(hash_path(path).encode())
+        for dep in self.deps:
+            digest.update(dep_keys[dep].encode())
+        return digest.hexdigest()
+
+class PipelineRunner:
+    """按依赖图运行各阶段, 产物存放在 <cache_dir>/<stage>/<key>/ 下, 键未变化的阶段直接复用"""
+
+    def __init__(self, stages, cache_dir=".cache/pipeline"):
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.status = []
+
+    def _order(self, targets):
+        """目标阶段及其所有上游阶段的拓扑顺序"""
+        order, visiting = [], set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle detected at stage {name!r}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in targets:
+            visit(name)
+        return order
+
+    def run(self, targets=None, force=()):
+        """运行目标阶段, 返回各阶段产物目录"""
+        targets = targets or list(self.stages)
+        keys, outputs = {}, {}
+        self.status = []
+
+        for name in self._order(targets):
+            stage = self.stages[name]
+            keys[name] = stage.cache_key(keys)
+            out_dir = os.path.join(self.cache_dir, name, keys[name][:16])
+            outputs[name] = out_dir
+
+            start = time.perf_counter()
+            if name not in force and os.path.exists(os.path.join(out_dir, SUCCESS_MARKER)):
+                state = "cached"
+            else:
+                # 先写入临时目录, 完成后再改名, 中断的阶段不会被当作缓存命中
+                tmp_dir = out_dir + ".tmp"
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                os.makedirs(tmp_dir)
+                with span(f"stage:{name}", key=keys[name][:16]):
+                    stage.run(tmp_dir, {dep: outputs[dep] for dep in stage.deps})
+                open(os.path.join(tmp_dir, SUCCESS_MARKER), "w").close()
+                shutil.rmtree(out_dir, ignore_errors=True)
+                os.replace(tmp_dir, out_dir)
+                state = "ran"
+            self.status.append({"stage": name, "status": state, "key": keys[name][:16],
+                                "seconds": round(time.perf_counter() - start, 3)})
+        return outputs
+
+    def summary(self):
+        """各阶段是否运行或命中缓存"""
+        return "\n".join(
+            f"{s['stage']:<12} {s['status']:<7} {s['key']}  {s['seconds']:.3f}s" for s in self.status
+        )
+
+def _run_generate(out_dir, deps):
+    from data_generator import run_generation_pipeline
+    run_generation_pipeline(DATA_GENERATION["num_patients"], out_dir, include_pii=False)
+
+@functools.lru_cache(maxsize=2)
+def _read_frame(path, signature):
+    """读取并压缩实验数据; signature 为文件状态, 同一次运行中报告与可视化阶段共用同一个对象"""
+    from experiment_frame import ExperimentFrame
+    return ExperimentFrame.read(path)
+
+def _file_signature(path):
+    """文件或目录下所有文件的 (路径, 修改时间, 大小), 内容变化后不会复用旧对象"""
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    return tuple((f, os.stat(f).st_mtime_ns, os.stat(f).st_size) for f in files)
+
+def _load_frame(path):
+    return _read_frame(path, _file_signature(path))
+
+def _analyze_stage(users_path):
+    def run(out_dir, deps):
+        from statistical_analysis import StatisticalAnalyzer
+        results_df = StatisticalAnalyzer(None, _load_frame(users_path)).analyze_all_metrics()
+        results_df.to_csv(os.path.join(out_dir, "results.csv"), index=False)
+    return run
+
+def _report_stage(metrics_path):
+    def run(out_dir, deps):
+        import pandas as pd
+        from business_report import BusinessReportGenerator
+        results_df = pd.read_csv(os.path.join(deps["analyze"], "results.csv"))
+        generator = BusinessReportGenerator(_load_frame(metrics_path), results_df, AB_TEST_CONFIG)
+        generator.generate_report_dataframe().to_csv(os.path.join(out_dir, "report.csv"), index=False)
+        with open(os.path.join(out_dir, "report.json"), "w", encoding="utf-8") as f:
+            generator.write_report_json(f)
+        with open(os.path.join(out_dir, "report.html"), "w", encoding="utf-8") as f:
+            generator.write_report_html(f)
+    return run
+
+def _visualize_stage(metrics_path):
+    def run(out_dir, deps):
+        import pandas as pd
+        from visualization import ABTestVisualizer
+        metrics = _load_frame(metrics_path)
+        results_df = pd.read_csv(os.path.join(deps["analyze"], "results.csv"))
+        timeseries_df = metrics.df if "date" in metrics.df.columns else None
+        ABTestVisualizer(metrics, results_df).render_all(out_dir, timeseries_df=timeseries_df, processes=1)
+    return run
+
+def build_default_pipeline(users_path, metrics_path, cache_dir=".cache/pipeline"):
+    """默认流水线: generate、analyze → report / visualize"""
+    analysis_config = {k: AB_TEST_CONFIG[k] for k in
+                       ["metrics", "significance_level", "traffic_allocation"]}
+    report_config = {k: AB_TEST_CONFIG[k] for k in
+                     ["experiment_name", "metrics", "groups", "test_duration", "significance_level"]}
+    stages = [
+        Stage("generate", _run_generate, config=DATA_GENERATION, code=["data_generator.py"]),
+        Stage("analyze", _analyze_stage(users_path), config=analysis_config,
+              code=["statistical_analysis.py", "experiment_frame.py"], inputs=[users_path]),
+        Stage("report", _report_stage(metrics_path), deps=["analyze"], config=report_config,
+              code=["business_report.py", "experiment_frame.py"], inputs=[metrics_path]),
+        Stage("visualize", _visualize_stage(metrics_path), deps=["analyze"],
+              code=["visualization.py", "experiment_frame.py"], inputs=[metrics_path])
+    ]
+    return PipelineRunner(stages, cache_dir)
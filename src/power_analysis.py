@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+from scipy import special
+from config import AB_TEST_CONFIG, POWER_ANALYSIS
+from statistical_analysis import ztest_from_moments, welch_from_moments, _arm, CONVERSION_COL
+
+# 每个模拟批次最多生成的 (模拟次数 × 情景数) 元素个数
+SIM_BLOCK_SIZE = 2000000
+
+def _arms(n_total, allocation):
+    """按流量分配比例拆分两组样本量 (allocation 为实验组占比)"""
+    n_total = np.asarray(n_total, dtype=float)
+    return n_total * (1 - allocation), n_total * allocation
+
+def _z(alpha, power=None):
+    """双侧检验的临界值, 以及目标功效对应的分位数"""
+    z_alpha = special.ndtri(1 - np.asarray(alpha) / 2)
+    return z_alpha if power is None else (z_alpha, special.ndtri(power))
+
+def _two_sided_power(delta, se_null, se_alt, alpha):
+    """H1 下统计量落入双侧拒绝域的概率"""
+    z_alpha = _z(alpha)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (special.ndtr((np.abs(delta) - z_alpha * se_null) / se_alt)
+                + special.ndtr((-np.abs(delta) - z_alpha * se_null) / se_alt))
+
+def power_proportions(baseline_rate, relative_effect, n_total, allocation=0.5, alpha=0.05):
+    """两比例z检验的解析功效 (参数可广播)"""
+    p_control = np.asarray(baseline_rate, dtype=float)
+    p_treatment = p_control * (1 + np.asarray(relative_effect, dtype=float))
+    n_control, n_treatment = _arms(n_total, allocation)
+    pooled = (p_control * n_control + p_treatment * n_treatment) / (n_control + n_treatment)
+    se_null = np.sqrt(pooled * (1 - pooled) * (1 / n_control + 1 / n_treatment))
+    se_alt = np.sqrt(p_control * (1 - p_control) / n_control + p_treatment * (1 - p_treatment) / n_treatment)
+    return _two_sided_power(p_treatment - p_control, se_null, se_alt, alpha)
+
+def power_means(baseline_mean, baseline_sd, relative_effect, n_total, allocation=0.5, alpha=0.05):
+    """两组均值比较的解析功效 (正态近似, 两组标准差相同)"""
+    delta = np.asarray(baseline_mean, dtype=float) * np.asarray(relative_effect, dtype=float)
+    n_control, n_treatment = _arms(n_total, allocation)
+    se = np.asarray(baseline_sd, dtype=float) * np.sqrt(1 / n_control + 1 / n_treatment)
+    return _two_sided_power(delta, se, se, alpha)
+
+def sample_size_proportions(baseline_rate, relative_effect, allocation=0.5, alpha=0.05, power=0.8):
+    """达到目标功效所需的两组总样本量 (两比例z检验)"""
+    z_alpha, z_power = _z(alpha, power)
+    p_control = np.asarray(baseline_rate, dtype=float)
+    p_treatment = p_control * (1 + np.asarray(relative_effect, dtype=float))
+    allocation = np.asarray(allocation, dtype=float)
+    pooled = (1 - allocation) * p_control + allocation * p_treatment
+
+    # 每单位总样本量下 H0/H1 的方差
+    var_null = pooled * (1 - pooled) * (1 / (1 - allocation) + 1 / allocation)
+    var_alt = p_control * (1 - p_control) / (1 - allocation) + p_treatment * (1 - p_treatment) / allocation
+    with np.errstate(divide="ignore"):
+        n_total = (z_alpha * np.sqrt(var_null) + z_power * np.sqrt(var_alt)) ** 2 / (p_treatment - p_control) ** 2
+    return np.ceil(n_total)
+
+def sample_size_means(baseline_mean, baseline_sd, relative_effect, allocation=0.5, alpha=0.05, power=0.8):
+    """达到目标功效所需的两组总样本量 (均值比较)"""
+    z_alpha, z_power = _z(alpha, power)
+    delta = np.asarray(baseline_mean, dtype=float) * np.asarray(relative_effect, dtype=float)
+    allocation = np.asarray(allocation, dtype=float)
+    variance = np.asarray(baseline_sd, dtype=float) ** 2 * (1 / (1 - allocation) + 1 / allocation)
+    with np.errstate(divide="ignore"):
+        return np.ceil((z_alpha + z_power) ** 2 * variance / delta ** 2)
+
+def _simulate(draw_pvalues, n_scenarios, alpha, n_sims):
+    """分块执行批量模拟, 返回每个情景 p<alpha 的比例"""
+    rejections = np.zeros(n_scenarios)
+    block = max(1, SIM_BLOCK_SIZE // max(n_scenarios, 1))
+    for start in range(0, n_sims, block):
+        size = min(block, n_sims - start)
+        rejections += (draw_pvalues(size) < alpha).sum(axis=0)
+    return rejections / n_sims
+
+def simulate_power_proportions(baseline_rate, relative_effect, n_control, n_treatment, alpha=0.05,
+                               n_sims=2000, rng=None, seed=None):
+    """蒙特卡洛功效: 每个情景一次性抽取 n_sims 次实验的转化数, 复用向量化z检验"""
+    rng = rng or np.random.default_rng(seed)
+    p_control, effect, n_control, n_treatment = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float).ravel() for x in (baseline_rate, relative_effect, n_control, n_treatment)]
+    )
+    p_treatment = p_control * (1 + effect)
+    n_control, n_treatment = np.round(n_control).astype(np.int64), np.round(n_treatment).astype(np.int64)
+
+    def draw(size):
+        rate_control = rng.binomial(n_control, p_control, size=(size, len(p_control))) / n_control
+        rate_treatment = rng.binomial(n_treatment, p_treatment, size=(size, len(p_control))) / n_treatment
+        return ztest_from_moments(n_control, rate_control, n_treatment, rate_treatment)[1]
+
+    return _simulate(draw, len(p_control), alpha, n_sims)
+
+def simulate_power_means(baseline_mean, baseline_sd, relative_effect, n_control, n_treatment, alpha=0.05,
+                         n_sims=2000, rng=None, seed=None):
+    """蒙特卡洛功效 (连续指标)
+
+    直接抽取样本均值与样本方差 (正态总体下分别服从正态分布和缩放卡方分布),
+    不生成逐用户数据, 再复用向量化Welch检验。
+    """
+    rng = rng or np.random.default_rng(seed)
+    mean, sd, effect, n_control, n_treatment = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float).ravel() for x in (baseline_mean, baseline_sd, relative_effect,
+                                                         n_control, n_treatment)]
+    )
+    n_control, n_treatment = np.round(n_control), np.round(n_treatment)
+    shape = len(mean)
+
+    def arm(size, mu, n):
+        means = rng.normal(mu, sd / np.sqrt(n), size=(size, shape))
+        variances = sd ** 2 * rng.chisquare(n - 1, size=(size, shape)) / (n - 1)
+        return means, variances
+
+    def draw(size):
+        mean_control, var_control = arm(size, mean, n_control)
+        mean_treatment, var_treatment = arm(size, mean * (1 + effect), n_treatment)
+        return welch_from_moments(n_control, mean_control, var_control, n_treatment, mean_treatment, var_treatment)[1]
+
+    return _simulate(draw, shape, alpha, n_sims)
+
+class PowerPlanner:
+    """实验功效与样本量规划: 在效应 × 流量分配 × 测试天数网格上同时给出解析与模拟结果"""
+
+    def __init__(self, config=None, planning=None):
+        self.config = config or AB_TEST_CONFIG
+        self.planning = {**POWER_ANALYSIS, **(planning or {})}
+        self.alpha = self.config["significance_level"]
+
+    @classmethod
+    def from_moments(cls, moments, metric_col=CONVERSION_COL, config=None, planning=None):
+        """以已有分析的对照组矩估计基线 (StatisticalAnalyzer.group_moments 的输出)"""
+        n, mean, var = _arm(moments, "control", metric_col)
+        planning = {**(planning or {}), "baseline_rate": mean}
+        if metric_col != CONVERSION_COL:
+            planning.update(baseline_mean=mean, baseline_sd=float(np.sqrt(var)))
+        return cls(config, planning)
+
+    def _defaults(self, effects, allocations, durations):
+        expected = self.config["expected_effect"]
+        effects = effects if effects is not None else [expected * m for m in self.planning["effect_multipliers"]]
+        allocations = allocations if allocations is not None else [self.config["traffic_allocation"]]
+        durations = durations if durations is not None else self.planning["durations"]
+        return effects, allocations, durations
+
+    def grid(self, effects=None, allocations=None, durations=None, simulate=True, n_sims=None, seed=None,
+             baseline_mean=None, baseline_sd=None):
+        """规划网格; 指定 baseline_sd 时按连续指标计算, 否则按转化率计算
+
+        planning["variance_reduction"] 为CUPED等协变量调整带来的方差缩减比例:
+        连续指标按缩减后的标准差计算, 转化率按等效样本量 n / (1 - 缩减比例) 近似。
+        """
+        effects, allocations, durations = self._defaults(effects, allocations, durations)
+        effect, allocation, duration = [a.ravel() for a in np.meshgrid(effects, allocations, durations,
+                                                                       indexing="ij")]
+        daily_users = self.planning["daily_users"]
+        target = self.planning["target_power"]
+        n_total = duration * daily_users
+        n_control, n_treatment = _arms(n_total, allocation)
+        remaining = 1 - self.planning.get("variance_reduction", 0.0)
+
+        baseline_sd = baseline_sd if baseline_sd is not None else self.planning.get("baseline_sd")
+        continuous = baseline_sd is not None
+        if continuous:
+            baseline_mean = baseline_mean if baseline_mean is not None else self.planning["baseline_mean"]
+            baseline_sd = baseline_sd * np.sqrt(remaining)
+            power = power_means(baseline_mean, baseline_sd, effect, n_total, allocation, self.alpha)
+            required = sample_size_means(baseline_mean, baseline_sd, effect, allocation, self.alpha, target)
+        else:
+            baseline = self.planning["baseline_rate"]
+            power = power_proportions(baseline, effect, n_total / remaining, allocation, self.alpha)
+            required = np.ceil(sample_size_proportions(baseline, effect, allocation, self.alpha, target) * remaining)
+
+        grid = pd.DataFrame({
+            "effect": effect,
+            "allocation": allocation,
+            "duration_days": duration,
+            "n_control": n_control.round().astype(np.int64),
+            "n_treatment": n_treatment.round().astype(np.int64),
+            "power_analytic": power,
+            "required_n_total": required,
+            "required_days": np.ceil(required / daily_users)
+        })
+
+        if simulate:
+            n_sims = n_sims or self.planning["n_sims"]
+            rng = np.random.default_rng(seed)
+            if continuous:
+                grid["power_simulated"] = simulate_power_means(
+                    baseline_mean, baseline_sd, effect, n_control, n_treatment, self.alpha, n_sims, rng)
+            else:
+                grid["power_simulated"] = simulate_power_proportions(
+                    baseline, effect, n_control / remaining, n_treatment / remaining, self.alpha, n_sims, rng)
+
+        # 每组样本量低于配置下限的情景
+        grid["below_min_sample"] = np.minimum(grid["n_control"], grid["n_treatment"]) < self.config["min_sample_size"]
+        return grid
+
+    def required_duration(self, effect=None, allocation=None):
+        """检测预期效应 (默认 expected_effect) 所需的测试天数"""
+        effect = self.config["expected_effect"] if effect is None else effect
+        allocation = self.config["traffic_allocation"] if allocation is None else allocation
+        required = sample_size_proportions(self.planning["baseline_rate"], effect, allocation,
+                                           self.alpha, self.planning["target_power"])
+        required = np.ceil(required * (1 - self.planning.get("variance_reduction", 0.0)))
+        per_arm = np.ceil(required * min(allocation, 1 - allocation))
+        if per_arm < self.config["min_sample_size"]:
+            required = np.ceil(self.config["min_sample_size"] / min(allocation, 1 - allocation))
+        return int(np.ceil(required / self.planning["daily_users"]))
@@ -0,0 +1,357 @@
+import functools
+import numpy as np
+import pandas as pd
+from scipy import special
+from config import QUANTILE_SKETCH
+from statistical_analysis import GROUP_COL
+from tracing import traced
+
+# uint32 桶计数的上限, 合并后超出时报错而不是静默回绕
+MAX_BIN_COUNT = np.iinfo(np.uint32).max
+
+def sketch_params(params=None):
+    """草图参数 (relative_accuracy, min_value, n_bins), 未指定的项取 QUANTILE_SKETCH"""
+    settings = {**QUANTILE_SKETCH, **(params or {})}
+    return float(settings["relative_accuracy"]), float(settings["min_value"]), int(settings["n_bins"])
+
+# 对数桶号的上限, 防止 inf 等极端值溢出
+MAX_MAGNITUDE_BIN = np.iinfo(np.int32).max
+
+def _layout(relative_accuracy, n_bins):
+    """对数桶的增长率 ln(gamma) 与每侧桶数; gamma = 1+a 时同一个桶内任意两个值的相对误差不超过 a"""
+    return np.log1p(relative_accuracy), (n_bins - 1) // 2
+
+def magnitude_bin(values, relative_accuracy, min_value):
+    """|x| -> 对数桶号 k: |x| 落在 (min_value·gamma^(k-1), min_value·gamma^k]; |x| < min_value 时为 -1"""
+    log_gamma, _ = _layout(relative_accuracy, 1)
+    magnitude = np.abs(values)
+    with np.errstate(divide="ignore"):
+        k = np.clip(np.ceil(np.log(magnitude / min_value) / log_gamma), 0, MAX_MAGNITUDE_BIN).astype(np.int64)
+    return np.where(magnitude < min_value, -1, k)
+
+def shift_for(max_magnitude, relative_accuracy, min_value, n_bins):
+    """使最大绝对值落在最外侧桶的偏移: 每侧只保留最大的 (n_bins-1)/2 个对数桶, 更小的并入零桶"""
+    top = magnitude_bin(np.asarray(max_magnitude, dtype=np.float64), relative_accuracy, min_value)
+    return np.maximum(top - (n_bins - 1) // 2 + 1, 0)
+
+def bin_index(values, relative_accuracy, min_value, n_bins, shift=0):
+    """值 -> 桶号: 零桶居中, 正值在右、负值在左, 桶号顺序与数值顺序一致
+
+    对数桶号 k >= shift 时属于该侧第 k-shift+1 个桶, 更小的绝对值 (含 |x| < min_value) 并入零桶。
+    """
+    _, half = _layout(relative_accuracy, n_bins)
+    k = magnitude_bin(values, relative_accuracy, min_value)
+    index = np.minimum(np.where(k < shift, 0, k - shift + 1), half)
+    return half + np.where(values < 0, -index, index)
+
+def bin_bounds(index, relative_accuracy, min_value, n_bins, shift=0):
+    """桶号 -> (下边界, 上边界); 零桶为 (-zero_threshold, zero_threshold)"""
+    log_gamma, half = _layout(relative_accuracy, n_bins)
+    signed = np.asarray(index) - half
+    zero = _zero_threshold(relative_accuracy, min_value, shift)
+    upper = np.where(signed == 0, zero, min_value * np.exp((np.abs(signed) + shift - 1) * log_gamma))
+    lower = np.where(signed == 0, -zero, upper * np.exp(-log_gamma))
+    negative = signed < 0
+    return np.where(negative, -upper, lower), np.where(negative, -lower, upper)
+
+def _zero_threshold(relative_accuracy, min_value, shift):
+    """零桶的绝对值上界: 未偏移时为 min_value, 偏移 shift 后为第 shift-1 个对数桶的上边界"""
+    return min_value * np.exp(max(shift - 1, 0) * np.log1p(relative_accuracy)) if shift else min_value
+
+def _rebase(counts, delta, half):
+    """将桶计数的偏移增加 delta: 两侧最靠近零的 delta 个桶并入零桶, 其余向零桶方向平移"""
+    counts = np.asarray(counts, dtype=np.uint64)
+    if delta <= 0:
+        return counts
+    d = min(delta, half)
+    rebased = np.zeros_like(counts)
+    rebased[half] = counts[half - d:half + d + 1].sum()
+    rebased[d:half] = counts[:half - d]
+    rebased[half + 1:2 * half + 1 - d] = counts[half + 1 + d:2 * half + 1]
+    return rebased
+
+class QuantileSketch:
+    """固定内存、可合并的分位数草图
+
+    采用对数分桶 (DDSketch 式): 桶边界按 gamma = 1+a 等比增长, 桶内插值得到的估计值与对应次序统计量
+    位于同一个桶内, 相对误差不超过 a。
+    计数数组长度固定 (默认2047个uint32, 约8KB), 每侧覆盖 gamma^1023 (a=1% 时约2.6万倍) 的动态范围:
+    桶窗口以已见的最大绝对值为上端 (shift), 更小的绝对值并入零桶 (DDSketch 的折叠存储),
+    因此相对误差保证只对绝对值不低于 zero_threshold 的分位数成立。
+    shift 只取决于全部数据的最大绝对值, 合并即对齐偏移后逐桶相加, 与直接对全部数据建草图的结果完全相同,
+    因此可以按分片、按天累加后再分析。
+    """
+
+    def __init__(self, relative_accuracy=None, min_value=None, n_bins=None):
+        self.relative_accuracy, self.min_value, self.n_bins = sketch_params({
+            key: value for key, value in
+            (("relative_accuracy", relative_accuracy), ("min_value", min_value), ("n_bins", n_bins))
+            if value is not None
+        })
+        self.counts = np.zeros(self.n_bins, dtype=np.uint32)
+        self.shift = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def params(self):
+        return self.relative_accuracy, self.min_value, self.n_bins
+
+    @property
+    def nbytes(self):
+        """桶计数占用的字节数 (与数据量无关)"""
+        return self.counts.nbytes
+
+    @property
+    def zero_threshold(self):
+        """绝对值不超过该值的样本记入零桶, 其分位数估计为0"""
+        return _zero_threshold(self.relative_accuracy, self.min_value, self.shift)
+
+    def _absorb(self, counts, total, low, high, shift=0):
+        """累加另一份 (偏移为 shift 的) 桶计数及其汇总量, 两者对齐到较大的偏移"""
+        half = (self.n_bins - 1) // 2
+        target = max(self.shift, int(shift))
+        merged = _rebase(self.counts, target - self.shift, half) + _rebase(counts, target - shift, half)
+        if merged.max(initial=0) > MAX_BIN_COUNT:
+            raise OverflowError("Quantile sketch bin count exceeds uint32 range")
+        self.counts = merged.astype(np.uint32)
+        self.shift = target
+        self.count = int(merged.sum())
+        self.sum += float(total)
+        self.min = min(self.min, float(low))
+        self.max = max(self.max, float(high))
+        return self
+
+    def add(self, values):
+        """加入一批数值 (忽略缺失值)"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values):
+            low, high = values.min(), values.max()
+            shift = max(self.shift, int(shift_for(max(-low, high), *self.params)))
+            counts = np.bincount(bin_index(values, *self.params, shift), minlength=self.n_bins)
+            self._absorb(counts, values.sum(), low, high, shift)
+        return self
+
+    def copy(self):
+        sketch = QuantileSketch(*self.params)
+        return sketch._absorb(self.counts, self.sum, self.min, self.max, self.shift)
+
+    def merge(self, other):
+        """返回两份草图合并后的新草图, 两者参数必须相同"""
+        if other.params != self.params:
+            raise ValueError(f"Cannot merge quantile sketches with different parameters: "
+                             f"{self.params} vs {other.params}")
+        return self.copy()._absorb(other.counts, other.sum, other.min, other.max, other.shift)
+
+    __add__ = merge
+
+    def _values_at_ranks(self, ranks):
+        """0起的 (可为小数的) 秩 -> 估计值
+
+        先定位秩所在的桶, 再按秩在桶内的位置在上下边界间做几何插值 (零桶取0),
+        估计值与真值位于同一个桶内; 对平滑分布, 插值误差远小于桶宽。
+        """
+        cumulative = np.cumsum(self.counts, dtype=np.int64)
+        bins = np.minimum(np.searchsorted(cumulative, ranks, side="right"), self.n_bins - 1)
+        counts = self.counts[bins].astype(np.float64)
+        fraction = np.clip((ranks - (cumulative[bins] - counts) + 0.5) / np.maximum(counts, 1), 0, 1)
+        lower, upper = bin_bounds(bins, *self.params, self.shift)
+        sign = np.sign(bins - self.n_bins // 2)
+        interpolated = sign * np.abs(lower) ** (1 - fraction) * np.abs(upper) ** fraction
+        return np.clip(interpolated, self.min, self.max)
+
+    def quantile(self, q):
+        """分位数估计 (q 可为数组); 空草图返回 NaN"""
+        q = np.asarray(q, dtype=np.float64)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        values = self._values_at_ranks(q * (self.count - 1))
+        return np.where(q <= 0, self.min, np.where(q >= 1, self.max, values))
+
+    def rank_interval(self, q, level=0.95):
+        """分位数的无分布置信区间
+
+        总体q分位数落在次序统计量 [X_(l), X_(u)] 之间的概率由二项分布决定,
+        l, u 取 nq ∓ z·sqrt(nq(1-q)) 的正态近似, 再从草图中读取这两个秩对应的值。
+        """
+        q = np.asarray(q, dtype=np.float64)
+        n = self.count
+        if n == 0:
+            return np.full(q.shape, np.nan), np.full(q.shape, np.nan)
+        spread = special.ndtri(0.5 + level / 2) * np.sqrt(n * q * (1 - q))
+        low_rank = np.clip(np.floor(n * q - spread) - 1, 0, n - 1)
+        high_rank = np.clip(np.ceil(n * q + spread) - 1, 0, n - 1)
+        return self._values_at_ranks(low_rank), self._values_at_ranks(high_rank)
+
+    def to_dict(self):
+        """可JSON序列化的稀疏表示, 只保存非零桶"""
+        bins = np.flatnonzero(self.counts)
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "min_value": self.min_value,
+            "n_bins": self.n_bins,
+            "shift": self.shift,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "bins": bins.tolist(),
+            "counts": self.counts[bins].tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state["relative_accuracy"], state["min_value"], state["n_bins"])
+        counts = np.zeros(sketch.n_bins, dtype=np.uint64)
+        counts[np.asarray(state["bins"], dtype=np.int64)] = state["counts"]
+        if counts.any():
+            sketch._absorb(counts, state["sum"], state["min"], state["max"], state.get("shift", 0))
+        return sketch
+
+    def __repr__(self):
+        return (f"QuantileSketch(count={self.count}, relative_accuracy={self.relative_accuracy}, "
+                f"nbytes={self.nbytes})")
+
+def _merge_cells(left, right):
+    """合并两个单元的草图, 缺失单元 (合并不同分组键的表时为 NaN) 直接取另一侧"""
+    if not isinstance(left, QuantileSketch):
+        return right
+    if not isinstance(right, QuantileSketch):
+        return left
+    return left.merge(right)
+
+def combine_sketches(sketches, by):
+    """按索引层级合并草图, 如由 细分 × 实验组 的最细单元上卷到实验组"""
+    by = [by] if isinstance(by, str) else list(by)
+    grouped = sketches.groupby(level=by, observed=True, dropna=False)
+    return grouped.agg(lambda cells: functools.reduce(_merge_cells, cells))
+
+def merge_sketch_tables(left, right):
+    """合并两份相同分组键的草图表, 用于分片归并或逐日累加"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return combine_sketches(pd.concat([left, right]), by=list(left.index.names))
+
+@traced()
+def compute_group_sketches(user_df, metric_cols, by=(GROUP_COL,), chunk_size=None, params=None):
+    """单次分组扫描为每个 分组单元 × 指标 构建分位数草图
+
+    返回以分组键为索引、指标为列、元素为 QuantileSketch 的数据框。所有单元的桶计数由一次
+    np.bincount(单元编号 × 桶数 + 桶号) 得到, 不逐组筛选数据; 各单元的桶偏移由单元内的最大绝对值决定。
+    chunk_size 指定时按行分块累加。
+    """
+    keys = [k for k in by if k in user_df.columns]
+    cols = [c for c in dict.fromkeys(metric_cols) if c in user_df.columns]
+    params = sketch_params(params)
+    n_bins = params[2]
+    chunk_size = chunk_size or max(len(user_df), 1)
+
+    total = None
+    for start in range(0, max(len(user_df), 1), chunk_size):
+        chunk = user_df.iloc[start:start + chunk_size]
+        grouper = chunk.groupby([chunk[k] for k in keys], observed=True, dropna=False)
+        cells = grouper.ngroup().to_numpy()
+        index = grouper.size().index
+        n_cells = len(index)
+
+        table = {}
+        for metric in cols:
+            values = chunk[metric].to_numpy(dtype=np.float64)
+            valid = ~np.isnan(values)
+            values, cell = values[valid], cells[valid]
+            extremes = pd.Series(values).groupby(cell).agg(["sum", "min", "max"]).reindex(range(n_cells))
+            magnitude = np.fmax(-extremes["min"].to_numpy(), extremes["max"].to_numpy())
+            shifts = shift_for(np.nan_to_num(magnitude, nan=0.0), *params)
+            counts = np.bincount(cell * n_bins + bin_index(values, *params, shifts[cell]),
+                                 minlength=n_cells * n_bins).reshape(n_cells, n_bins)
+
+            sketches = []
+            for i, (total_value, low, high) in enumerate(extremes.itertuples(index=False)):
+                sketch = QuantileSketch(*params)
+                if counts[i].any():
+                    sketch._absorb(counts[i], total_value, low, high, shifts[i])
+                sketches.append(sketch)
+            table[metric] = sketches
+
+        partial = pd.DataFrame(table, index=index, columns=cols)
+        total = partial if total is None else merge_sketch_tables(total, partial)
+    return total
+
+def sketches_to_records(sketches):
+    """草图表 -> 可JSON序列化的记录列表 (每个 单元 × 指标 一条)"""
+    names = list(sketches.index.names)
+    records = []
+    for key, row in sketches.iterrows():
+        key = [k.item() if isinstance(k, np.generic) else k for k in (key if isinstance(key, tuple) else (key,))]
+        for metric, sketch in row.items():
+            if isinstance(sketch, QuantileSketch):
+                records.append({**dict(zip(names, key)), "metric": metric, "sketch": sketch.to_dict()})
+    return records
+
+def sketches_from_records(records, index_names):
+    """由 sketches_to_records 的输出恢复草图表"""
+    cells = {}
+    for record in records:
+        key = tuple(record[name] for name in index_names)
+        cells.setdefault(key, {})[record["metric"]] = QuantileSketch.from_dict(record["sketch"])
+    index = pd.MultiIndex.from_tuples(list(cells), names=index_names) if len(index_names) > 1 \
+        else pd.Index([key[0] for key in cells], name=index_names[0])
+    return pd.DataFrame(list(cells.values()), index=index)
+
+def quantile_effects(control, treatment, quantiles, level=0.95):
+    """两组草图在各分位数上的效应: 差值与相对提升的区间及p值, 不做bootstrap
+
+    各组分位数的标准误取秩区间宽度 / 2z (以次序统计量估计密度倒数, 即 Siddiqui-Bloch-Gastwirth 方法),
+    差值的标准误按两组独立合成, 相对提升 Q_t/Q_c - 1 的标准误用delta方法。
+    """
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    z = special.ndtri(0.5 + level / 2)
+    value_control, value_treatment = control.quantile(quantiles), treatment.quantile(quantiles)
+    lower, upper = control.rank_interval(quantiles, level)
+    se_control = (upper - lower) / (2 * z)
+    lower, upper = treatment.rank_interval(quantiles, level)
+    se_treatment = (upper - lower) / (2 * z)
+
+    difference = value_treatment - value_control
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se_difference = np.sqrt(se_control ** 2 + se_treatment ** 2)
+        pval = 2 * special.ndtr(-np.abs(difference / se_difference))
+        lift = value_treatment / value_control - 1
+        se_lift = np.sqrt(se_treatment ** 2 / value_control ** 2
+                          + value_treatment ** 2 * se_control ** 2 / value_control ** 4)
+
+    return pd.DataFrame({
+        "quantile": quantiles,
+        "n_control": control.count,
+        "n_treatment": treatment.count,
+        "control_value": value_control,
+        "treatment_value": value_treatment,
+        "difference": difference,
+        "difference_ci_lower": difference - z * se_difference,
+        "difference_ci_upper": difference + z * se_difference,
+        "lift": lift,
+        "lift_ci_lower": lift - z * se_lift,
+        "lift_ci_upper": lift + z * se_lift,
+        "p_value": pval
+    })
+
+def quantile_results(sketches, config, quantiles=None, metric_cols=None):
+    """由草图表生成 指标 × 分位数 的结果表, 区间水平取 1 - significance_level"""
+    alpha = config["significance_level"]
+    quantiles = QUANTILE_SKETCH["quantiles"] if quantiles is None else quantiles
+    by_group = combine_sketches(sketches, GROUP_COL) if sketches.index.nlevels > 1 else sketches
+    frames = []
+    for metric in metric_cols or list(sketches.columns):
+        effects = quantile_effects(by_group.loc["control", metric], by_group.loc["treatment", metric],
+                                   quantiles, level=1 - alpha)
+        effects.insert(0, "metric", metric)
+        frames.append(effects)
+
+    results = pd.concat(frames, ignore_index=True)
+    results["significant"] = results["p_value"] < alpha
+    results["test_type"] = "quantile_sketch"
+    return results
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+from config import AB_TEST_CONFIG, QUANTILE_SKETCH
+from experiment_frame import ExperimentFrame
+from tracing import traced
+from statistical_analysis import (
+    GROUP_COL, CONVERSION_COL, configured_metrics,
+    compute_group_stats, to_moments, ztest_from_moments, welch_from_moments
+)
+
+AGE_BANDS = [0, 30, 45, 60, 75, 200]
+AGE_BAND_LABELS = ["<30", "30-44", "45-59", "60-74", "75+"]
+
+def add_age_band(user_df, age_col="age", bins=AGE_BANDS, labels=AGE_BAND_LABELS):
+    """按年龄段添加 age_band 细分列"""
+    user_df = user_df.copy()
+    user_df["age_band"] = pd.cut(user_df[age_col], bins=bins, labels=labels, right=False)
+    return user_df
+
+class SegmentAnalyzer:
+    """细分群体 × 指标批量检验, 一次分组扫描得到所有细分的结果并做多重比较校正"""
+
+    def __init__(self, user_df, segment_cols, metric_cols=None, correction="fdr_bh", config=None):
+        self.user_df = user_df.df if isinstance(user_df, ExperimentFrame) else user_df
+        self.segment_cols = list(segment_cols)
+        self.config = config or AB_TEST_CONFIG
+        self.alpha = self.config["significance_level"]
+        self.correction = correction
+        if metric_cols is None:
+            metric_cols = configured_metrics(self.config)
+        self.metric_cols = [c for c in metric_cols if c in self.user_df.columns]
+        self._cell_stats = None
+        self._cell_sketches = None
+
+    def cell_stats(self):
+        """按全部细分列 × 实验组的最细单元汇总, 只扫描一次原始数据"""
+        if self._cell_stats is None:
+            self._cell_stats = compute_group_stats(
+                self.user_df, self.metric_cols, by=self.segment_cols + [GROUP_COL]
+            )
+        return self._cell_stats
+
+    def _segment_moments(self, segment_col):
+        """从最细单元上卷到单个细分列的各组矩"""
+        cells = self.cell_stats()
+        marginal = cells.groupby(level=[segment_col, GROUP_COL], observed=True, dropna=False).sum()
+        return to_moments(marginal)
+
+    def _test_segment(self, segment_col):
+        """对一个细分列的所有取值和指标做向量化检验"""
+        moments = self._segment_moments(segment_col)
+        control = moments.xs("control", level=GROUP_COL)
+        treatment = moments.xs("treatment", level=GROUP_COL).reindex(control.index)
+
+        frames = []
+        for metric in self.metric_cols:
+            n_c, mean_c, m2_c = (control[(metric, s)].to_numpy() for s in ("count", "mean", "m2"))
+            n_t, mean_t, m2_t = (treatment[(metric, s)].to_numpy() for s in ("count", "mean", "m2"))
+
+            if metric == CONVERSION_COL:
+                _, pval = ztest_from_moments(n_c, mean_c, n_t, mean_t)
+                name, test_type = "conversion_rate", "proportions_ztest"
+            else:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    var_c = m2_c / (n_c - 1)
+                    var_t = m2_t / (n_t - 1)
+                _, pval = welch_from_moments(n_c, mean_c, var_c, n_t, mean_t, var_t)
+                name, test_type = metric, "t-test_ind"
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                lift = (mean_t - mean_c) / mean_c
+            frames.append(pd.DataFrame({
+                "segment_col": segment_col,
+                "segment_value": control.index.to_numpy(),
+                "metric": name,
+                "n_control": n_c,
+                "n_treatment": n_t,
+                "control_value": mean_c,
+                "treatment_value": mean_t,
+                "lift": lift,
+                "p_value": pval,
+                "test_type": test_type
+            }))
+        return pd.concat(frames, ignore_index=True)
+
+    def _adjust(self, results):
+        """在整张结果表上做多重比较校正, p值缺失(样本不足)的行不参与"""
+        results["p_adjusted"] = np.nan
+        valid = results["p_value"].notna()
+        if valid.any():
+            from statsmodels.stats.multitest import multipletests
+            _, p_adjusted, _, _ = multipletests(
+                results.loc[valid, "p_value"], alpha=self.alpha, method=self.correction
+            )
+            results.loc[valid, "p_adjusted"] = p_adjusted
+        results["significant"] = results["p_adjusted"] < self.alpha
+        results["correction"] = self.correction
+        return results
+
+    @traced()
+    def analyze(self):
+        """返回所有 细分列 × 取值 × 指标 的整洁结果表, 含多重比较校正后的p值"""
+        results = pd.concat([self._test_segment(col) for col in self.segment_cols], ignore_index=True)
+        results = self._adjust(results)
+
+        return results[["segment_col", "segment_value", "metric", "n_control", "n_treatment",
+                        "control_value", "treatment_value", "lift", "p_value", "p_adjusted",
+                        "significant", "test_type", "correction"]]
+
+    def cell_sketches(self, metric_cols):
+        """按全部细分列 × 实验组的最细单元构建分位数草图, 只扫描一次原始数据"""
+        from quantile_sketch import compute_group_sketches
+        if self._cell_sketches is None or any(c not in self._cell_sketches.columns for c in metric_cols):
+            self._cell_sketches = compute_group_sketches(
+                self.user_df, metric_cols, by=self.segment_cols + [GROUP_COL]
+            )
+        return self._cell_sketches[metric_cols]
+
+    @traced()
+    def analyze_quantiles(self, metric_cols=None, quantiles=None):
+        """细分列 × 取值 × 指标 × 分位数 的效应检验, 草图由最细单元合并上卷, 同样做多重比较校正"""
+        from quantile_sketch import combine_sketches, quantile_effects
+        metric_cols = [c for c in (metric_cols or QUANTILE_SKETCH["metrics"]) if c in self.user_df.columns]
+        quantiles = QUANTILE_SKETCH["quantiles"] if quantiles is None else quantiles
+        level = 1 - self.alpha
+        cells = self.cell_sketches(metric_cols)
+
+        frames = []
+        for segment_col in self.segment_cols:
+            marginal = combine_sketches(cells, [segment_col, GROUP_COL])
+            control = marginal.xs("control", level=GROUP_COL)
+            treatment = marginal.xs("treatment", level=GROUP_COL)
+            for value in control.index.intersection(treatment.index):
+                for metric in metric_cols:
+                    effects = quantile_effects(control.loc[value, metric], treatment.loc[value, metric],
+                                               quantiles, level)
+                    effects.insert(0, "metric", metric)
+                    effects.insert(0, "segment_value", value)
+                    effects.insert(0, "segment_col", segment_col)
+                    frames.append(effects)
+
+        results = self._adjust(pd.concat(frames, ignore_index=True))
+        results["test_type"] = "quantile_sketch"
+        return results
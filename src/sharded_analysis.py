@@ -0,0 +1,173 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from config import AB_TEST_CONFIG, QUANTILE_SKETCH
+from storage import iter_batches, dataset_files
+from tracing import pool_map
+from statistical_analysis import (
+    GROUP_COL, CHRONIC_COL, configured_metrics,
+    compute_group_stats, results_from_stats
+)
+
+# 扫描CSV时每次读取的字节数
+SCAN_BLOCK_BYTES = 1 << 20
+
+def count_rows(path):
+    """统计CSV文件的数据行数 (不含表头)"""
+    with open(path, "rb") as f:
+        lines = sum(block.count(b"\n") for block in iter(lambda: f.read(SCAN_BLOCK_BYTES), b""))
+    return max(lines - 1, 0)
+
+def row_offsets(path, rows_per_shard):
+    """扫描一次换行符, 返回每隔 rows_per_shard 行的数据行起始字节偏移与数据总行数"""
+    offsets = []
+    seen = 0
+    position = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(SCAN_BLOCK_BYTES), b""):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n"))
+            # 第 i 个换行符 (i 从0计, 第0个结束表头) 之后开始第 i 个数据行
+            rows = seen + np.arange(len(newlines))
+            offsets.extend((newlines[rows % rows_per_shard == 0] + position + 1).tolist())
+            seen += len(newlines)
+            position += len(block)
+            last = block[-1:]
+
+    # 末行没有换行符时同样计入
+    total = max(seen - 1 + (last != b"\n"), 0)
+    return offsets[:-(-total // rows_per_shard)], total
+
+def plan_shards(paths, rows_per_shard=None):
+    """将输入切分为 (path, offset, nrows, base_dir) 分片
+
+    目录展开为其中的分区文件, base_dir 为所在目录 (用于补回Hive分区列), 单个文件时为 None。
+    不指定行数或为Parquet文件时每个文件一个分片; CSV分片按字节偏移定位:
+    各分片直接 seek 到自己的首行读取, 不需要重新解析之前的行。
+    """
+    shards = []
+    for path in paths:
+        base_dir = path if os.path.isdir(path) else None
+        for file in dataset_files(path):
+            if rows_per_shard is None or file.endswith(".parquet"):
+                shards.append((file, 0, None, base_dir))
+                continue
+            offsets, total = row_offsets(file, rows_per_shard)
+            for i, offset in enumerate(offsets):
+                shards.append((file, offset, min(rows_per_shard, total - i * rows_per_shard), base_dir))
+    return shards
+
+def _read_shard(path, offset, nrows, base_dir, columns, chunk_size):
+    """分块读取一个分片, 只解析需要的列; offset 为分片首行的字节偏移 (0 表示从表头开始)"""
+    if path.endswith(".parquet"):
+        yield from iter_batches(path, columns, chunk_size, base_dir=base_dir)
+        return
+    if not offset:
+        yield from pd.read_csv(path, usecols=lambda c: c in columns, nrows=nrows, chunksize=chunk_size)
+        return
+
+    names = pd.read_csv(path, nrows=0).columns.tolist()
+    with open(path, "rb") as f:
+        f.seek(offset)
+        yield from pd.read_csv(f, header=None, names=names, usecols=lambda c: c in columns,
+                               nrows=nrows, chunksize=chunk_size)
+
+def shard_group_stats(shard, metric_cols, by=(GROUP_COL, CHRONIC_COL), chunk_size=500000):
+    """map: 计算单个分片的分组充分统计量"""
+    columns = set(metric_cols) | set(by)
+    total = None
+    for chunk in _read_shard(*shard, columns, chunk_size):
+        if not len(chunk):
+            continue
+        partial = compute_group_stats(chunk, metric_cols, by=by)
+        total = partial if total is None else total.add(partial, fill_value=0)
+    return total
+
+def reduce_group_stats(partials):
+    """reduce: 充分统计量可直接相加, 合并结果与单进程扫描一致"""
+    total = None
+    for partial in partials:
+        if partial is None:
+            continue
+        total = partial if total is None else total.add(partial, fill_value=0)
+    return total
+
+def shard_group_sketches(shard, metric_cols, by=(GROUP_COL, CHRONIC_COL), chunk_size=500000):
+    """map: 构建单个分片的分位数草图"""
+    from quantile_sketch import compute_group_sketches, merge_sketch_tables
+    columns = set(metric_cols) | set(by)
+    total = None
+    for chunk in _read_shard(*shard, columns, chunk_size):
+        if not len(chunk):
+            continue
+        total = merge_sketch_tables(total, compute_group_sketches(chunk, metric_cols, by=by))
+    return total
+
+def _shard_worker(args):
+    """进程池入口, 参数需可pickle"""
+    shard, metric_cols, by, chunk_size = args
+    return shard_group_stats(shard, metric_cols, by, chunk_size)
+
+def _sketch_worker(args):
+    """进程池入口 (分位数草图)"""
+    shard, metric_cols, by, chunk_size = args
+    return shard_group_sketches(shard, metric_cols, by, chunk_size)
+
+class ShardedAnalyzer:
+    """分片 map-reduce 分析: 各进程只持有一个分块的数据, 适用于超出内存的用户表"""
+
+    def __init__(self, paths, rows_per_shard=None, processes=None, chunk_size=500000, config=None):
+        self.config = config or AB_TEST_CONFIG
+        self.paths = list(paths)
+        self.shards = plan_shards(self.paths, rows_per_shard)
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._group_stats = None
+        self._group_sketches = None
+
+    def _metric_columns(self):
+        """需要汇总的指标列"""
+        return configured_metrics(self.config)
+
+    def group_stats(self):
+        """并行计算所有分片的分组充分统计量并归并"""
+        if self._group_stats is None:
+            tasks = [
+                (shard, self._metric_columns(), (GROUP_COL, CHRONIC_COL), self.chunk_size)
+                for shard in self.shards
+            ]
+            self._group_stats = reduce_group_stats(self._map(_shard_worker, tasks))
+            if self._group_stats is None:
+                raise ValueError(f"No data rows found in {self.paths}")
+        return self._group_stats
+
+    def _map(self, worker, tasks):
+        """按配置的进程数执行 map 阶段"""
+        if self.processes == 1 or len(tasks) <= 1:
+            return list(map(worker, tasks))
+        with ProcessPoolExecutor(max_workers=min(self.processes, len(tasks))) as pool:
+            return pool_map(pool, worker, tasks)
+
+    def group_sketches(self):
+        """并行构建所有分片的分位数草图并逐个合并 (草图合并与单进程构建结果一致)"""
+        if self._group_sketches is None:
+            from quantile_sketch import merge_sketch_tables
+            tasks = [
+                (shard, QUANTILE_SKETCH["metrics"], (GROUP_COL, CHRONIC_COL), self.chunk_size)
+                for shard in self.shards
+            ]
+            for partial in self._map(_sketch_worker, tasks):
+                self._group_sketches = merge_sketch_tables(self._group_sketches, partial)
+            if self._group_sketches is None:
+                raise ValueError(f"No data rows found in {self.paths}")
+        return self._group_sketches
+
+    def analyze_quantiles(self, quantiles=None):
+        """与 StatisticalAnalyzer.analyze_quantiles 输出相同的分位数效应表"""
+        from quantile_sketch import quantile_results
+        return quantile_results(self.group_sketches(), self.config, quantiles)
+
+    def analyze_all_metrics(self):
+        """与 StatisticalAnalyzer.analyze_all_metrics 输出相同的结果表"""
+        return results_from_stats(self.group_stats(), self.config)
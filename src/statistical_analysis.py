@@ -1,111 +1,342 @@
 import numpy as np
 import pandas as pd
-from scipy import stats
-from statsmodels.stats.proportion import proportions_ztest
-from config import AB_TEST_CONFIG
+from scipy import special
+from config import AB_TEST_CONFIG, QUANTILE_SKETCH
+from bootstrap import bootstrap_intervals, DEFAULT_MEMORY_BUDGET_MB
+from experiment_frame import ExperimentFrame
+from tracing import traced
+
+GROUP_COL = "group"
+CHRONIC_COL = "is_chronic"
+CONVERSION_COL = "converted_user"
+
+# 分块扫描时每行每个指标的float64临时副本数 (取值、计数、平方与拼接结果)
+_COPIES_PER_VALUE = 4
+MIN_CHUNK_ROWS = 10000
+
+def default_chunk_size(n_values, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, copies=_COPIES_PER_VALUE):
+    """未指定 chunk_size 时按内存预算推出的块行数: 每块的临时副本约占 memory_budget_mb"""
+    per_row = max(n_values, 1) * copies * 8
+    return max(int(memory_budget_mb * 2 ** 20 // per_row), MIN_CHUNK_ROWS)
+
+def configured_metrics(config):
+    """需要汇总的指标列: 主要指标、次要指标与慢病用药依从性"""
+    return [CONVERSION_COL] + list(config["metrics"]["secondary"]) + ["adherence"]
+
+@traced()
+def compute_group_stats(user_df, metric_cols, by=(GROUP_COL,), chunk_size=None):
+    """单次分组扫描计算各指标的充分统计量 (count, sum, sumsq)
+
+    返回以分组键为索引、(metric, stat) 为列的数据框。sum/sumsq 可直接相加。
+    按行分块累加, 避免一次性复制整张用户表; chunk_size 默认由内存预算推出 (见 default_chunk_size)。
+    user_df 可以是 ExperimentFrame。
+    """
+    frame = user_df if isinstance(user_df, ExperimentFrame) else None
+    user_df = user_df.df if frame is not None else user_df
+    keys = [k for k in by if k in user_df.columns]
+    cols = [c for c in dict.fromkeys(metric_cols) if c in user_df.columns]
+    chunk_size = chunk_size or default_chunk_size(len(cols))
+
+    total = None
+    for start in range(0, max(len(user_df), 1), chunk_size):
+        chunk = user_df.iloc[start:start + chunk_size]
+        values = chunk[cols].astype("float64")
+        parts = pd.concat({"count": values.notna(), "sum": values, "sumsq": values * values}, axis=1)
+        # 传入 ExperimentFrame 时分组键直接取预先计算的分组编码
+        groupers = [frame.group_key(start, start + chunk_size) if frame is not None and k == frame.group_col
+                    else chunk[k] for k in keys]
+        partial = parts.groupby(groupers, observed=True, dropna=False).sum()
+        total = partial if total is None else total.add(partial, fill_value=0)
+    return total.swaplevel(axis=1).sort_index(axis=1)
+
+def to_moments(stats_df):
+    """将 (count, sum, sumsq) 转换为 (count, mean, m2), m2 为离均差平方和"""
+    count = stats_df.xs("count", axis=1, level=1)
+    total = stats_df.xs("sum", axis=1, level=1)
+    sumsq = stats_df.xs("sumsq", axis=1, level=1)
+    mean = total / count
+    m2 = (sumsq - total * mean).clip(lower=0)
+    moments = pd.concat({"count": count, "mean": mean, "m2": m2}, axis=1)
+    return moments.swaplevel(axis=1).sort_index(axis=1)
+
+def combine_moments(moments, by):
+    """按索引层级合并各单元的矩 (Chan/Welford 并行合并公式)"""
+    by = [by] if isinstance(by, str) else list(by)
+    count = moments.xs("count", axis=1, level=1).fillna(0)
+    mean = moments.xs("mean", axis=1, level=1).where(count > 0, 0.0)
+    m2 = moments.xs("m2", axis=1, level=1).fillna(0)
+
+    total = count.groupby(level=by).sum()
+    pooled_mean = (mean * count).groupby(level=by).sum() / total
+
+    # 各单元均值相对合并均值的偏差贡献额外的离均差平方和
+    keys = moments.index.droplevel([l for l in moments.index.names if l not in by])
+    deviation = mean - pooled_mean.reindex(keys).to_numpy()
+    pooled_m2 = (m2 + count * deviation ** 2).groupby(level=by).sum()
+
+    combined = pd.concat({"count": total, "mean": pooled_mean, "m2": pooled_m2}, axis=1)
+    return combined.swaplevel(axis=1).sort_index(axis=1)
+
+def merge_moments(left, right):
+    """合并两份相同分组键的矩, 用于增量累加或分片归并"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return combine_moments(pd.concat([left, right]), by=list(left.index.names))
+
+def _arm(moments, group, metric):
+    """取出某组某指标的样本量、均值和样本方差"""
+    row = moments.loc[group, metric]
+    n = row["count"]
+    var = row["m2"] / (n - 1) if n > 1 else np.nan
+    return n, row["mean"], var
+
+def ztest_from_moments(n_control, p_control, n_treatment, p_treatment):
+    """向量化的两比例合并方差z检验, 与 proportions_ztest 结果一致"""
+    n_control, p_control, n_treatment, p_treatment = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (n_control, p_control, n_treatment, p_treatment)]
+    )
+    pooled = (p_control * n_control + p_treatment * n_treatment) / (n_control + n_treatment)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se = np.sqrt(pooled * (1 - pooled) * (1 / n_control + 1 / n_treatment))
+        zstat = (p_control - p_treatment) / se
+    return zstat, 2 * special.ndtr(-np.abs(zstat))
+
+def welch_from_moments(n_control, mean_control, var_control, n_treatment, mean_treatment, var_treatment):
+    """向量化的Welch t检验, 与 scipy.stats.ttest_ind_from_stats(equal_var=False) 一致
+
+    只依赖 scipy.special, 避免分析路径在启动时加载整个 scipy.stats。
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se_control = np.asarray(var_control, dtype=float) / n_control
+        se_treatment = np.asarray(var_treatment, dtype=float) / n_treatment
+        se = se_control + se_treatment
+        dof = se ** 2 / (se_control ** 2 / (n_control - 1) + se_treatment ** 2 / (n_treatment - 1))
+        tstat = (np.asarray(mean_treatment, dtype=float) - mean_control) / np.sqrt(se)
+        pval = 2 * special.stdtr(dof, -np.abs(tstat))
+    return tstat, pval
+
+def conversion_test(moments, alpha, metric_col=CONVERSION_COL, metric_name="conversion_rate"):
+    """基于分组汇总量的比例z检验"""
+    n_control, cr_control, _ = _arm(moments, "control", metric_col)
+    n_treatment, cr_treatment, _ = _arm(moments, "treatment", metric_col)
+
+    # 执行比例检验
+    zstat, pval = ztest_from_moments(n_control, cr_control, n_treatment, cr_treatment)
+    pval = float(pval)
+
+    # 计算提升幅度
+    lift = (cr_treatment - cr_control) / cr_control
+
+    return {
+        "metric": metric_name,
+        "control_value": cr_control,
+        "treatment_value": cr_treatment,
+        "lift": lift,
+        "p_value": pval,
+        "significant": pval < alpha,
+        "test_type": "proportions_ztest"
+    }
+
+def welch_test(moments, metric_col, alpha):
+    """基于分组汇总量的Welch t检验"""
+    n_control, mean_control, var_control = _arm(moments, "control", metric_col)
+    n_treatment, mean_treatment, var_treatment = _arm(moments, "treatment", metric_col)
+
+    # 执行t检验
+    tstat, pval = welch_from_moments(n_control, mean_control, var_control,
+                                     n_treatment, mean_treatment, var_treatment)
+
+    # 计算提升幅度
+    lift = (mean_treatment - mean_control) / mean_control
+
+    return {
+        "metric": metric_col,
+        "control_value": mean_control,
+        "treatment_value": mean_treatment,
+        "lift": lift,
+        "p_value": pval,
+        "significant": pval < alpha,
+        "test_type": "t-test_ind"
+    }
+
+def normal_intervals(moments, metric_col, level=0.95):
+    """基于分组汇总量的正态近似置信区间"""
+    intervals = {}
+    for group in ["control", "treatment"]:
+        n, mean, var = _arm(moments, group, metric_col)
+        half = special.ndtri(0.5 + level / 2) * np.sqrt(var / n)
+        intervals[group] = {"mean": mean, "ci_lower": mean - half, "ci_upper": mean + half}
+    return intervals
+
+def results_from_moments(moments, config):
+    """由分组矩生成与 analyze_all_metrics 相同的结果表"""
+    alpha = config["significance_level"]
+    by_group = combine_moments(moments, GROUP_COL) if moments.index.nlevels > 1 else moments
+    available = set(moments.columns.get_level_values(0))
+    results = []
+
+    # 分析主要指标
+    results.append(conversion_test(by_group, alpha))
+
+    # 分析次要指标
+    for metric in config["metrics"]["secondary"]:
+        if metric in available:
+            results.append(welch_test(by_group, metric, alpha))
+
+    # 分析医药特定指标 (慢病患者子集)
+    if CHRONIC_COL in moments.index.names:
+        chronic_keys = moments.index.get_level_values(CHRONIC_COL) == True
+        if chronic_keys.any() and "adherence" in available:
+            chronic = combine_moments(moments[chronic_keys], GROUP_COL)
+            results.append(welch_test(chronic, "adherence", alpha))
+            results.append(conversion_test(chronic, alpha))  # 复购率分析
+
+    return pd.DataFrame(results)
+
+def results_from_stats(stats_df, config):
+    """由分组充分统计量生成结果表"""
+    return results_from_moments(to_moments(stats_df), config)
 
 class StatisticalAnalyzer:
-    def __init__(self, metrics_df, user_df):
+    def __init__(self, metrics_df, user_df, chunk_size=None, config=None):
         self.metrics_df = metrics_df
-        self.user_df = user_df
-        self.config = AB_TEST_CONFIG
+        self.user_frame = ExperimentFrame.wrap(user_df)
+        self.user_df = self.user_frame.df
+        self.config = config or AB_TEST_CONFIG
         self.alpha = self.config["significance_level"]
-        
-    def analyze_conversion_rate(self):
-        """分析转化率差异"""
-        control_data = self.user_df[self.user_df["group"] == "control"]
-        treatment_data = self.user_df[self.user_df["group"] == "treatment"]
-        
-        n_control = len(control_data)
-        n_treatment = len(treatment_data)
-        
-        conversions_control = control_data["converted_user"].sum()
-        conversions_treatment = treatment_data["converted_user"].sum()
-        
-        # 执行比例检验
-        count = np.array([conversions_control, conversions_treatment])
-        nobs = np.array([n_control, n_treatment])
-        
-        zstat, pval = proportions_ztest(count, nobs)
-        
-        # 计算提升幅度
-        cr_control = conversions_control / n_control
-        cr_treatment = conversions_treatment / n_treatment
-        lift = (cr_treatment - cr_control) / cr_control
-        
-        return {
-            "metric": "conversion_rate",
-            "control_value": cr_control,
-            "treatment_value": cr_treatment,
-            "lift": lift,
-            "p_value": pval,
-            "significant": pval < self.alpha,
-            "test_type": "proportions_ztest"
-        }
-    
-    def analyze_continuous_metric(self, metric_col):
-        """分析连续变量指标"""
-        control_data = self.user_df[self.user_df["group"] == "control"][metric_col]
-        treatment_data = self.user_df[self.user_df["group"] == "treatment"][metric_col]
-        
-        # 执行t检验
-        tstat, pval = stats.ttest_ind(treatment_data, control_data, equal_var=False)
-        
-        # 计算提升幅度
-        mean_control = control_data.mean()
-        mean_treatment = treatment_data.mean()
-        lift = (mean_treatment - mean_control) / mean_control
-        
-        return {
-            "metric": metric_col,
-            "control_value": mean_control,
-            "treatment_value": mean_treatment,
-            "lift": lift,
-            "p_value": pval,
-            "significant": pval < self.alpha,
-            "test_type": "t-test_ind"
-        }
-    
-    def analyze_all_metrics(self):
-        """分析所有指标"""
-        results = []
-        
-        # 分析主要指标
-        results.append(self.analyze_conversion_rate())
-        
-        # 分析次要指标
-        secondary_metrics = self.config["metrics"]["secondary"]
-        for metric in secondary_metrics:
-            if metric in self.user_df.columns:
-                results.append(self.analyze_continuous_metric(metric))
-        
-        # 分析医药特定指标
-        if "is_chronic" in self.user_df.columns:
-            chronic_users = self.user_df[self.user_df["is_chronic"] == True]
-            if not chronic_users.empty:
-                self.user_df = chronic_users
-                results.append(self.analyze_continuous_metric("adherence"))
-                results.append(self.analyze_conversion_rate())  # 复购率分析
-        
-        return pd.DataFrame(results)
-    
-    def calculate_confidence_intervals(self, metric_col="converted_user"):
-        """计算置信区间"""
-        control_data = self.user_df[self.user_df["group"] == "control"][metric_col]
-        treatment_data = self.user_df[self.user_df["group"] == "treatment"][metric_col]
-        
-        # 计算均值和标准误
-        mean_control = control_data.mean()
-        mean_treatment = treatment_data.mean()
-        
-        se_control = control_data.sem()
-        se_treatment = treatment_data.sem()
-        
-        # 计算95%置信区间
-        ci_control = stats.norm.interval(0.95, loc=mean_control, scale=se_control)
-        ci_treatment = stats.norm.interval(0.95, loc=mean_treatment, scale=se_treatment)
-        
-        return {
-            "control": {"mean": mean_control, "ci_lower": ci_control[0], "ci_upper": ci_control[1]},
-            "treatment": {"mean": mean_treatment, "ci_lower": ci_treatment[0], "ci_upper": ci_treatment[1]}
-        }
+        self.chunk_size = chunk_size
+        self._group_stats = None
+        self._cross_stats = {}
+        self._group_sketches = None
+
+    def _configured_metrics(self):
+        """所有需要汇总的指标列"""
+        return configured_metrics(self.config)
+
+    def group_stats(self, metric_cols=None):
+        """按 (group, is_chronic) 汇总的充分统计量, 全表只扫描一次并缓存"""
+        if self._group_stats is None:
+            self._group_stats = compute_group_stats(
+                self.user_frame, self._configured_metrics(), by=(GROUP_COL, CHRONIC_COL),
+                chunk_size=self.chunk_size
+            )
+
+        # 请求了未配置的指标时, 仅对缺失列补扫一次
+        missing = [c for c in (metric_cols or []) if c not in self._group_stats.columns.get_level_values(0)]
+        if missing:
+            extra = compute_group_stats(
+                self.user_frame, missing, by=(GROUP_COL, CHRONIC_COL), chunk_size=self.chunk_size
+            )
+            self._group_stats = pd.concat([self._group_stats, extra], axis=1)
+        return self._group_stats
+
+    def group_moments(self, metric_cols=None):
+        """按实验组汇总的各指标矩 (count, mean, m2)"""
+        group_stats = self.group_stats(metric_cols)
+        if group_stats.index.nlevels > 1:
+            group_stats = group_stats.groupby(level=GROUP_COL).sum()
+        return to_moments(group_stats)
+
+    def cross_stats(self, covariates=None):
+        """按 (group, is_chronic) 汇总的指标 × 协变量交叉统计量, 按协变量映射缓存"""
+        from cuped import compute_cross_stats, resolve_covariates
+        mapping = resolve_covariates(self.user_df, covariates, self._configured_metrics())
+        key = tuple(sorted(mapping.items()))
+        if key not in self._cross_stats:
+            self._cross_stats[key] = compute_cross_stats(
+                self.user_df, mapping, by=(GROUP_COL, CHRONIC_COL), chunk_size=self.chunk_size
+            )
+        return self._cross_stats[key]
+
+    def group_sketches(self, metric_cols=None):
+        """按 (group, is_chronic) 构建的分位数草图 (默认 QUANTILE_SKETCH["metrics"]), 按指标补扫并缓存"""
+        from quantile_sketch import compute_group_sketches
+        metric_cols = [c for c in (metric_cols or QUANTILE_SKETCH["metrics"]) if c in self.user_df.columns]
+        built = [] if self._group_sketches is None else list(self._group_sketches.columns)
+        missing = [c for c in metric_cols if c not in built]
+        if missing:
+            extra = compute_group_sketches(
+                self.user_df, missing, by=(GROUP_COL, CHRONIC_COL), chunk_size=self.chunk_size
+            )
+            self._group_sketches = extra if self._group_sketches is None else pd.concat(
+                [self._group_sketches, extra], axis=1)
+        return self._group_sketches[metric_cols]
+
+    @traced()
+    def analyze_conversion_rate(self, covariate_col=None):
+        """分析转化率差异; 指定协变量列时使用CUPED调整"""
+        if covariate_col:
+            from cuped import cuped_test, to_cross_moments
+            cross = self.cross_stats({CONVERSION_COL: covariate_col})
+            return cuped_test(to_cross_moments(cross, CONVERSION_COL), self.alpha, "conversion_rate")
+        return conversion_test(self.group_moments([CONVERSION_COL]), self.alpha)
+
+    @traced()
+    def analyze_continuous_metric(self, metric_col, covariate_col=None):
+        """分析连续变量指标; 指定协变量列时使用CUPED调整"""
+        if covariate_col:
+            from cuped import cuped_test, to_cross_moments
+            cross = self.cross_stats({metric_col: covariate_col})
+            return cuped_test(to_cross_moments(cross, metric_col), self.alpha, metric_col)
+        return welch_test(self.group_moments([metric_col]), metric_col, self.alpha)
+
+    def check_sample_ratio(self):
+        """按配置的流量分配检验各组样本量 (SRM), 失衡时发出 SampleRatioMismatchWarning"""
+        from assignment import check_srm
+        counts = {group: self.user_frame.group_size(group) for group in self.user_frame.groups}
+        return check_srm(counts, self.config.get("traffic_allocation"))
+
+    @traced()
+    def analyze_all_metrics(self, covariates=None):
+        """分析所有指标
+
+        covariates 指定时 (协变量列名, 或 指标 -> 协变量列 的字典, True 表示默认映射)
+        使用实验前协变量做CUPED方差缩减, 结果表额外包含 theta 与 variance_reduction 列;
+        数据中没有对应协变量的指标使用未调整的检验 (theta 为空)。
+        分析前先做样本比例失衡检查。
+        """
+        self.check_sample_ratio()
+        if covariates:
+            from cuped import cuped_results
+            cross = self.cross_stats(None if covariates is True else covariates)
+            return cuped_results(cross, self.config, moments=to_moments(self.group_stats()))
+        return results_from_stats(self.group_stats(), self.config)
+
+    @traced()
+    def analyze_quantiles(self, metric_cols=None, quantiles=None):
+        """偏态指标的分位数效应 (默认中位数与P90)
+
+        基于可合并的分位数草图, 不保存或排序原始值; 区间由草图的秩区间与delta方法得到, 不需要bootstrap。
+        """
+        from quantile_sketch import quantile_results
+        return quantile_results(self.group_sketches(metric_cols), self.config, quantiles)
+
+    @traced()
+    def analyze_segments(self, segment_cols, metric_cols=None, correction="fdr_bh"):
+        """细分群体 × 指标批量检验 (FDR/Holm 校正), 不修改 self.user_df"""
+        from segmentation import SegmentAnalyzer
+        return SegmentAnalyzer(
+            self.user_df, segment_cols, metric_cols, correction, config=self.config
+        ).analyze()
+
+    @traced()
+    def calculate_confidence_intervals(self, metric_col="converted_user", method="normal",
+                                       n_boot=10000, seed=None, n_jobs=1, **bootstrap_options):
+        """计算置信区间
+
+        method="normal" 使用汇总量的正态近似; method="bootstrap" 对偏态指标
+        (如 avg_order_value) 计算各组均值及相对提升的bootstrap区间。
+        """
+        if method == "normal":
+            # 计算95%置信区间
+            return normal_intervals(self.group_moments([metric_col]), metric_col, level=0.95)
+        if method != "bootstrap":
+            raise ValueError(f"Unknown confidence interval method: {method}")
+
+        return bootstrap_intervals(
+            self.user_frame.values("control", metric_col, dtype=float),
+            self.user_frame.values("treatment", metric_col, dtype=float), level=0.95,
+            n_boot=n_boot, seed=seed, n_jobs=n_jobs, **bootstrap_options
+        )
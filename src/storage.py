@@ -0,0 +1,162 @@
+import os
+import glob
+import datetime
+import numpy as np
+import pandas as pd
+from tracing import traced
+
+# 低基数字符串列以字典编码存储, 读回时为 category 类型
+DICTIONARY_COLUMNS = ["group", "drug_name", "primary_disease"]
+
+def _require_pyarrow():
+    """按需导入pyarrow; 未安装时仅Parquet相关功能不可用"""
+    try:
+        import pyarrow
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet storage requires pyarrow (pip install pyarrow)") from e
+    return pyarrow, pq
+
+def _encode_dictionary_columns(df):
+    """将字典编码列转换为 category, 写入Parquet时即为dictionary类型"""
+    to_encode = [c for c in DICTIONARY_COLUMNS if c in df.columns and df[c].dtype != "category"]
+    if not to_encode:
+        return df
+    return df.astype({c: "category" for c in to_encode})
+
+def write_partition(df, output_dir, table, part, fmt="parquet"):
+    """将一个批次写入 <output_dir>/<table>/part-XXXXX.<fmt>"""
+    table_dir = os.path.join(output_dir, table)
+    os.makedirs(table_dir, exist_ok=True)
+    path = os.path.join(table_dir, f"part-{part:05d}.{fmt}")
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "parquet":
+        pyarrow, pq = _require_pyarrow()
+        df = _encode_dictionary_columns(df)
+        pq.write_table(
+            pyarrow.Table.from_pandas(df, preserve_index=False), path,
+            use_dictionary=[c for c in DICTIONARY_COLUMNS if c in df.columns]
+        )
+    else:
+        raise ValueError(f"Unknown storage format: {fmt}")
+    return path
+
+def write_dataset(df, path, partition_cols=None, basename_template=None):
+    """将实验数据写为按列分区的Parquet数据集 (如按 date / group 分区)
+
+    basename_template 为分区内文件名模板 (须含 "{i}"), 不指定时由pyarrow生成随机文件名。
+    """
+    pyarrow, pq = _require_pyarrow()
+    df = _encode_dictionary_columns(df)
+    pq.write_to_dataset(
+        pyarrow.Table.from_pandas(df, preserve_index=False), path,
+        partition_cols=partition_cols,
+        basename_template=basename_template,
+        use_dictionary=[c for c in DICTIONARY_COLUMNS if c in df.columns]
+    )
+    return path
+
+def _parts(path, fmt):
+    """列出目录下某种格式的分区文件"""
+    return sorted(glob.glob(os.path.join(path, "**", f"*.{fmt}"), recursive=True))
+
+@traced()
+def read_table(path, columns=None, filters=None, memory_map=True):
+    """读取Parquet文件或数据集目录, 只解析所需列并在读取时按行过滤
+
+    filters 采用pyarrow的DNF格式, 如 [("group", "==", "control"), ("date", ">=", start)];
+    目录下只有CSV分区时回退为逐个读取CSV。
+    """
+    if path.endswith(".csv") or (os.path.isdir(path) and not _parts(path, "parquet")):
+        files = _parts(path, "csv") if os.path.isdir(path) else [path]
+        usecols = None
+        if columns is not None:
+            usecols = list(dict.fromkeys(list(columns) + [f[0] for f in filters or []]))
+        # CSV中日期为字符串, 按日期比较的过滤列需要先解析
+        date_cols = list(dict.fromkeys(col for col, _, value in filters or [] if _is_datetime(value)))
+        df = pd.concat((pd.read_csv(p, usecols=usecols, parse_dates=date_cols) for p in files),
+                       ignore_index=True)
+        df = _apply_filters(df, filters)
+        return df if columns is None else df[list(columns)]
+
+    _, pq = _require_pyarrow()
+    table = pq.read_table(path, columns=columns, filters=filters, memory_map=memory_map)
+    return table.to_pandas()
+
+_OPERATORS = {
+    "==": lambda s, v: s == v, "=": lambda s, v: s == v, "!=": lambda s, v: s != v,
+    "<": lambda s, v: s < v, "<=": lambda s, v: s <= v,
+    ">": lambda s, v: s > v, ">=": lambda s, v: s >= v,
+    "in": lambda s, v: s.isin(v), "not in": lambda s, v: ~s.isin(v)
+}
+
+def _is_datetime(value):
+    """过滤值 (或 in 条件的取值列表) 是否为日期时间"""
+    if isinstance(value, (list, tuple, set)):
+        return bool(value) and all(_is_datetime(v) for v in value)
+    return isinstance(value, (datetime.date, np.datetime64))
+
+def _filter_value(series, value):
+    """日期列上将 date/datetime 过滤值统一为 Timestamp 后再比较"""
+    if not pd.api.types.is_datetime64_any_dtype(series.dtype) or not _is_datetime(value):
+        return value
+    if isinstance(value, (list, tuple, set)):
+        return [pd.Timestamp(v) for v in value]
+    return pd.Timestamp(value)
+
+def _apply_filters(df, filters):
+    """CSV回退路径上按与Parquet相同的 (列, 操作符, 值) 条件过滤"""
+    if not filters:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        mask &= _OPERATORS[op](df[col], _filter_value(df[col], value))
+    return df[mask].reset_index(drop=True)
+
+def dataset_files(path):
+    """数据路径展开为文件列表: 目录取其中的分区文件 (有Parquet时只取Parquet), 文件原样返回"""
+    if not os.path.isdir(path):
+        return [path]
+    return _parts(path, "parquet") or _parts(path, "csv")
+
+def iter_batches(path, columns=None, batch_size=500000, base_dir=None):
+    """分块流式读取CSV或Parquet文件, 只解析存在于文件中的所需列
+
+    path 为分区目录时按分区文件名顺序依次读取 (生成器写出的分区按患者ID递增)。
+    Hive式分区目录 (如 group=control/) 的分区列不在文件内, 按文件相对 base_dir 的路径补回;
+    直接读取目录时 base_dir 即该目录。
+    """
+    if os.path.isdir(path):
+        for part in dataset_files(path):
+            yield from iter_batches(part, columns, batch_size, base_dir=path)
+        return
+    if path.endswith(".parquet"):
+        _require_pyarrow()
+        import pyarrow.dataset as ds
+        dataset = ds.dataset([path], format="parquet", partitioning="hive" if base_dir else None,
+                             partition_base_dir=base_dir)
+        names = dataset.schema.names
+        selected = None if columns is None else [c for c in names if c in columns]
+        for batch in dataset.to_batches(columns=selected, batch_size=batch_size):
+            yield batch.to_pandas()
+    else:
+        usecols = None if columns is None else (lambda c: c in columns)
+        yield from pd.read_csv(path, usecols=usecols, chunksize=batch_size)
+
+def import_csv(csv_path, output_path, partition_cols=None, parse_dates=None, chunksize=1000000):
+    """将CSV分块转换为Parquet数据集
+
+    各块文件名按块序号编号 (chunk-00000-0.parquet ...), 文件名顺序即原CSV的行顺序,
+    读回时每个分区内保持原顺序 (不分区时整体保持)。
+    """
+    reader = pd.read_csv(csv_path, parse_dates=parse_dates, chunksize=chunksize)
+    for number, chunk in enumerate(reader):
+        write_dataset(chunk, output_path, partition_cols,
+                      basename_template=f"chunk-{number:05d}-{{i}}.parquet")
+    return output_path
+
+def export_csv(path, csv_path, columns=None, filters=None):
+    """将Parquet数据 (可选列投影与过滤) 导出为CSV"""
+    read_table(path, columns=columns, filters=filters).to_csv(csv_path, index=False)
+    return csv_path
@@ -0,0 +1,204 @@
+"""轻量级分阶段计时与追踪
+
+用 span() 上下文管理器或 traced 装饰器包裹各阶段, 记录耗时、行数和进程内存高水位,
+可导出为结构化JSON或 Chrome trace (chrome://tracing / Perfetto) 文件。
+
+通过环境变量 ABTEST_TRACE=1、命令行 --trace 或 enable() 开启。关闭时 span() 返回共享的空对象,
+traced 只多一次全局标志判断, 开销可忽略。
+
+进程池中的任务通过 pool_map() 提交: 工作进程的span随结果返回并合并到父进程, 挂在提交时的当前span下。
+"""
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import functools
+
+_ENABLED = os.environ.get("ABTEST_TRACE", "").lower() in ("1", "true", "yes")
+_SPANS = []
+_LOCAL = threading.local()
+
+# Linux 上 ru_maxrss 单位为KB, macOS 上为字节
+_RSS_SCALE = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+
+def _peak_rss_mb():
+    """进程内存高水位 (MB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_SCALE
+
+def _rows(value):
+    """数据框/数组的行数, 其他对象返回None"""
+    shape = getattr(value, "shape", None)
+    return int(shape[0]) if shape else None
+
+def enable():
+    global _ENABLED
+    _ENABLED = True
+
+def disable():
+    global _ENABLED
+    _ENABLED = False
+
+def is_enabled():
+    return _ENABLED
+
+def reset():
+    """清空已记录的span"""
+    _SPANS.clear()
+
+def get_spans():
+    """已完成的span列表 (按结束顺序)"""
+    return list(_SPANS)
+
+class _NullSpan:
+    """追踪关闭时使用的空span"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """一次计时区间, 嵌套的span记录父级名称和深度"""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """补充属性, 例如 rows"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = getattr(_LOCAL, "stack", None)
+        if stack is None:
+            stack = _LOCAL.stack = []
+        self.parent = stack[-1].name if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+        self.rss_start = _peak_rss_mb()
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.perf_counter_ns()
+        _LOCAL.stack.pop()
+        rss_end = _peak_rss_mb()
+        record = {
+            "name": self.name,
+            "parent": self.parent,
+            "depth": self.depth,
+            "start_us": self.start_ns / 1000,
+            "duration_ms": (end_ns - self.start_ns) / 1e6,
+            "peak_rss_mb": round(rss_end, 1),
+            "peak_rss_growth_mb": round(rss_end - self.rss_start, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "attrs": self.attrs
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        _SPANS.append(record)
+        return False
+
+def span(name, **attrs):
+    """计时区间上下文管理器; 关闭追踪时返回空对象"""
+    if not _ENABLED:
+        return _NULL_SPAN
+    return Span(name, attrs)
+
+def traced(name=None):
+    """将函数或方法包裹在span中, 自动记录输入数据框与返回值的行数"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            attrs = {}
+            for arg in args:
+                rows = _rows(arg)
+                if rows is not None:
+                    attrs["rows_in"] = rows
+                    break
+            with Span(span_name, attrs) as s:
+                result = func(*args, **kwargs)
+                rows = _rows(result)
+                if rows is not None:
+                    s.set(rows_out=rows)
+            return result
+        return wrapper
+    return decorator
+
+def _traced_call(task):
+    """进程池工作进程入口: 开启追踪执行一个任务, 返回 (结果, 本任务记录的span)
+
+    fork 启动的工作进程继承了父进程已有的span和span栈, 因此清空栈并只取本任务新增的部分。
+    """
+    func, arg = task
+    enable()
+    _LOCAL.stack = []
+    start = len(_SPANS)
+    with Span(getattr(func, "__qualname__", str(func)), {}):
+        result = func(arg)
+    spans = _SPANS[start:]
+    del _SPANS[start:]
+    return result, spans
+
+def pool_map(pool, func, tasks):
+    """在进程池中对每个任务执行 func, 返回结果列表; 开启追踪时合并工作进程的span"""
+    if not _ENABLED:
+        return list(pool.map(func, tasks))
+    stack = getattr(_LOCAL, "stack", None) or []
+    parent = stack[-1].name if stack else None
+    results = []
+    for result, spans in pool.map(_traced_call, [(func, task) for task in tasks]):
+        for record in spans:
+            # perf_counter 在同一主机上跨进程单调一致, 时间戳无需换算
+            if record["parent"] is None:
+                record["parent"] = parent
+            record["depth"] += len(stack)
+        _SPANS.extend(spans)
+        results.append(result)
+    return results
+
+def summary():
+    """按span名称汇总调用次数与总耗时, 耗时高者在前"""
+    totals = {}
+    for record in _SPANS:
+        entry = totals.setdefault(record["name"], {"name": record["name"], "calls": 0,
+                                                   "total_ms": 0.0, "peak_rss_mb": 0.0})
+        entry["calls"] += 1
+        entry["total_ms"] += record["duration_ms"]
+        entry["peak_rss_mb"] = max(entry["peak_rss_mb"], record["peak_rss_mb"])
+    return sorted(totals.values(), key=lambda e: -e["total_ms"])
+
+def export_json(path):
+    """导出全部span为结构化JSON"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"spans": _SPANS, "summary": summary()}, f, ensure_ascii=False, indent=2, default=str)
+    return path
+
+def export_chrome_trace(path):
+    """导出为 Chrome trace 事件格式 (完整事件 ph="X")"""
+    events = [{
+        "name": record["name"],
+        "cat": "abtest",
+        "ph": "X",
+        "ts": record["start_us"],
+        "dur": record["duration_ms"] * 1000,
+        "pid": record["pid"],
+        "tid": record["tid"],
+        "args": {**record["attrs"], "peak_rss_mb": record["peak_rss_mb"]}
+    } for record in _SPANS]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+    return path
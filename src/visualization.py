@@ -1,108 +1,284 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
+import pandas as pd
+from experiment_frame import ExperimentFrame
+from tracing import span, traced, pool_map
 
-plt.style.use('seaborn-whitegrid')
+# matplotlib/seaborn/plotly 均在首次绘图时才导入, 只做计算的任务不承担其启动开销
+_PLT = None
+
+def _pyplot():
+    """按需加载matplotlib: 选择后端并设置样式, 只执行一次"""
+    global _PLT
+    if _PLT is None:
+        import matplotlib
+
+        # 无显示环境(定时任务/服务器)时使用Agg后端离屏渲染
+        if not os.environ.get("MPLBACKEND") and not os.environ.get("DISPLAY"):
+            matplotlib.use("Agg")
+
+        import matplotlib.pyplot as plt
+
+        # 新版matplotlib中seaborn样式更名为 seaborn-v0_8-*
+        plt.style.use('seaborn-whitegrid' if 'seaborn-whitegrid' in plt.style.available
+                      else 'seaborn-v0_8-whitegrid')
+        _PLT = plt
+    return _PLT
+
+PALETTE = ['#1f77b4', '#ff7f0e']
+
+# 原始行数超过该值时默认改用预聚合数据绘图
+AGGREGATE_THRESHOLD = 100000
+
+@traced()
+def draw_metric_comparison(aggregates, metric, significant=False):
+    """根据各组均值与置信区间绘制指标对比图"""
+    plt = _pyplot()
+    plt.figure(figsize=(10, 6))
+    ax = plt.gca()
+    yerr = [aggregates['mean'] - aggregates['ci_lower'], aggregates['ci_upper'] - aggregates['mean']]
+    ax.bar(aggregates['group'].astype(str), aggregates['mean'], yerr=yerr, capsize=8,
+           color=PALETTE[:len(aggregates)])
+
+    # 添加统计显著性标记
+    if significant:
+        plt.text(0.5, aggregates['ci_upper'].max() * 1.05, "** Significant **",
+                 ha='center', fontsize=12, color='red')
+
+    plt.title(f'{metric.upper()} Comparison', fontsize=14)
+    plt.ylabel(metric.replace('_', ' ').title(), fontsize=12)
+    plt.xlabel('')
+    plt.tight_layout()
+    return ax
+
+@traced()
+def draw_timeseries(daily_metrics, metric):
+    """根据按日聚合的数据绘制时间序列"""
+    import seaborn as sns
+    plt = _pyplot()
+    plt.figure(figsize=(12, 6))
+    sns.lineplot(data=daily_metrics, x='date', y=metric, hue='group',
+                 palette=PALETTE, linewidth=2.5, errorbar=None)
+
+    plt.title(f'Daily {metric.upper()} Trend', fontsize=14)
+    plt.ylabel(metric.replace('_', ' ').title(), fontsize=12)
+    plt.xlabel('Date', fontsize=12)
+    plt.xticks(rotation=45)
+    plt.legend(title='Group')
+    plt.tight_layout()
+    return plt
+
+@traced()
+def draw_segmented_results(segmented, segment_col, value_col='converted'):
+    """根据细分群体聚合结果绘制分组柱状图"""
+    import seaborn as sns
+    plt = _pyplot()
+    plt.figure(figsize=(12, 6))
+    ax = sns.barplot(x=segment_col, y=value_col, hue='group',
+                     data=segmented, palette=PALETTE, errorbar=None)
+
+    plt.title(f'Conversion Rate by {segment_col.title()}', fontsize=14)
+    plt.ylabel('Conversion Rate', fontsize=12)
+    plt.xlabel(segment_col.replace('_', ' ').title(), fontsize=12)
+    plt.legend(title='Group')
+    plt.tight_layout()
+    return ax
+
+@traced()
+def draw_lift_with_ci(metric, lift, pval, ci_lower, ci_upper):
+    """绘制提升幅度与置信区间 (plotly)"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    fig = make_subplots(rows=1, cols=1)
+
+    # 添加提升幅度点
+    fig.add_trace(go.Scatter(
+        x=[lift],
+        y=['Lift'],
+        mode='markers',
+        marker=dict(size=14, color='red' if pval < 0.05 else 'blue'),
+        name='Observed Lift'
+    ))
+
+    # 添加置信区间
+    fig.add_trace(go.Scatter(
+        x=[ci_lower, ci_upper],
+        y=['Lift', 'Lift'],
+        mode='lines',
+        line=dict(color='black', width=2),
+        name='95% CI'
+    ))
+
+    # 添加零线
+    fig.add_vline(x=0, line_dash="dash", line_color="green")
+
+    fig.update_layout(
+        title=f"Lift in {metric.replace('_', ' ').title()} with Confidence Interval",
+        xaxis_title="Lift",
+        yaxis_title="",
+        showlegend=False,
+        height=400
+    )
+
+    return fig
+
+_DRAWERS = {
+    'metric_comparison': draw_metric_comparison,
+    'timeseries': draw_timeseries,
+    'segmented_results': draw_segmented_results,
+    'lift_with_ci': draw_lift_with_ci
+}
+
+def render_chart(job):
+    """渲染单个图表任务并写入文件: matplotlib图表输出PNG, plotly图表输出HTML"""
+    kind, path, kwargs = job
+    result = _DRAWERS[kind](**kwargs)
+    with span("save_chart", kind=kind, path=path):
+        if kind == 'lift_with_ci':
+            result.write_html(path, include_plotlyjs='cdn')
+        else:
+            plt = _pyplot()
+            plt.savefig(path, dpi=100)
+            plt.close('all')
+    return path
+
+def render_charts(jobs, processes=None):
+    """并行渲染一批图表; 任务只携带聚合后的小数据, 与原始行数无关"""
+    processes = processes or os.cpu_count() or 1
+    if processes <= 1 or len(jobs) <= 1:
+        return [render_chart(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(processes, len(jobs))) as pool:
+        return pool_map(pool, render_chart, jobs)
 
 class ABTestVisualizer:
     def __init__(self, metrics_df, results_df):
-        self.metrics_df = metrics_df
+        self.metrics_frame = ExperimentFrame.wrap(metrics_df)
+        self.metrics_df = self.metrics_frame.df
         self.results_df = results_df
-    
-    def plot_metric_comparison(self, metric='conversion_rate'):
+        self._daily_cache = {}
+
+    def _use_aggregates(self, aggregated, n_rows):
+        """未显式指定时, 数据量较大则使用预聚合路径"""
+        return n_rows > AGGREGATE_THRESHOLD if aggregated is None else aggregated
+
+    def _result_row(self, metric):
+        """取出某指标的检验结果"""
+        return self.results_df[self.results_df['metric'] == metric].iloc[0]
+
+    def group_aggregates(self, metric, level=0.95):
+        """各组均值与正态近似置信区间, 基于预先计算的分组索引"""
+        from scipy import special
+        rows = []
+        for group in self.metrics_frame.groups:
+            values = self.metrics_frame.values(group, metric, dtype=np.float64)
+            values = values[~np.isnan(values)]
+            mean = values.mean()
+            sem = values.std(ddof=1) / np.sqrt(len(values)) if len(values) > 1 else 0.0
+            half = special.ndtri(0.5 + level / 2) * sem
+            rows.append({'group': group, 'n': len(values), 'mean': mean,
+                         'ci_lower': mean - half, 'ci_upper': mean + half})
+        return pd.DataFrame(rows)
+
+    def daily_aggregates(self, df, metric):
+        """按日期和组计算均值; 同一数据框的所有数值指标一次分组计算并缓存"""
+        cached = self._daily_cache.get(id(df))
+        if cached is None or cached[0] is not df:
+            numeric = df.select_dtypes(include=['number', 'bool']).columns
+            daily = df.groupby(['date', 'group'], observed=True)[list(numeric)].mean().reset_index()
+            cached = self._daily_cache[id(df)] = (df, daily)
+        return cached[1][['date', 'group', metric]]
+
+    @traced()
+    def plot_metric_comparison(self, metric='conversion_rate', aggregated=None):
         """绘制指标对比图"""
+        result_row = self._result_row(metric)
+        if self._use_aggregates(aggregated, len(self.metrics_df)):
+            return draw_metric_comparison(self.group_aggregates(metric), metric, result_row['significant'])
+
+        import seaborn as sns
+        plt = _pyplot()
+
         # 筛选指定指标数据
         metric_data = self.metrics_df[['group', metric]]
-        
+
         plt.figure(figsize=(10, 6))
-        ax = sns.barplot(x='group', y=metric, data=metric_data, palette=['#1f77b4', '#ff7f0e'])
-        
+        ax = sns.barplot(x='group', y=metric, data=metric_data, palette=PALETTE)
+
         # 添加统计显著性标记
-        result_row = self.results_df[self.results_df['metric'] == metric].iloc[0]
         if result_row['significant']:
-            plt.text(0.5, max(metric_data[metric]) * 1.05, "** Significant **", 
+            plt.text(0.5, max(metric_data[metric]) * 1.05, "** Significant **",
                     ha='center', fontsize=12, color='red')
-        
+
         plt.title(f'{metric.upper()} Comparison', fontsize=14)
         plt.ylabel(metric.replace('_', ' ').title(), fontsize=12)
         plt.xlabel('')
         plt.tight_layout()
         return ax
-    
-    def plot_lift_with_ci(self, metric='conversion_rate'):
-        """绘制提升幅度与置信区间"""
-        fig = make_subplots(rows=1, cols=1)
-        
-        # 添加提升幅度点
-        result_row = self.results_df[self.results_df['metric'] == metric].iloc[0]
+
+    def _lift_interval(self, metric):
+        """提升幅度及其近似置信区间"""
+        result_row = self._result_row(metric)
         lift = result_row['lift']
-        pval = result_row['p_value']
-        
-        fig.add_trace(go.Scatter(
-            x=[lift],
-            y=['Lift'],
-            mode='markers',
-            marker=dict(size=14, color='red' if pval < 0.05 else 'blue'),
-            name='Observed Lift'
-        ))
-        
-        # 添加置信区间
         ci_lower = lift - 1.96 * np.sqrt((lift * (1 - lift)) / len(self.metrics_df))
         ci_upper = lift + 1.96 * np.sqrt((lift * (1 - lift)) / len(self.metrics_df))
-        
-        fig.add_trace(go.Scatter(
-            x=[ci_lower, ci_upper],
-            y=['Lift', 'Lift'],
-            mode='lines',
-            line=dict(color='black', width=2),
-            name='95% CI'
-        ))
-        
-        # 添加零线
-        fig.add_vline(x=0, line_dash="dash", line_color="green")
-        
-        fig.update_layout(
-            title=f"Lift in {metric.replace('_', ' ').title()} with Confidence Interval",
-            xaxis_title="Lift",
-            yaxis_title="",
-            showlegend=False,
-            height=400
-        )
-        
-        return fig
-    
+        return lift, result_row['p_value'], ci_lower, ci_upper
+
+    @traced()
+    def plot_lift_with_ci(self, metric='conversion_rate'):
+        """绘制提升幅度与置信区间"""
+        lift, pval, ci_lower, ci_upper = self._lift_interval(metric)
+        return draw_lift_with_ci(metric, lift, pval, ci_lower, ci_upper)
+
+    @traced()
     def plot_timeseries(self, df, metric='conversion_rate'):
         """绘制指标时间序列"""
         # 按日期和组计算指标
-        daily_metrics = df.groupby(['date', 'group'])[metric].mean().reset_index()
-        
-        plt.figure(figsize=(12, 6))
-        sns.lineplot(data=daily_metrics, x='date', y=metric, hue='group', 
-                    palette=['#1f77b4', '#ff7f0e'], linewidth=2.5)
-        
-        plt.title(f'Daily {metric.upper()} Trend', fontsize=14)
-        plt.ylabel(metric.replace('_', ' ').title(), fontsize=12)
-        plt.xlabel('Date', fontsize=12)
-        plt.xticks(rotation=45)
-        plt.legend(title='Group')
-        plt.tight_layout()
-        return plt
-    
-    def plot_segmented_results(self, df, segment_col='chronic_type'):
-        """绘制细分群体结果"""
+        return draw_timeseries(self.daily_aggregates(df, metric), metric)
+
+    @traced()
+    def plot_segmented_results(self, df=None, segment_col='chronic_type', segment_results=None):
+        """绘制细分群体结果
+
+        传入 SegmentAnalyzer 的结果表时直接使用其中的各组转化率, 不再扫描原始行。
+        """
+        return draw_segmented_results(self.segment_aggregates(df, segment_col, segment_results), segment_col)
+
+    def segment_aggregates(self, df, segment_col, segment_results=None):
+        """细分群体各组的转化率"""
+        if segment_results is not None:
+            rows = segment_results[(segment_results['segment_col'] == segment_col)
+                                   & (segment_results['metric'] == 'conversion_rate')]
+            return rows.melt(id_vars='segment_value', value_vars=['control_value', 'treatment_value'],
+                             var_name='group', value_name='converted').assign(
+                group=lambda d: d['group'].str.replace('_value', '')
+            ).rename(columns={'segment_value': segment_col})
+
         # 计算细分群体的转化率
-        segmented = df.groupby(['group', segment_col])['converted'].mean().reset_index()
-        
-        plt.figure(figsize=(12, 6))
-        ax = sns.barplot(x=segment_col, y='converted', hue='group', 
-                         data=segmented, palette=['#1f77b4', '#ff7f0e'])
-        
-        plt.title(f'Conversion Rate by {segment_col.title()}', fontsize=14)
-        plt.ylabel('Conversion Rate', fontsize=12)
-        plt.xlabel(segment_col.replace('_', ' ').title(), fontsize=12)
-        plt.legend(title='Group')
-        plt.tight_layout()
-        return ax
+        return df.groupby(['group', segment_col], observed=True)['converted'].mean().reset_index()
+
+    def chart_jobs(self, output_dir, metrics=None, timeseries_df=None, prefix=''):
+        """为多个指标生成批量渲染任务 (聚合在主进程完成, 任务中只含聚合结果)"""
+        os.makedirs(output_dir, exist_ok=True)
+        metrics = metrics or [m for m in self.results_df['metric'].unique() if m in self.metrics_df.columns]
+        jobs = []
+        for metric in metrics:
+            base = os.path.join(output_dir, f"{prefix}{metric}")
+            jobs.append(('metric_comparison', f"{base}_comparison.png", {
+                'aggregates': self.group_aggregates(metric), 'metric': metric,
+                'significant': bool(self._result_row(metric)['significant'])
+            }))
+            lift, pval, ci_lower, ci_upper = self._lift_interval(metric)
+            jobs.append(('lift_with_ci', f"{base}_lift.html", {
+                'metric': metric, 'lift': lift, 'pval': pval, 'ci_lower': ci_lower, 'ci_upper': ci_upper
+            }))
+            if timeseries_df is not None and metric in timeseries_df.columns:
+                jobs.append(('timeseries', f"{base}_timeseries.png", {
+                    'daily_metrics': self.daily_aggregates(timeseries_df, metric), 'metric': metric
+                }))
+        return jobs
+
+    @traced()
+    def render_all(self, output_dir, metrics=None, timeseries_df=None, processes=None):
+        """批量渲染所有指标的图表到文件"""
+        return render_charts(self.chart_jobs(output_dir, metrics, timeseries_df), processes)
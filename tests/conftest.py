@@ -0,0 +1,56 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 与 cli.py 一致: 源码模块按同级导入, config 位于仓库根目录
+for path in (ROOT, os.path.join(ROOT, "src")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+START_DATE = pd.Timestamp("2023-01-01")
+
+def _make_users(n=20000, seed=0):
+    """合成用户级实验数据: 含两个实验、慢病标记与和指标相关的实验前协变量"""
+    rng = np.random.default_rng(seed)
+    treatment = rng.random(n) < 0.5
+    pre_aov = rng.lognormal(4, 0.5, n)
+    return pd.DataFrame({
+        "user_id": np.arange(n),
+        "experiment_name": rng.choice(["e1", "e2"], n),
+        "date": START_DATE + pd.to_timedelta(rng.integers(0, 60, n), "D"),
+        "group": np.where(treatment, "treatment", "control"),
+        "is_chronic": rng.random(n) < 0.3,
+        "converted_user": (rng.random(n) < 0.1 + 0.01 * treatment).astype(int),
+        "avg_order_value": pre_aov * rng.lognormal(0.05 * treatment, 0.2, n),
+        "bounce_rate": rng.random(n),
+        "adherence": np.clip(rng.normal(0.7, 0.1, n), 0, 1),
+        "pre_purchased": (rng.random(n) < 0.2).astype(float),
+        "pre_avg_order_value": pre_aov
+    })
+
+def _make_metrics(n=1000, seed=0, n_days=30):
+    """合成指标数据, 每行一个用户日"""
+    rng = np.random.default_rng(seed)
+    treatment = rng.random(n) < 0.5
+    conversions = rng.integers(0, 5, n)
+    return pd.DataFrame({
+        "date": START_DATE + pd.to_timedelta(rng.integers(0, n_days, n), "D"),
+        "group": np.where(treatment, "treatment", "control"),
+        "conversions": conversions,
+        "conversion_rate": (conversions > 0).astype(float),
+        "total_revenue": conversions * rng.lognormal(4, 0.8, n)
+    })
+
+@pytest.fixture
+def make_users():
+    """用户表工厂: make_users(n=20000, seed=0)"""
+    return _make_users
+
+@pytest.fixture
+def make_metrics():
+    """指标表工厂: make_metrics(n=1000, seed=0, n_days=30)"""
+    return _make_metrics
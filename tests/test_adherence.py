@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+from adherence import compute_pdc, iter_pdc
+
+PERIOD_END = pd.Timestamp("2023-03-31")
+
+def _fills(n_patients=150, seed=0):
+    """随机取药记录: 提前续药造成覆盖重叠, 部分取药在观察期结束后或覆盖期跨过期末"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for patient in range(n_patients):
+        for drug in rng.choice(["metformin", "lisinopril", "atorvastatin"], rng.integers(1, 3), replace=False):
+            days = np.sort(rng.integers(0, 105, rng.integers(1, 8)))
+            for day in days:
+                rows.append((patient, drug, pd.Timestamp("2023-01-01") + pd.Timedelta(days=int(day)),
+                             int(rng.choice([7, 14, 30, 90]))))
+    return pd.DataFrame(rows, columns=["patient_id", "drug_name", "transaction_date", "expected_interval_days"])
+
+def _naive_pdc(fills, period_end=PERIOD_END):
+    """逐日模拟: 按日期取药, 提前取药的剩余药量顺延, 统计观察期内被覆盖的日期"""
+    window_end = period_end + pd.Timedelta(days=1)
+    records = {}
+    fills = fills[fills["transaction_date"] < window_end]
+    for (patient, drug), group in fills.groupby(["patient_id", "drug_name"]):
+        group = group.sort_values("transaction_date", kind="stable")
+        first = group["transaction_date"].iloc[0]
+        covered = set()
+        cursor, gaps = None, []
+        for date, supply in zip(group["transaction_date"], group["expected_interval_days"]):
+            gaps.append(0 if cursor is None else max((date - cursor).days, 0))
+            cursor = date if cursor is None else max(cursor, date)
+            for _ in range(supply):
+                if cursor < window_end:
+                    covered.add(cursor)
+                cursor += pd.Timedelta(days=1)
+        period_days = (window_end - first).days
+        records[(patient, drug)] = (len(group), len(covered), period_days,
+                                    min(len(covered) / period_days, 1.0), max(gaps), sum(gaps))
+    return records
+
+def _assert_matches_naive(result, expected):
+    assert len(result) == len(expected)
+    for row in result.itertuples(index=False):
+        assert (row.n_fills, row.covered_days, row.period_days) == expected[(row.patient_id, row.drug_name)][:3]
+        assert row.pdc == pytest.approx(expected[(row.patient_id, row.drug_name)][3])
+        assert (row.max_gap_days, row.total_gap_days) == expected[(row.patient_id, row.drug_name)][4:]
+
+def test_pdc_matches_day_by_day_coverage():
+    fills = _fills()
+    expected = _naive_pdc(fills)
+    # 随机数据中应同时出现重叠续药和跨过期末的覆盖
+    ordered = fills.sort_values(["patient_id", "drug_name", "transaction_date"])
+    supply_end = ordered["transaction_date"] + pd.to_timedelta(ordered["expected_interval_days"], unit="D")
+    same_group = ordered[["patient_id", "drug_name"]].eq(ordered[["patient_id", "drug_name"]].shift()).all(axis=1)
+    assert (same_group & (ordered["transaction_date"] < supply_end.shift())).any()
+    assert ((ordered["transaction_date"] <= PERIOD_END) & (supply_end > PERIOD_END + pd.Timedelta(days=1))).any()
+    assert (ordered["transaction_date"] > PERIOD_END).any()
+    _assert_matches_naive(compute_pdc(fills.sample(frac=1, random_state=1), period_end=PERIOD_END), expected)
+
+def test_pdc_with_prescription_supply_and_chunks():
+    fills = _fills(seed=2)
+    prescriptions = (fills.groupby(["patient_id", "drug_name"], as_index=False)["expected_interval_days"]
+                     .first())
+    fills = fills.drop(columns="expected_interval_days").merge(prescriptions, on=["patient_id", "drug_name"])
+    expected = _naive_pdc(fills)
+
+    transactions = fills.drop(columns="expected_interval_days")
+    _assert_matches_naive(compute_pdc(transactions, prescriptions, period_end=PERIOD_END), expected)
+
+    ordered = transactions.sort_values("patient_id", kind="stable")
+    chunks = [ordered.iloc[rows] for rows in np.array_split(np.arange(len(ordered)), 7)]
+    chunked = pd.concat(iter_pdc(chunks, prescriptions, period_end=PERIOD_END), ignore_index=True)
+    _assert_matches_naive(chunked, expected)
@@ -0,0 +1,28 @@
+import asyncio
+import pytest
+from assignment import TrafficAssigner, AssignmentService, AssignmentClient, LocalAssignmentClient
+from cli import main
+
+MIXED_IDS = [12345, "abc", 1.5, 7, "user-42", 2 ** 40, True, 12345]
+
+async def _lookup_both(user_ids):
+    assigner = TrafficAssigner()
+    async with AssignmentService(assigner) as service:
+        async with AssignmentClient(service.host, service.port) as client:
+            served = await client.lookup_many(user_ids)
+    async with LocalAssignmentClient(assigner) as client:
+        local = await client.lookup_many(user_ids)
+    return served, local
+
+def test_service_matches_local_client_on_mixed_batches():
+    served, local = asyncio.run(_lookup_both(MIXED_IDS))
+    assert served == local
+    # 单条查询与混合批次中的结果相同
+    single, _ = asyncio.run(_lookup_both([12345]))
+    assert served[0] == single[0]
+
+def test_assign_requires_users_or_serve(capsys):
+    with pytest.raises(SystemExit) as excinfo:
+        main(["assign"])
+    assert excinfo.value.code == 2
+    assert "--serve" in capsys.readouterr().err
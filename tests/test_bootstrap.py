@@ -0,0 +1,59 @@
+import numpy as np
+from bootstrap import bootstrap_means, bootstrap_intervals, _resample_data, DEFAULT_MAX_SUPPORT
+
+def _asymmetry(replicates):
+    """上尾与下尾长度之比; 对称分布约为1, 右偏分布大于1"""
+    lower, median, upper = np.percentile(replicates, [2.5, 50, 97.5])
+    return (upper - median) / (median - lower)
+
+def _values(n=20000, sigma=2.5, seed=0):
+    return np.random.default_rng(seed).lognormal(0.0, sigma, n)
+
+def test_exact_matches_row_level_bootstrap():
+    values = _values()
+    exact = bootstrap_means(values, n_boot=2000, seed=1, resampling="exact")
+    rows = bootstrap_means(values, n_boot=2000, seed=2, resampling="poisson")
+
+    assert abs(exact.std() / rows.std() - 1) < 0.1
+    # 偏态指标的重抽样分布保留右偏 (上尾长于下尾)
+    assert _asymmetry(exact) > 1.15
+    assert _asymmetry(rows) > 1.15
+    tails = np.percentile(exact, [2.5, 97.5]), np.percentile(rows, [2.5, 97.5])
+    assert np.allclose(*tails, rtol=0.05)
+
+def test_exact_support_matches_binomial_variance():
+    values = (np.random.default_rng(3).random(50000) < 0.1).astype(float)
+    means = bootstrap_means(values, n_boot=4000, seed=4)
+    expected = np.sqrt(values.mean() * (1 - values.mean()) / len(values))
+    assert abs(means.std() / expected - 1) < 0.05
+
+def test_auto_default_bounds_support_and_keeps_skew():
+    values = _values(40000)
+    support, counts, _ = _resample_data(values, "auto", DEFAULT_MAX_SUPPORT)
+    assert len(support) == DEFAULT_MAX_SUPPORT and counts.sum() == len(values)
+
+    auto = bootstrap_means(values, n_boot=2000, seed=9)
+    rows = bootstrap_means(values, n_boot=2000, seed=10, resampling="poisson")
+    assert abs(auto.std() / rows.std() - 1) < 0.1
+    assert _asymmetry(auto) > 1.15
+    tails = np.percentile(auto, [2.5, 97.5]), np.percentile(rows, [2.5, 97.5])
+    assert np.allclose(*tails, rtol=0.05)
+
+def test_binned_is_opt_in_and_checked_against_row_level():
+    values = _values()
+    binned = bootstrap_means(values, n_boot=2000, seed=5, resampling="binned", max_support=1024)
+    rows = bootstrap_means(values, n_boot=2000, seed=6, resampling="poisson")
+
+    # 分箱保留均值与标准误, 但抹平偏度
+    assert abs(binned.mean() / rows.mean() - 1) < 0.02
+    assert abs(binned.std() / rows.std() - 1) < 0.1
+    assert _asymmetry(binned) < 1.05
+    assert _asymmetry(rows) > 1.15
+
+def test_intervals_reproducible_with_seed():
+    rng = np.random.default_rng(7)
+    control, treatment = rng.lognormal(0, 2, 5000), rng.lognormal(0.1, 2, 5000)
+    first = bootstrap_intervals(control, treatment, n_boot=500, seed=8)
+    second = bootstrap_intervals(control, treatment, n_boot=500, seed=8)
+    assert first == second
+    assert first["lift"]["ci_lower"] < first["lift"]["estimate"] < first["lift"]["ci_upper"]
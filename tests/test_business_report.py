@@ -0,0 +1,78 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import business_report
+from business_report import BusinessReportGenerator, stream_reports_json
+from config import AB_TEST_CONFIG
+
+def _results():
+    return pd.DataFrame({
+        "metric": ["conversion_rate", "adherence"],
+        "control_value": [0.1, np.nan],
+        "treatment_value": [0.12, np.nan],
+        "lift": [0.2, np.inf],
+        "p_value": [0.01, np.nan],
+        "significant": [True, False]
+    })
+
+def _reject_constant(name):
+    raise ValueError(f"non-standard JSON constant {name}")
+
+def test_report_json_is_strict(tmp_path, make_metrics):
+    metrics_df, results_df = make_metrics(), _results()
+    generator = BusinessReportGenerator(metrics_df, results_df, AB_TEST_CONFIG)
+    text = "".join(generator.iter_report_json())
+    report = json.loads(text, parse_constant=_reject_constant)
+    adherence = report["key_results"][1]
+    assert adherence["control_value"] is None and adherence["lift"] is None
+
+    path = tmp_path / "reports.json"
+    with open(path, "w", encoding="utf-8") as f:
+        stream_reports_json([generator, generator], f)
+    assert len(json.loads(path.read_text(encoding="utf-8"), parse_constant=_reject_constant)) == 2
+
+def test_memory_cache_is_bounded(monkeypatch, make_metrics):
+    monkeypatch.setattr(business_report, "REPORT_CACHE_SIZE", 3)
+    business_report._REPORT_CACHE.clear()
+    metrics_df, results_df = make_metrics(), _results()
+    for seed in range(6):
+        config = {**AB_TEST_CONFIG, "experiment_name": f"exp-{seed}"}
+        BusinessReportGenerator(metrics_df, results_df, config).generate_report_dataframe()
+    assert len(business_report._REPORT_CACHE) == 3
+
+def test_disk_cache_key_includes_code_version(tmp_path, monkeypatch, make_metrics):
+    metrics_df, results_df = make_metrics(), _results()
+    BusinessReportGenerator(metrics_df, results_df, AB_TEST_CONFIG,
+                            cache_dir=str(tmp_path)).generate_report_dataframe()
+    files = os.listdir(tmp_path)
+    assert len(files) == 1 and files[0].startswith(business_report._CODE_VERSION)
+
+    # 源码版本变化后不读取旧的磁盘缓存
+    business_report._REPORT_CACHE.clear()
+    monkeypatch.setattr(business_report, "_CODE_VERSION", "changed")
+    BusinessReportGenerator(metrics_df, results_df, AB_TEST_CONFIG,
+                            cache_dir=str(tmp_path)).generate_report_dataframe()
+    assert len(os.listdir(tmp_path)) == 2
+
+def test_report_from_csv_inputs(tmp_path, make_users, make_metrics):
+    from cli import main
+    from experiment_frame import ExperimentFrame
+    from statistical_analysis import StatisticalAnalyzer
+    metrics_path, results_path = str(tmp_path / "metrics.csv"), str(tmp_path / "results.csv")
+    metrics_df = make_metrics()
+    metrics_df.to_csv(metrics_path, index=False)
+    results_df = StatisticalAnalyzer(None, make_users()).analyze_all_metrics()
+    results_df.to_csv(results_path, index=False)
+
+    # CSV中的日期为字符串, 压缩后须仍可取最值
+    generator = BusinessReportGenerator(ExperimentFrame.read(metrics_path), pd.read_csv(results_path),
+                                        AB_TEST_CONFIG)
+    summary = generator.generate_executive_summary()
+    assert summary["start_date"] == metrics_df["date"].min()
+    assert summary["end_date"] == metrics_df["date"].max()
+
+    output = str(tmp_path / "report.json")
+    main(["report", "--metrics", metrics_path, "--results", results_path, "--output", output])
+    with open(output, encoding="utf-8") as f:
+        assert len(json.load(f)["key_results"]) == len(results_df)
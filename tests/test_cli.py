@@ -0,0 +1,41 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from conftest import ROOT
+from cli import STARTUP_BUDGET_SECONDS
+
+CLI = os.path.join(ROOT, "src", "cli.py")
+PLOTTING_MODULES = ["matplotlib", "seaborn", "plotly", "faker"]
+
+# 子进程中导入 analyze 的依赖并计时, 执行 analyze 子命令 (单进程与分片两条路径), 之后列出已加载的绘图/造数模块
+_ANALYZE_IMPORTS = """
+import sys, json, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+import cli, statistical_analysis, experiment_frame, sharded_analysis
+elapsed = time.perf_counter() - start
+cli.main(["analyze", {path!r}])
+cli.main(["analyze", {path!r}, "--processes", "1"])
+print(json.dumps({{"import_seconds": elapsed,
+                  "loaded": sorted(m for m in {modules!r} if m in sys.modules)}}))
+"""
+
+def test_analyze_help_is_fast():
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, CLI, "analyze", "--help"], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    assert proc.returncode == 0 and "users" in proc.stdout
+    # 宽松上限: 包含解释器启动, 只用于发现意外引入的重量级导入
+    assert elapsed < 4 * STARTUP_BUDGET_SECONDS
+
+def test_analyze_does_not_import_plotting_or_faker(tmp_path, make_users):
+    path = str(tmp_path / "users.csv")
+    make_users(2000).to_csv(path, index=False)
+    code = _ANALYZE_IMPORTS.format(src=os.path.join(ROOT, "src"), path=path, modules=PLOTTING_MODULES)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=str(tmp_path))
+    assert proc.returncode == 0, proc.stderr
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+    assert report["loaded"] == []
+    assert report["import_seconds"] < 4 * STARTUP_BUDGET_SECONDS
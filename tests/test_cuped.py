@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from statistical_analysis import StatisticalAnalyzer
+from cuped import build_pre_period_covariates
+from adherence import compute_pdc, patient_adherence
+
+def test_metrics_without_covariate_fall_back_to_unadjusted_test(make_users):
+    users = make_users()
+    plain = StatisticalAnalyzer(None, users).analyze_all_metrics()
+    adjusted = StatisticalAnalyzer(None, users).analyze_all_metrics(covariates=True)
+
+    assert len(adjusted) == len(plain)
+    assert list(adjusted["metric"]) == list(plain["metric"])
+    # adherence 没有 pre_adherence_score, 结果与未调整的检验一致
+    for row in (2, 3):
+        assert adjusted.loc[row, "test_type"] == plain.loc[row, "test_type"]
+        assert np.isclose(adjusted.loc[row, "p_value"], plain.loc[row, "p_value"])
+        assert np.isnan(adjusted.loc[row, "theta"])
+    aov = adjusted.set_index("metric").loc["avg_order_value"]
+    assert aov["test_type"] == "cuped_t-test" and aov["variance_reduction"] > 0.5
+
+def test_no_covariate_columns_raises_clear_error(make_users):
+    users = make_users().drop(columns=["pre_purchased", "pre_avg_order_value"])
+    with pytest.raises(ValueError, match="covariate"):
+        StatisticalAnalyzer(None, users).analyze_all_metrics(covariates=True)
+
+def _fills():
+    start = pd.Timestamp("2023-06-01")
+    rows = []
+    for patient, interval in [(1, 30), (2, 45), (3, 60)]:
+        # 实验前按各自间隔取药, 实验开始后所有人都按时取药
+        for day in range(0, 150, interval):
+            rows.append((patient, start - pd.Timedelta(days=150 - day)))
+        for day in range(0, 120, 30):
+            rows.append((patient, start + pd.Timedelta(days=day)))
+    df = pd.DataFrame(rows, columns=["patient_id", "transaction_date"])
+    df["drug_name"] = "metformin"
+    df["amount"] = 10.0
+    df["expected_interval_days"] = 30
+    return df, start
+
+def test_pre_adherence_uses_only_pre_period_fills():
+    fills, start = _fills()
+    covariates = build_pre_period_covariates(fills, start, adherence=True)
+
+    pre = fills[fills["transaction_date"] < start]
+    expected = patient_adherence(compute_pdc(pre, period_end=start - pd.Timedelta(days=1)))["pdc"]
+    assert np.allclose(covariates["pre_adherence_score"].sort_index(), expected.sort_index())
+    assert covariates.loc[1, "pre_adherence_score"] > covariates.loc[3, "pre_adherence_score"]
+
+    # 实验期间的取药不影响协变量; 按患者排列的分块输入结果相同
+    later = fills.assign(transaction_date=fills["transaction_date"].where(
+        fills["transaction_date"] < start, fills["transaction_date"] + pd.Timedelta(days=5)))
+    chunks = [later.iloc[:7], later.iloc[7:]]
+    chunked = build_pre_period_covariates(iter(chunks), start, adherence=True)
+    pd.testing.assert_frame_equal(chunked.sort_index(), covariates.sort_index())
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from data_generator import generate_patients, generate_transactions, generate_prescriptions, generate_adherence
+
+def _corr(a, b):
+    return abs(np.corrcoef(np.asarray(a, dtype=float), np.asarray(b, dtype=float))[0, 1])
+
+def test_default_seeded_tables_are_independent():
+    patients = generate_patients(20000, include_pii=False)
+    transactions = generate_transactions(patients)
+    adherence = generate_adherence(patients, None)
+
+    # 各表使用由种子派生的独立随机流, 交易次数、反馈评分都与年龄无关
+    n_transactions = transactions.groupby("patient_id").size().reindex(patients["patient_id"])
+    assert _corr(patients["age"], n_transactions) < 0.05
+    assert _corr(patients["age"], adherence["feedback_score"]) < 0.05
+    # 刻意设计的依赖 (年龄影响依从率) 保留
+    assert _corr(patients["age"], adherence["adherence_score"]) > 0.1
+
+def test_patients_reproducible_from_seed():
+    patients = generate_patients(5000, include_pii=False)
+    pd.testing.assert_frame_equal(generate_patients(5000, include_pii=False), patients)
+    pd.testing.assert_frame_equal(generate_patients(5000, seed=7, include_pii=False),
+                                  generate_patients(5000, seed=7, include_pii=False))
+    assert not generate_patients(5000, seed=7, include_pii=False)["age"].equals(patients["age"])
+
+def test_transactions_and_prescriptions_reproducible_and_independent():
+    patients = generate_patients(20000, include_pii=False)
+    transactions = generate_transactions(patients)
+    prescriptions = generate_prescriptions(transactions)
+    pd.testing.assert_frame_equal(generate_transactions(patients), transactions)
+    pd.testing.assert_frame_equal(generate_prescriptions(transactions), prescriptions)
+    other = generate_transactions(patients, seed=7)
+    assert not other["unit_price"].equals(transactions["unit_price"])
+    pd.testing.assert_frame_equal(generate_transactions(patients, seed=7), other)
+
+    # 与患者表 (首个随机数即年龄) 无关: 逐患者的首笔交易与首张处方
+    age = patients.set_index("patient_id")["age"]
+    first_tx = transactions.groupby("patient_id").first()
+    assert _corr(age.loc[first_tx.index], first_tx["quantity"]) < 0.05
+    first_rx = prescriptions.groupby("patient_id").first()
+    ratio = first_rx["actual_interval_days"] / first_rx["expected_interval_days"]
+    assert _corr(age.loc[first_rx.index], ratio) < 0.05
+    # 按行位置比较随机抽样: 与患者表共用随机流时两者逐行对应
+    k = min(len(patients), len(prescriptions))
+    free = ~prescriptions["drug_name"].astype(str).isin(["Insulin", "Inhalers"]).to_numpy()[:k]
+    assert _corr(patients["age"].to_numpy()[:k][free],
+                 prescriptions["expected_interval_days"].to_numpy()[:k][free]) < 0.05
@@ -0,0 +1,33 @@
+import numpy as np
+from experiment_frame import ExperimentFrame
+from statistical_analysis import compute_group_stats
+
+def test_group_stats_use_precomputed_group_codes(make_users):
+    users = make_users()
+    frame = ExperimentFrame(users)
+    expected = compute_group_stats(users, ["converted_user", "avg_order_value"], by=("group", "is_chronic"))
+    result = compute_group_stats(frame, ["converted_user", "avg_order_value"], by=("group", "is_chronic"),
+                                 chunk_size=3000)
+    assert list(result.index) == list(expected.index)
+    assert np.allclose(result.to_numpy(), expected.to_numpy(), rtol=1e-6)
+
+def test_take_reuses_group_codes(make_users):
+    users = make_users()
+    frame = ExperimentFrame(users)
+    positions = np.flatnonzero(users["experiment_name"] == "e1")
+    subset = frame.take(positions)
+    for group in ["control", "treatment"]:
+        expected = np.flatnonzero(users.iloc[positions]["group"].to_numpy() == group)
+        assert np.array_equal(subset.group_indices[group], expected)
+
+def test_compact_frame_is_smaller(make_users):
+    users = make_users()
+    assert ExperimentFrame(users).memory_usage() < ExperimentFrame.wrap(users).memory_usage()
+
+def test_float32_only_when_rounding_is_small_relative_to_spread(make_users):
+    users = make_users()
+    # 集中在大数附近的列: float32 舍入误差与标准差同量级, 保留 float64
+    users["timestamp"] = 1.7e9 + np.random.default_rng(0).random(len(users))
+    dtypes = ExperimentFrame(users).df.dtypes
+    assert dtypes["avg_order_value"] == np.float32
+    assert dtypes["timestamp"] == np.float64
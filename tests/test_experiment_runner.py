@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+from config import AB_TEST_CONFIG
+from statistical_analysis import StatisticalAnalyzer
+from business_report import BusinessReportGenerator
+from experiment_runner import ExperimentRunner
+
+CONFIGS = [{"experiment_name": "e1"}, {"experiment_name": "e2", "significance_level": 0.01}]
+
+def _inputs(make_users, make_metrics):
+    users = make_users(20000)
+    metrics = make_metrics(2000)
+    metrics["experiment_name"] = ["e1", "e2"] * (len(metrics) // 2)
+    return metrics, users
+
+def _serial_reports(metrics, users):
+    """不经过压缩表示与进程池, 逐个实验筛选原始数据后分析并生成报告"""
+    reports = []
+    for config in CONFIGS:
+        config = {**AB_TEST_CONFIG, **config}
+        name = config["experiment_name"]
+        metrics_rows = metrics[metrics["experiment_name"] == name]
+        results = StatisticalAnalyzer(metrics_rows, users[users["experiment_name"] == name],
+                                      config=config).analyze_all_metrics()
+        report = BusinessReportGenerator(metrics_rows, results, config).generate_report_dataframe()
+        report.insert(0, "experiment_name", name)
+        reports.append(report)
+    return pd.concat(reports, ignore_index=True)
+
+def test_runner_matches_serial_run(make_users, make_metrics):
+    metrics, users = _inputs(make_users, make_metrics)
+    parallel = ExperimentRunner(CONFIGS, metrics, users, processes=2).run()
+    single = ExperimentRunner(CONFIGS, metrics, users, processes=1).run()
+    assert list(parallel["experiment_name"].unique()) == ["e1", "e2"]
+    pd.testing.assert_frame_equal(parallel, single)
+    # 压缩表示中的 float32 指标列只带来舍入级别的差异
+    pd.testing.assert_frame_equal(parallel, _serial_reports(metrics, users), rtol=1e-5)
+
+def test_runner_from_csv(tmp_path, make_users, make_metrics):
+    metrics, users = _inputs(make_users, make_metrics)
+    metrics_path, users_path = str(tmp_path / "metrics.csv"), str(tmp_path / "users.csv")
+    metrics.to_csv(metrics_path, index=False)
+    users.to_csv(users_path, index=False)
+    from_csv = ExperimentRunner.from_csv(CONFIGS, metrics_path, users_path, processes=2).run()
+    pd.testing.assert_frame_equal(from_csv, ExperimentRunner(CONFIGS, metrics, users, processes=1).run(),
+                                  rtol=1e-5)
+
+def test_duplicate_experiment_names_rejected(make_users, make_metrics):
+    metrics, users = _inputs(make_users, make_metrics)
+    with pytest.raises(ValueError, match="unique"):
+        ExperimentRunner([{"experiment_name": "e1"}] * 2, metrics, users)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+from statistical_analysis import StatisticalAnalyzer
+from incremental_analysis import IncrementalAnalyzer
+
+def _daily(users, n_days=4):
+    return [users.iloc[rows] for rows in np.array_split(np.arange(len(users)), n_days)]
+
+def _assert_same_results(left, right):
+    pd.testing.assert_frame_equal(left.drop(columns="p_value"), right.drop(columns="p_value"), rtol=1e-9)
+    assert np.allclose(left["p_value"], right["p_value"], rtol=1e-7, atol=1e-300)
+
+def test_incremental_matches_one_shot_analysis(make_users):
+    users = make_users(30000)
+    analyzer = IncrementalAnalyzer()
+    for day, batch in enumerate(_daily(users)):
+        results = analyzer.ingest(batch, batch_id=f"day-{day}")
+    _assert_same_results(results, StatisticalAnalyzer(None, users).analyze_all_metrics())
+
+def test_duplicate_batch_is_skipped_with_warning(make_users):
+    users = make_users(10000)
+    analyzer = IncrementalAnalyzer()
+    first = analyzer.ingest(users, batch_id="day-0")
+    with pytest.warns(UserWarning, match="already ingested"):
+        again = analyzer.ingest(users, batch_id="day-0")
+    pd.testing.assert_frame_equal(again, first)
+    assert analyzer.ingested_batches == ["day-0"]
+
+def test_checkpoint_save_and_restore(tmp_path, make_users):
+    users = make_users(30000)
+    days = _daily(users)
+    path = str(tmp_path / "state.json")
+
+    first = IncrementalAnalyzer(checkpoint_path=path)
+    for day, batch in enumerate(days[:2]):
+        first.ingest(batch, batch_id=day)
+
+    # 重启后从检查点恢复, 继续摄入剩余批次
+    resumed = IncrementalAnalyzer(checkpoint_path=path)
+    assert resumed.ingested_batches == [0, 1]
+    _assert_same_results(resumed.results(), first.results())
+    for day, batch in enumerate(days[2:], start=2):
+        results = resumed.ingest(batch, batch_id=day)
+    _assert_same_results(results, StatisticalAnalyzer(None, users).analyze_all_metrics())
+
+def test_restore_rejects_other_experiment(tmp_path, make_users):
+    path = str(tmp_path / "state.json")
+    IncrementalAnalyzer(checkpoint_path=path).ingest(make_users(2000), batch_id=0)
+    with pytest.raises(ValueError, match="belongs to experiment"):
+        IncrementalAnalyzer(checkpoint_path=path, config={"experiment_name": "other"})
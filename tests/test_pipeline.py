@@ -0,0 +1,24 @@
+import pipeline
+from pipeline import Stage, module_closure, build_default_pipeline
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+
+def test_stage_code_includes_transitive_imports(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "SRC_DIR", str(tmp_path))
+    _write(tmp_path / "entry.py", "import numpy as np\nfrom helper import f\n")
+    _write(tmp_path / "helper.py", "def f():\n    from lazy import g\n    return g()\n")
+    _write(tmp_path / "lazy.py", "def g():\n    return 1\n")
+    assert module_closure(["entry.py"]) == ["entry.py", "helper.py", "lazy.py"]
+
+    stage = Stage("s", lambda out_dir, deps: None, code=["entry.py"])
+    key = stage.cache_key({})
+    _write(tmp_path / "lazy.py", "def g():\n    return 2\n")
+    assert stage.cache_key({}) != key
+
+def test_analyze_stage_covers_imported_modules_and_allocation():
+    stages = build_default_pipeline("users.csv", "metrics.csv").stages
+    analyze = stages["analyze"]
+    for module in ["assignment.py", "cuped.py", "tracing.py", "bootstrap.py", "experiment_frame.py"]:
+        assert module in analyze.code
+    assert "traffic_allocation" in analyze.config
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from statsmodels.stats.power import NormalIndPower
+from statsmodels.stats.proportion import power_proportions_2indep
+from power_analysis import (
+    power_proportions, power_means, sample_size_proportions, sample_size_means,
+    simulate_power_proportions, simulate_power_means, PowerPlanner
+)
+
+SCENARIOS = [(0.10, 0.05, 20000, 0.5), (0.10, 0.10, 8000, 0.3), (0.03, -0.15, 50000, 0.5), (0.2, 0.02, 5000, 0.8)]
+
+@pytest.mark.parametrize("rate, effect, n_total, allocation", SCENARIOS)
+def test_power_proportions_matches_statsmodels(rate, effect, n_total, allocation):
+    n_treatment, n_control = n_total * allocation, n_total * (1 - allocation)
+    expected = power_proportions_2indep(rate * effect, rate, n_treatment, ratio=n_control / n_treatment,
+                                        alpha=0.05).power
+    assert power_proportions(rate, effect, n_total, allocation) == pytest.approx(expected, rel=1e-6)
+
+    # 所需样本量下功效恰好达到目标
+    required = sample_size_proportions(rate, effect, allocation, power=0.8)
+    assert power_proportions(rate, effect, required, allocation) == pytest.approx(0.8, abs=1e-3)
+
+@pytest.mark.parametrize("effect, n_total, allocation", [(0.02, 20000, 0.5), (0.05, 3000, 0.3), (-0.01, 80000, 0.6)])
+def test_power_means_matches_statsmodels(effect, n_total, allocation):
+    mean, sd = 60.0, 35.0
+    n_treatment, n_control = n_total * allocation, n_total * (1 - allocation)
+    solver = NormalIndPower()
+    expected = solver.power(mean * effect / sd, n_control, alpha=0.05, ratio=n_treatment / n_control)
+    assert power_means(mean, sd, effect, n_total, allocation) == pytest.approx(expected, rel=1e-9)
+
+    nobs_control = solver.solve_power(abs(mean * effect / sd), nobs1=None, alpha=0.05, power=0.8,
+                                      ratio=allocation / (1 - allocation))
+    required = sample_size_means(mean, sd, effect, allocation)
+    assert abs(required - nobs_control / (1 - allocation)) <= 2
+
+def _assert_within_monte_carlo_error(simulated, analytic, n_sims):
+    se = np.sqrt(analytic * (1 - analytic) / n_sims)
+    assert np.all(np.abs(simulated - analytic) <= 4 * se + 0.005)
+
+def test_simulated_power_within_monte_carlo_error():
+    n_sims = 4000
+    rate, effect, n_total, allocation = (np.array(x, dtype=float) for x in zip(*SCENARIOS))
+    n_treatment, n_control = n_total * allocation, n_total * (1 - allocation)
+    simulated = simulate_power_proportions(rate, effect, n_control, n_treatment, n_sims=n_sims, seed=1)
+    _assert_within_monte_carlo_error(simulated, power_proportions(rate, effect, n_total, allocation), n_sims)
+
+    effect = np.array([0.0, 0.01, 0.02, 0.04])
+    simulated = simulate_power_means(60.0, 35.0, effect, 10000, 10000, n_sims=n_sims, seed=2)
+    _assert_within_monte_carlo_error(simulated, power_means(60.0, 35.0, effect, 20000), n_sims)
+
+def test_planner_grid_simulation_agrees_with_analytic():
+    planner = PowerPlanner()
+    grid = planner.grid(effects=[0.1, 0.2], allocations=[0.5], durations=[7, 14], n_sims=4000, seed=3)
+    _assert_within_monte_carlo_error(grid["power_simulated"].to_numpy(), grid["power_analytic"].to_numpy(), 4000)
+    daily_users = planner.planning["daily_users"]
+    assert (grid["n_control"] + grid["n_treatment"] == grid["duration_days"] * daily_users).all()
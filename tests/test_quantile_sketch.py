@@ -0,0 +1,111 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from quantile_sketch import (
+    QuantileSketch, compute_group_sketches, merge_sketch_tables, sketches_to_records, sketches_from_records
+)
+from sharded_analysis import ShardedAnalyzer
+from incremental_analysis import IncrementalAnalyzer
+
+QUANTILES = np.array([0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99])
+
+def _assert_same_sketches(left, right):
+    assert list(left.index) == list(right.index)
+    assert list(left.columns) == list(right.columns)
+    for a, b in zip(left.to_numpy().ravel(), right.to_numpy().ravel()):
+        assert np.array_equal(a.counts, b.counts)
+        assert a.count == b.count
+        # CSV 往返可能改变末位精度, 极值与总和按近似比较
+        assert np.allclose([a.min, a.max, a.sum], [b.min, b.max, b.sum])
+
+def test_quantiles_within_relative_accuracy():
+    rng = np.random.default_rng(1)
+    samples = [rng.lognormal(4, 1, 100000), rng.normal(0, 50, 100000), rng.exponential(30, 100000),
+               rng.lognormal(4, 1, 50), rng.integers(1, 20, 100000).astype(float)]
+    for values in samples:
+        sketch = QuantileSketch().add(values)
+        estimate = sketch.quantile(QUANTILES)
+        # 保证针对秩 floor(q(n-1)) 的次序统计量成立
+        exact = np.quantile(values, QUANTILES, method="lower")
+        away_from_zero = np.abs(exact) > sketch.zero_threshold
+        error = np.abs(estimate - exact)[away_from_zero] / np.abs(exact[away_from_zero])
+        assert error.max() <= sketch.relative_accuracy + 1e-12
+
+    # 大样本连续分布上与 np.quantile 的默认 (线性插值) 结果同样在相对误差以内
+    values = samples[0]
+    estimate = QuantileSketch().add(values).quantile(QUANTILES)
+    assert np.all(np.abs(estimate / np.quantile(values, QUANTILES) - 1) <= 0.01)
+
+def test_merge_matches_single_build():
+    values = np.random.default_rng(2).lognormal(3, 1.5, 50000)
+    whole = QuantileSketch().add(values)
+    merged = QuantileSketch()
+    for part in np.array_split(values, 7):
+        merged = merged.merge(QuantileSketch().add(part))
+    assert np.array_equal(merged.counts, whole.counts)
+    assert (merged.count, merged.min, merged.max) == (whole.count, whole.min, whole.max)
+    assert np.array_equal(merged.quantile(QUANTILES), whole.quantile(QUANTILES))
+
+def test_fixed_size_store_keeps_accuracy_below_the_maximum():
+    rng = np.random.default_rng(3)
+    # 跨越12个数量级: 每侧只保留最大绝对值以下 gamma^1023 倍的范围, 更小的并入零桶
+    values = np.concatenate([10 ** rng.uniform(-3, 9, 100000), -rng.lognormal(2, 1, 1000)])
+    sketch = QuantileSketch().add(values)
+    assert sketch.nbytes <= 8192 and sketch.shift > 0
+    assert sketch.zero_threshold == pytest.approx(values.max() / 1.01 ** 1022, rel=0.02)
+
+    exact = np.quantile(values, QUANTILES, method="lower")
+    estimate = sketch.quantile(QUANTILES)
+    kept = np.abs(exact) > sketch.zero_threshold
+    # 最大值 1e9 以下约2.6万倍 (约 4e4) 以内的分位数保持精度, 中位数 (约1e3) 及以下并入零桶
+    assert kept[QUANTILES >= 0.75].all() and not kept[QUANTILES <= 0.5].any()
+    assert np.all(np.abs(estimate - exact)[kept] / np.abs(exact[kept]) <= sketch.relative_accuracy + 1e-12)
+    assert np.all(estimate[~kept] == 0)
+
+def test_merge_aligns_different_shifts():
+    rng = np.random.default_rng(4)
+    parts = [rng.lognormal(0, 1, 5000), -rng.lognormal(3, 1, 5000), rng.lognormal(12, 2, 5000)]
+    whole = QuantileSketch().add(np.concatenate(parts))
+    sketches = [QuantileSketch().add(part) for part in parts]
+    assert len({sketch.shift for sketch in sketches}) == 3
+    for order in [(0, 1, 2), (2, 1, 0), (1, 2, 0)]:
+        merged = sketches[order[0]] + sketches[order[1]] + sketches[order[2]]
+        assert merged.shift == whole.shift
+        assert np.array_equal(merged.counts, whole.counts)
+    restored = QuantileSketch.from_dict(json.loads(json.dumps(whole.to_dict())))
+    assert restored.shift == whole.shift and np.array_equal(restored.counts, whole.counts)
+
+def test_chunked_sharded_and_incremental_builds_agree(tmp_path, make_users):
+    users = make_users(40000)
+    by = ("group", "is_chronic")
+    whole = compute_group_sketches(users, ["avg_order_value"], by=by)
+
+    chunked = compute_group_sketches(users, ["avg_order_value"], by=by, chunk_size=3000)
+    _assert_same_sketches(chunked, whole)
+
+    path = str(tmp_path / "users.csv")
+    users.to_csv(path, index=False)
+    sharded = ShardedAnalyzer([path], rows_per_shard=9000, processes=1, chunk_size=4000).group_sketches()
+    _assert_same_sketches(sharded.sort_index(), whole.sort_index())
+
+    analyzer = IncrementalAnalyzer()
+    for day, batch in enumerate(np.array_split(np.arange(len(users)), 5)):
+        analyzer.ingest(users.iloc[batch], batch_id=day)
+    _assert_same_sketches(analyzer.sketches.sort_index(), whole.sort_index())
+
+def test_checkpoint_round_trip(tmp_path, make_users):
+    users = make_users(40000)
+    sketches = compute_group_sketches(users, ["avg_order_value"], by=("group", "is_chronic"))
+    records = json.loads(json.dumps(sketches_to_records(sketches)))
+    restored = sketches_from_records(records, ["group", "is_chronic"])
+    _assert_same_sketches(restored.sort_index(), sketches.sort_index())
+    assert merge_sketch_tables(restored, sketches)["avg_order_value"].map(lambda s: s.count).equals(
+        sketches["avg_order_value"].map(lambda s: 2 * s.count))
+
+    path = str(tmp_path / "checkpoint.json")
+    first = IncrementalAnalyzer(checkpoint_path=path)
+    first.ingest(users.iloc[:20000], batch_id="d1")
+    resumed = IncrementalAnalyzer(checkpoint_path=path)
+    _assert_same_sketches(resumed.sketches, first.sketches)
+    pd.testing.assert_frame_equal(resumed.quantile_results(), first.quantile_results())
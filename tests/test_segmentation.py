@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from scipy import stats
+from statsmodels.stats.proportion import proportions_ztest
+from statsmodels.stats.multitest import multipletests
+from segmentation import SegmentAnalyzer
+
+def _segmented_users(make_users, n=30000):
+    users = make_users(n)
+    rng = np.random.default_rng(11)
+    users["region"] = rng.choice(["north", "south", "east", "west"], n)
+    users["age_band"] = rng.choice(["18-39", "40-64", "65+"], n)
+    return users
+
+def test_segment_matches_brute_force_tests(make_users):
+    users = _segmented_users(make_users)
+    results = SegmentAnalyzer(users, ["region", "age_band"]).analyze()
+
+    subset = users[users["region"] == "south"]
+    control, treatment = (subset[subset["group"] == g] for g in ("control", "treatment"))
+    rows = results[(results["segment_col"] == "region") & (results["segment_value"] == "south")].set_index("metric")
+
+    _, pval = proportions_ztest([treatment["converted_user"].sum(), control["converted_user"].sum()],
+                                [len(treatment), len(control)])
+    assert rows.loc["conversion_rate", "p_value"] == pytest.approx(pval, rel=1e-9)
+    for metric in ["avg_order_value", "bounce_rate", "adherence"]:
+        expected = stats.ttest_ind(treatment[metric], control[metric], equal_var=False).pvalue
+        assert rows.loc[metric, "p_value"] == pytest.approx(expected, rel=1e-7)
+        assert rows.loc[metric, "control_value"] == pytest.approx(control[metric].mean(), rel=1e-9)
+        assert rows.loc[metric, "n_treatment"] == len(treatment)
+
+@pytest.mark.parametrize("correction", ["fdr_bh", "bonferroni", "holm"])
+def test_adjust_matches_multipletests(make_users, correction):
+    users = _segmented_users(make_users)
+    # 只有对照组的细分取值: p值缺失, 不参与校正
+    users.loc[(users["region"] == "west") & (users["group"] == "treatment"), "region"] = "north"
+    users.loc[users.index[:50], "region"] = "islands"
+    users.loc[users.index[:50], "group"] = "control"
+    results = SegmentAnalyzer(users, ["region", "age_band"], correction=correction).analyze()
+
+    missing = results["p_value"].isna()
+    assert missing.any() and results.loc[missing, "p_adjusted"].isna().all()
+    reject, expected, _, _ = multipletests(results.loc[~missing, "p_value"], alpha=0.05, method=correction)
+    assert np.allclose(results.loc[~missing, "p_adjusted"], expected)
+    assert np.array_equal(results.loc[~missing, "significant"], reject)
+    assert not results.loc[missing, "significant"].any()
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from statistical_analysis import StatisticalAnalyzer
+from sharded_analysis import ShardedAnalyzer, plan_shards
+from storage import write_dataset
+
+def _assert_same_results(left, right):
+    pd.testing.assert_frame_equal(left.drop(columns="p_value"), right.drop(columns="p_value"), rtol=1e-9)
+    assert np.allclose(left["p_value"], right["p_value"], rtol=1e-7, atol=1e-300)
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_sharded_csv_matches_single_process(tmp_path, make_users, processes):
+    users = make_users(10007)
+    path = str(tmp_path / "users.csv")
+    users.to_csv(path, index=False)
+    # 3000 行一片: 最后一片只有 1007 行, 分片边界落在文件中间
+    analyzer = ShardedAnalyzer([path], rows_per_shard=3000, processes=processes)
+    assert [nrows for _, _, nrows, _ in analyzer.shards] == [3000, 3000, 3000, 1007]
+    expected = StatisticalAnalyzer(None, pd.read_csv(path)).analyze_all_metrics()
+    _assert_same_results(analyzer.analyze_all_metrics(), expected)
+
+def test_sharded_csv_without_trailing_newline(tmp_path, make_users):
+    users = make_users(5000)
+    path = str(tmp_path / "users.csv")
+    with open(path, "w") as f:
+        f.write(users.to_csv(index=False).rstrip("\n"))
+    analyzer = ShardedAnalyzer([path], rows_per_shard=1500)
+    expected = StatisticalAnalyzer(None, pd.read_csv(path)).analyze_all_metrics()
+    _assert_same_results(analyzer.analyze_all_metrics(), expected)
+
+def test_sharded_partitioned_directories(tmp_path, make_users):
+    users = make_users(8000)
+    expected = StatisticalAnalyzer(None, users).analyze_all_metrics()
+
+    # Hive式分区: group 列只存在于目录名中
+    parquet_dir = str(tmp_path / "parquet")
+    write_dataset(users, parquet_dir, partition_cols=["group"])
+    _assert_same_results(ShardedAnalyzer([parquet_dir], processes=2).analyze_all_metrics(), expected)
+
+    csv_dir = tmp_path / "csv"
+    csv_dir.mkdir()
+    for i, rows in enumerate(np.array_split(np.arange(len(users)), 3)):
+        users.iloc[rows].to_csv(csv_dir / f"part-{i:05d}.csv", index=False)
+    analyzer = ShardedAnalyzer([str(csv_dir)], rows_per_shard=1000)
+    assert len(analyzer.shards) == 9
+    _assert_same_results(analyzer.analyze_all_metrics(), expected)
+
+def test_empty_csv_raises_clear_error(tmp_path, make_users):
+    path = str(tmp_path / "empty.csv")
+    make_users(10).iloc[:0].to_csv(path, index=False)
+    assert plan_shards([path], rows_per_shard=100) == []
+    with pytest.raises(ValueError, match="No data rows"):
+        ShardedAnalyzer([path], rows_per_shard=100).analyze_all_metrics()
+    with pytest.raises(ValueError, match="No data rows"):
+        ShardedAnalyzer([path]).analyze_all_metrics()
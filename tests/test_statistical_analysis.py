@@ -0,0 +1,38 @@
+import numpy as np
+from scipy import stats
+from statsmodels.stats.proportion import proportions_ztest
+from statistical_analysis import StatisticalAnalyzer, compute_group_stats, default_chunk_size, MIN_CHUNK_ROWS
+
+def _arms(users, col, chronic_only=False):
+    subset = users[users["is_chronic"]] if chronic_only else users
+    return [subset.loc[subset["group"] == g, col].to_numpy(dtype=float) for g in ("control", "treatment")]
+
+def test_results_match_scipy_and_statsmodels(make_users):
+    users = make_users(30000)
+    results = StatisticalAnalyzer(None, users).analyze_all_metrics()
+    assert list(results["metric"]) == ["conversion_rate", "avg_order_value", "bounce_rate",
+                                       "adherence", "conversion_rate"]
+
+    for row, (col, chronic_only) in zip(results.itertuples(), [
+            ("converted_user", False), ("avg_order_value", False), ("bounce_rate", False),
+            ("adherence", True), ("converted_user", True)]):
+        control, treatment = _arms(users, col, chronic_only)
+        if col == "converted_user":
+            _, expected = proportions_ztest([control.sum(), treatment.sum()], [len(control), len(treatment)])
+        else:
+            expected = stats.ttest_ind(control, treatment, equal_var=False).pvalue
+        assert np.isclose(row.p_value, expected, rtol=1e-9, atol=1e-300)
+        assert np.isclose(row.control_value, control.mean())
+        assert np.isclose(row.treatment_value, treatment.mean())
+
+def test_default_chunking_is_bounded_and_exact(make_users):
+    users = make_users(30000)
+    cols = ["converted_user", "avg_order_value", "adherence"]
+    assert default_chunk_size(len(cols)) < 50_000_000
+    assert default_chunk_size(10 ** 6) == MIN_CHUNK_ROWS
+
+    whole = compute_group_stats(users, cols, by=("group", "is_chronic"), chunk_size=len(users))
+    chunked = compute_group_stats(users, cols, by=("group", "is_chronic"), chunk_size=7000)
+    default = compute_group_stats(users, cols, by=("group", "is_chronic"))
+    for result in (chunked, default):
+        assert np.allclose(result.to_numpy(), whole.to_numpy(), rtol=1e-12)
@@ -0,0 +1,33 @@
+import datetime
+import numpy as np
+import pandas as pd
+from storage import read_table, import_csv
+
+def test_csv_fallback_filters_on_dates(tmp_path, make_users):
+    df = make_users()
+    path = str(tmp_path / "users.csv")
+    df.to_csv(path, index=False)
+    start = pd.Timestamp("2023-02-01")
+    expected = ((df["date"] >= start) & (df["group"] == "control")).sum()
+
+    for value in (start, start.date(), np.datetime64("2023-02-01")):
+        result = read_table(path, columns=["user_id", "avg_order_value"],
+                            filters=[("date", ">=", value), ("group", "==", "control")])
+        assert len(result) == expected
+        assert list(result.columns) == ["user_id", "avg_order_value"]
+
+    result = read_table(path, filters=[("date", "in", [datetime.date(2023, 2, 1)])])
+    assert len(result) == (df["date"] == start).sum()
+
+def test_import_csv_preserves_row_order(tmp_path, make_users):
+    df = make_users()
+    csv_path = str(tmp_path / "users.csv")
+    df.to_csv(csv_path, index=False)
+
+    flat = read_table(import_csv(csv_path, str(tmp_path / "flat"), parse_dates=["date"], chunksize=3000))
+    assert np.array_equal(flat["user_id"].to_numpy(), df["user_id"].to_numpy())
+
+    partitioned = read_table(import_csv(csv_path, str(tmp_path / "by_group"), partition_cols=["group"],
+                                        chunksize=3000))
+    for _, part in partitioned.groupby("group", observed=True):
+        assert np.all(np.diff(part["user_id"].to_numpy()) > 0)
@@ -0,0 +1,61 @@
+import os
+import json
+import pandas as pd
+import pytest
+import tracing
+from tracing import span, traced
+from sharded_analysis import ShardedAnalyzer
+
+@pytest.fixture
+def tracing_on():
+    tracing.reset()
+    tracing.enable()
+    yield
+    tracing.disable()
+    tracing.reset()
+
+@traced("double")
+def _double(df):
+    return pd.concat([df, df])
+
+def test_nested_spans_record_parent_and_rows(tracing_on):
+    with span("outer", stage="test") as s:
+        _double(pd.DataFrame({"x": range(5)}))
+        s.set(rows=5)
+    inner, outer = tracing.get_spans()
+    assert (inner["name"], inner["parent"], inner["depth"]) == ("double", "outer", 1)
+    assert inner["attrs"] == {"rows_in": 5, "rows_out": 10}
+    assert (outer["name"], outer["parent"], outer["depth"]) == ("outer", None, 0)
+    assert outer["attrs"] == {"stage": "test", "rows": 5}
+    assert outer["duration_ms"] >= inner["duration_ms"]
+
+def test_disabled_tracing_records_nothing():
+    tracing.reset()
+    with span("ignored"):
+        _double(pd.DataFrame({"x": [1]}))
+    assert tracing.get_spans() == []
+
+def test_export_chrome_trace(tmp_path, tracing_on):
+    with span("outer"):
+        _double(pd.DataFrame({"x": [1, 2]}))
+    with open(tracing.export_chrome_trace(str(tmp_path / "run.trace.json"))) as f:
+        events = json.load(f)["traceEvents"]
+    assert [e["name"] for e in events] == ["double", "outer"]
+    assert all(e["ph"] == "X" and e["pid"] == os.getpid() for e in events)
+    assert events[0]["args"]["rows_out"] == 4
+    assert events[1]["ts"] <= events[0]["ts"] and events[0]["dur"] <= events[1]["dur"]
+
+def test_worker_spans_are_merged_into_parent(tmp_path, tracing_on, make_users):
+    path = str(tmp_path / "users.csv")
+    make_users(6000).to_csv(path, index=False)
+    with span("analyze"):
+        ShardedAnalyzer([path], rows_per_shard=2000, processes=2).analyze_all_metrics()
+
+    spans = tracing.get_spans()
+    workers = [s for s in spans if s["name"] == "_shard_worker"]
+    assert len(workers) == 3
+    assert all(s["pid"] != os.getpid() and s["parent"] == "analyze" and s["depth"] == 1 for s in workers)
+    # 工作进程内部的span保留原有的嵌套关系
+    nested = [s for s in spans if s["parent"] == "_shard_worker"]
+    assert nested and all(s["depth"] == 2 for s in nested)
+    assert len(tracing.summary()) == len({s["name"] for s in spans})
@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import stats
+import visualization
+from visualization import ABTestVisualizer
+
+def _results(metrics):
+    return pd.DataFrame({"metric": metrics, "lift": 0.05, "p_value": 0.01, "significant": True})
+
+def test_group_aggregates_match_raw_groupby(make_metrics):
+    metrics_df = make_metrics(5000)
+    metrics_df.loc[metrics_df.index[::97], "total_revenue"] = np.nan
+    visualizer = ABTestVisualizer(metrics_df, _results(["conversion_rate", "total_revenue"]))
+    z = stats.norm.ppf(0.975)
+    for metric in ["conversion_rate", "total_revenue"]:
+        expected = metrics_df.groupby("group")[metric].agg(["count", "mean", "sem"])
+        aggregates = visualizer.group_aggregates(metric).set_index("group")
+        assert list(aggregates.index) == list(expected.index)
+        assert np.array_equal(aggregates["n"], expected["count"])
+        assert np.allclose(aggregates["mean"], expected["mean"], rtol=1e-12)
+        assert np.allclose(aggregates["ci_lower"], expected["mean"] - z * expected["sem"], rtol=1e-12)
+        assert np.allclose(aggregates["ci_upper"], expected["mean"] + z * expected["sem"], rtol=1e-12)
+
+def test_daily_aggregates_match_raw_groupby(make_metrics):
+    metrics_df = make_metrics(5000)
+    visualizer = ABTestVisualizer(metrics_df, _results(["conversion_rate"]))
+    for metric in ["conversion_rate", "conversions", "total_revenue"]:
+        expected = metrics_df.groupby(["date", "group"])[metric].mean().reset_index()
+        pd.testing.assert_frame_equal(visualizer.daily_aggregates(metrics_df, metric).reset_index(drop=True),
+                                      expected)
+
+    # 缓存按数据框对象区分, 另一份数据不会命中旧结果
+    other = make_metrics(5000, seed=1)
+    pd.testing.assert_frame_equal(visualizer.daily_aggregates(other, "total_revenue").reset_index(drop=True),
+                                  other.groupby(["date", "group"])["total_revenue"].mean().reset_index())
+
+def test_aggregated_chart_path_above_threshold(tmp_path, monkeypatch, make_metrics):
+    metrics_df = make_metrics(5000)
+    visualizer = ABTestVisualizer(metrics_df, _results(["conversion_rate", "total_revenue"]))
+    monkeypatch.setattr(visualization, "AGGREGATE_THRESHOLD", 1000)
+    ax = visualizer.plot_metric_comparison("total_revenue")
+    heights = [patch.get_height() for patch in ax.patches]
+    assert np.allclose(heights, metrics_df.groupby("group")["total_revenue"].mean())
+    visualization._pyplot().close("all")
+
+    jobs = visualizer.chart_jobs(str(tmp_path), timeseries_df=metrics_df)
+    comparison = {job[2]["metric"]: job[2]["aggregates"] for job in jobs if job[0] == "metric_comparison"}
+    for metric, aggregates in comparison.items():
+        pd.testing.assert_frame_equal(aggregates, visualizer.group_aggregates(metric))
+        # 任务只携带聚合结果: 每组一行, 与原始行数无关
+        assert len(aggregates) == metrics_df["group"].nunique()
+    paths = visualization.render_charts(jobs, processes=2)
+    assert len(paths) == 6 and all(os.path.getsize(path) > 0 for path in paths)